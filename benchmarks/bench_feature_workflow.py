@@ -0,0 +1,67 @@
+"""
+Cost of the distance and asymmetry features of FeatureExtractor on one sequence: per-frame loop (sklearn's
+pairwise_distances, as before) vs the batched FeatureExtractor._iterative_workflow().
+
+    $ python benchmarks/bench_feature_workflow.py --num-frames 1000
+
+The sequence is random keypoints scaled to [0, 1], as after FeatureExtractor._clipping_rescaling().
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import pairwise_distances
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from common.feature_extraction import FeatureExtractor  # noqa: E402
+from common.keypoints_format import openpose_L_indexes, openpose_R_indexes, openpose_central_indexes  # noqa: E402
+
+
+def iterative_workflow_loop(data):
+    features_all_frames = []
+    upper_tri_indices = np.triu_indices(n=25, k=1)
+    for data_each_frame in data:
+        pair_dist = pairwise_distances(data_each_frame, metric='euclidean')
+        only_relative_dist = pair_dist[upper_tri_indices[0], upper_tri_indices[1]]
+        L_keyps = data_each_frame[openpose_L_indexes, :]
+        R_keyps = data_each_frame[openpose_R_indexes, :]
+        asymmetry = []
+        for anchor in data_each_frame[openpose_central_indexes, :]:
+            L_eu_dist = np.linalg.norm(L_keyps - anchor[np.newaxis], axis=1)
+            R_eu_dist = np.linalg.norm(R_keyps - anchor[np.newaxis], axis=1)
+            asymmetry.append(L_eu_dist / (R_eu_dist + 0.00001))
+        features_all_frames.append(np.append(only_relative_dist, np.array(asymmetry).flatten()))
+    features_all_frames_np = np.array(features_all_frames)
+    return np.append(np.mean(features_all_frames_np, axis=0), np.std(features_all_frames_np, axis=0))
+
+
+def best_time(fn, data, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-frames", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    data = np.random.RandomState(0).uniform(0, 1, size=(args.num_frames, 25, 2))
+    extractor = FeatureExtractor(data_dir="", save_dir="")
+    assert np.allclose(extractor._iterative_workflow(data), iterative_workflow_loop(data), rtol=1e-5, atol=1e-5)
+
+    loop_time = best_time(iterative_workflow_loop, data, args.repeats)
+    batched_time = best_time(extractor._iterative_workflow, data, args.repeats)
+    print("{} frames".format(args.num_frames))
+    print("per-frame loop:       {:8.1f} ms".format(loop_time * 1e3))
+    print("_iterative_workflow:  {:8.1f} ms ({:.1f}x)".format(batched_time * 1e3, loop_time / batched_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Batch construction of GaitGeneratorFromDFforTemporalVAE: per-sample loop over the dataframe cells (as before) vs the
+gather from the concatenated buffers of _loop_for_array_construction(), and the whole iterator().
+
+    $ python benchmarks/bench_generator.py --df-path /path/to/part2_output.npz --m 512
+
+Without --df-path, a synthetic Part-2 output (random keypoints, 140-900 frames per row) is written to a temporary
+directory, as a feature store (--format npz) or a dataframe pickle (--format pickle).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from common.generator import GaitGeneratorFromDFforTemporalVAE  # noqa: E402
+from common.utils import write_df_pickle, write_feature_store  # noqa: E402
+
+
+def write_synthetic_df(store_path, num_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    num_frames = rng.randint(140, 900, size=num_rows)
+    df = pd.DataFrame({"vid_name_roots": ["vid{}".format(i) for i in range(num_rows)]})
+    df["features"] = [rng.uniform(0, 1, size=(n, 25, 2)) for n in num_frames]
+    df["feature_masks"] = [np.repeat(rng.uniform(size=(n, 25, 1)) > 0.1, 2, axis=2) for n in num_frames]
+    df["tasks"], df["task_masks"] = rng.randint(0, 8, size=num_rows), np.arange(num_rows) < num_rows // 6
+    df["phenos"], df["pheno_masks"] = rng.randint(0, 13, size=num_rows), rng.uniform(size=num_rows) > 0.5
+    df["idpatients"] = rng.randint(0, 300, size=num_rows).astype(float)
+    df["towards_camera"] = rng.randint(0, 3, size=num_rows)
+    df["leg"], df["leg_masks"] = rng.uniform(size=num_rows), rng.uniform(size=num_rows) > 0.2
+    df["num_frames"], df["fut_avail_mask"] = num_frames, num_frames > 128 + 32
+    if store_path.endswith(".npz"):
+        write_feature_store(df, store_path)
+    else:
+        write_df_pickle(df, store_path)
+
+
+def loop_windows(data_gen, df, num_samples):
+    fea_vec, fea_mask_vec = list(df["features"].iloc[0:num_samples]), list(df["feature_masks"].iloc[0:num_samples])
+    fut_avail_mask = np.asarray(df["fut_avail_mask"].iloc[0:num_samples], dtype=bool)
+    x_end_idx, y_end_idx = data_gen.keyps_x_dims, data_gen.keyps_x_dims + data_gen.keyps_y_dims
+    features_arr = np.zeros((num_samples, data_gen.total_fea_dims, data_gen.n))
+    fea_masks_arr = np.zeros(features_arr.shape, dtype=bool)
+    fut_features_arr = np.zeros((num_samples, data_gen.total_fea_dims, data_gen.fut_dim))
+    fut_fea_masks_arr = np.zeros(fut_features_arr.shape, dtype=bool)
+    for i in range(num_samples):
+        fut_dim = data_gen.fut_dim if fut_avail_mask[i] else 0
+        slice_start = np.random.choice(fea_vec[i].shape[0] - data_gen.n - fut_dim)
+        windows = [(slice(slice_start, slice_start + data_gen.n), features_arr, fea_masks_arr)]
+        if fut_avail_mask[i]:
+            windows.append((slice(slice_start + data_gen.n, slice_start + data_gen.n + data_gen.fut_dim),
+                            fut_features_arr, fut_fea_masks_arr))
+        for frames, out_features, out_masks in windows:
+            fea_vec_sliced, fea_mask_vec_sliced = fea_vec[i][frames, :, :], fea_mask_vec[i][frames, :, :]
+            out_features[i, 0:x_end_idx, :] = fea_vec_sliced[:, :, 0].T
+            out_features[i, x_end_idx:y_end_idx, :] = fea_vec_sliced[:, :, 1].T
+            out_masks[i, 0:x_end_idx, :] = fea_mask_vec_sliced[:, :, 0].T
+            out_masks[i, x_end_idx:y_end_idx, :] = fea_mask_vec_sliced[:, :, 1].T
+    return features_arr, fea_masks_arr, fut_features_arr, fut_fea_masks_arr
+
+
+def batches_per_second(construct_batch, data_gen, duration):
+    np.random.seed(0)
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < duration:
+        batch_start = (count * data_gen.m) % max(data_gen.num_rows - data_gen.m, 1)
+        construct_batch(data_gen.df_train.iloc[batch_start:batch_start + data_gen.m])
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def iterator_batches_per_second(data_gen, duration):
+    np.random.seed(0)
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for _ in data_gen.iterator():
+            count += 1
+            if time.perf_counter() - start >= duration:
+                break
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--df-path", default=None, help="Part-2 output, feature store (.npz) or dataframe pickle")
+    parser.add_argument("--format", default="npz", choices=["npz", "pickle"], help="Format of the synthetic data")
+    parser.add_argument("--num-rows", type=int, default=3000, help="Number of synthetic rows")
+    parser.add_argument("--m", type=int, default=512, help="Batch size")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of each timing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        df_path = args.df_path
+        if df_path is None:
+            df_path = os.path.join(tmp_dir, "synthetic.{}".format(args.format))
+            write_synthetic_df(df_path, args.num_rows)
+        data_gen = GaitGeneratorFromDFforTemporalVAE(df_path, m=args.m, n=128, seed=0)
+
+        batch_df = data_gen.df_train.iloc[0:data_gen.m]
+        np.random.seed(0)
+        (features, masks), (fut_features, fut_masks, _) = data_gen._loop_for_array_construction(
+            batch_df, batch_df.shape[0])[0:2]
+        np.random.seed(0)
+        windows_ref = loop_windows(data_gen, batch_df, batch_df.shape[0])
+        for arr, arr_ref in zip((features, masks, fut_features, fut_masks), windows_ref):
+            assert np.array_equal(arr, arr_ref)
+
+        loop_rate = batches_per_second(lambda df: loop_windows(data_gen, df, df.shape[0]), data_gen, args.duration)
+        gather_rate = batches_per_second(lambda df: data_gen._loop_for_array_construction(df, df.shape[0]),
+                                         data_gen, args.duration)
+        iterator_rate = iterator_batches_per_second(data_gen, args.duration)
+        num_rows = data_gen.num_rows
+        del data_gen  # Release the memory-mapped buffers before the temporary directory is removed
+    print("{} training rows, m={}, from {}".format(num_rows, args.m, args.df_path or "synthetic data"))
+    print("per-sample loop:               {:6.1f} batches/s".format(loop_rate))
+    print("_loop_for_array_construction:  {:6.1f} batches/s ({:.1f}x)".format(gather_rate, gather_rate / loop_rate))
+    print("iterator():                    {:6.1f} batches/s".format(iterator_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Per-frame cost of reading the body keypoints of OpenPose .json files: json module vs
+common.utils.read_openpose_pose_keypoints().
+
+    $ python benchmarks/bench_openpose_json.py --json-dir /path/to/openpose/output/video_name
+
+Without --json-dir, synthetic BODY_25 frames (with face and hand keypoints, 0-3 people) are written to a temporary
+directory.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from glob import glob
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from common.utils import read_openpose_pose_keypoints  # noqa: E402
+
+
+def json_load_keypoints(json_path):
+    with open(json_path, "r") as fh:
+        people = json.load(fh)["people"]
+    return np.asarray([person["pose_keypoints_2d"] for person in people], dtype=float).reshape(len(people), 25, 3)
+
+
+def write_synthetic_frames(output_dir, num_frames, seed=0):
+    rng = np.random.RandomState(seed)
+
+    def keypoints(num):
+        return [round(x, 6) for x in rng.uniform(0, 1000, size=num * 3).tolist()]
+
+    for frame_idx in range(num_frames):
+        people = [{"person_id": [-1], "pose_keypoints_2d": keypoints(25), "face_keypoints_2d": keypoints(70),
+                   "hand_left_keypoints_2d": keypoints(21), "hand_right_keypoints_2d": keypoints(21),
+                   "pose_keypoints_3d": [], "face_keypoints_3d": [], "hand_left_keypoints_3d": [],
+                   "hand_right_keypoints_3d": []} for _ in range(rng.randint(0, 4))]
+        with open(os.path.join(output_dir, "synthetic_{:012d}_keypoints.json".format(frame_idx)), "w") as fh:
+            json.dump({"version": 1.3, "people": people}, fh)
+
+
+def time_per_frame(read_fn, json_paths, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for json_path in json_paths:
+            read_fn(json_path)
+        best = min(best, (time.perf_counter() - start) / len(json_paths))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json-dir", default=None, help="Directory of OpenPose .json files of a video")
+    parser.add_argument("--num-frames", type=int, default=500, help="Number of synthetic frames")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_dir = args.json_dir
+        if json_dir is None:
+            write_synthetic_frames(tmp_dir, args.num_frames)
+            json_dir = tmp_dir
+        json_paths = sorted(glob(os.path.join(json_dir, "*.json")))
+        for json_path in json_paths:
+            assert np.array_equal(read_openpose_pose_keypoints(json_path)[0], json_load_keypoints(json_path))
+
+        # Warm the page cache, such that both readers are timed on the same footing
+        time_per_frame(json_load_keypoints, json_paths, 1)
+        json_time = time_per_frame(json_load_keypoints, json_paths, args.repeats)
+        fast_time = time_per_frame(read_openpose_pose_keypoints, json_paths, args.repeats)
+    print("{} frames from {}".format(len(json_paths), "synthetic data" if args.json_dir is None else args.json_dir))
+    print("json module:                  {:8.1f} us/frame".format(json_time * 1e6))
+    print("read_openpose_pose_keypoints: {:8.1f} us/frame ({:.1f}x)".format(fast_time * 1e6, json_time / fast_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,8 @@ import numpy as np
 import os
 import matplotlib.pyplot as plt
 import pprint
-from common.utils import MeterAssembly, numpy2tensor, expand1darr
+from common.utils import MeterAssembly, numpy2tensor, mask2tensor, expand1darr
+from common.generator import PrefetchIterator
 
 from .Model import SpatioTemporalVAE
 from .ConditionalModel import ConditionalSpatioTemporalVAE, ConditionalPhenotypeSpatioTemporalVAE
@@ -98,6 +99,7 @@ class BaseContainer:
             "test_acc"
         )
         self.class_criterion = CrossEntropyLoss(reduction="none")
+        self.eval_input = None  # Evaluation batch converted by self._evaluate()
         # Initialize model, params, optimizer, loss
         if load_chkpt_path is None:
             self.model, self.optimizer, self.lr_scheduler = self._model_initialization()
@@ -135,24 +137,29 @@ class BaseContainer:
             data_outputs = self.model(*data_input)
         return data_outputs
 
-    def train(self, n_epochs=50):
+    def train(self, n_epochs=50, prefetch_workers=0, eval_every=None):
+        """
+        Parameters
+        ----------
+        n_epochs : int
+        prefetch_workers : int
+            With prefetch_workers > 0, batches are assembled by background threads while the GPU trains.
+        eval_every : int, "epoch" or None
+            If given, the model is evaluated on the fixed evaluation batch of data_gen.eval_data() every eval_every
+            iterations, or once at the end of each epoch with "epoch". No evaluation if None (the test meters are then
+            not updated).
+        """
+        batch_source = PrefetchIterator(self.data_gen, num_workers=prefetch_workers) if prefetch_workers > 0 \
+            else self.data_gen
         try:
             for epoch in range(n_epochs):
                 iter_idx = 0
-                for train_data, test_data in self.data_gen.iterator():
+                for train_data in batch_source.iterator():
                     # Clear optimizer's previous gradients
                     self.optimizer.zero_grad()
 
                     # Retrieve data
                     train_input, train_info = self._convert_input_data(train_data)
-                    # test_input, test_info = self._convert_input_data(test_data)
-
-                    # # CV set
-                    # self.model.eval()
-                    # with torch.no_grad():
-                    #     test_outputs = self.model(*test_input)
-                    #     loss_test, loss_test_indicators = self.loss_function(test_outputs, test_info)
-                    #     self._update_loss_meters(loss_test, loss_test_indicators, train=False)
 
                     # Train set
                     self.model.train()
@@ -168,6 +175,13 @@ class BaseContainer:
                     self.optimizer.step()
                     iter_idx += 1
 
+                    # CV set
+                    if isinstance(eval_every, int) and iter_idx % eval_every == 0:
+                        self._evaluate()
+
+                if eval_every == "epoch":
+                    self._evaluate()
+
                 # save (overwrite) model file every epoch
                 self._print_update_for_each_epoch()
                 self._save_model()
@@ -178,6 +192,23 @@ class BaseContainer:
             self._save_model()
             raise e
 
+        finally:
+            # Release the device memory of the evaluation batch
+            self.eval_input = None
+
+    def _evaluate(self):
+        # The evaluation batch is fixed, hence converted to tensors only once per call of self.train(). The test
+        # meters are reset such that they hold the losses of the latest evaluation.
+        if self.eval_input is None:
+            self.eval_input = self._convert_input_data(self.data_gen.eval_data())
+        test_input, test_info = self.eval_input
+        self.model.eval()
+        with torch.no_grad():
+            test_outputs = self.model(*test_input)
+            loss_test, loss_test_indicators = self.loss_function(test_outputs, test_info)
+        self.loss_meter.reset_meters("test_")
+        self._update_loss_meters(loss_test, loss_test_indicators, train=False)
+
     def _update_loss_meters(self, total_loss, indicators, train):
 
         recon, posekld, motionkld, recongrad, latentgrad, acc, fut_predic = indicators
@@ -427,8 +458,7 @@ class BaseContainer:
         x, fut = numpy2tensor(self.device, x, fut_np)
         tasks = torch.from_numpy(tasks).long().to(self.device)
         tasks_mask = torch.from_numpy(tasks_mask * 1 + 1e-5).float().to(self.device)
-        nan_masks = torch.from_numpy(nan_masks * 1 + 1e-5).float().to(self.device)
-        fut_mask = torch.from_numpy(fut_mask_np * 1 + 1e-5).float().to(self.device)
+        nan_masks, fut_mask = mask2tensor(self.device, nan_masks, fut_mask_np)
         fut_avail_mask = torch.from_numpy(fut_avail_mask_np.astype(int)).to(self.device)
 
         # Construct tuple
@@ -525,8 +555,7 @@ class ConditionalContainer(BaseContainer):
         # Convert numpy to torch.tensor
         tasks = torch.from_numpy(tasks).long().to(self.device)
         tasks_mask = torch.from_numpy(tasks_mask * 1 + 1e-5).float().to(self.device)
-        nan_masks = torch.from_numpy(nan_masks * 1 + 1e-5).float().to(self.device)
-        fut_mask = torch.from_numpy(fut_mask_np * 1 + 1e-5).float().to(self.device)
+        nan_masks, fut_mask = mask2tensor(self.device, nan_masks, fut_mask_np)
         fut_avail_mask = torch.from_numpy(fut_avail_mask_np.astype(int)).to(self.device)
         x, fut, towards = numpy2tensor(self.device,
                                x,
@@ -646,8 +675,7 @@ class PhenoCondContainer(BaseContainer):
         # Convert numpy to torch.tensor
         tasks = torch.from_numpy(tasks_np).long().to(self.device)
         tasks_mask = torch.from_numpy(tasks_mask_np * 1 + 1e-5).float().to(self.device)
-        nan_masks = torch.from_numpy(nan_masks * 1 + 1e-5).float().to(self.device)
-        fut_mask = torch.from_numpy(fut_mask_np * 1 + 1e-5).float().to(self.device)
+        nan_masks, fut_mask = mask2tensor(self.device, nan_masks, fut_mask_np)
         fut_avail_mask = torch.from_numpy(fut_avail_mask_np.astype(int)).to(self.device)
         x, fut, towards = numpy2tensor(self.device,
                                 x,
@@ -1,4 +1,4 @@
-from common.utils import tensor2numpy, write_df_pickle
+from common.utils import tensor2numpy, write_df_pickle, pack_motion_masks
 from thesis_analysis_script import load_model_container
 import pandas as pd
 import numpy as np
@@ -13,7 +13,8 @@ class OutputSavers:
 
     1. From inputs:
         1.1. Original motion sequence
-        1.2. Mask of original motion sequence (True = confident keypoint. False = low confident/non-existing)
+        1.2. Mask of original motion sequence (True = confident keypoint. False = low confident/non-existing).
+             Bit-packed with one bit per keypoint and frame, see common.utils.unpack_motion_masks
         1.3. Task labels, integer between [0,7]
         1.4. Mask of task labels (True = labelled. False = unlabbled)
         1.5. Phenotype labels, integer between [0, 12]
@@ -48,7 +49,7 @@ class OutputSavers:
             Path for saving the dataframe that stores the kld reconstruction
         """
         self.data_gen = data_gen
-        self.data_gen.mt = data_gen.df_test.shape[0]  # s.t. all data are loaded in first generaator loop
+        self.data_gen.mt = data_gen.df_test.shape[0]  # s.t. all test data are loaded in the evaluation batch
         self.identifier_set = [x.replace("Thesis_", "") for x in identifier_set]
         self.model_container_set = model_container_set
         self.df_dict = dict()  # For being loaded into output dataframe (storing general data)
@@ -61,23 +62,23 @@ class OutputSavers:
 
     def forward_batch(self):
         print('Data iteration ...')
-        # Dummy iteration to dump all test data
-        for _, test_data in self.data_gen.iterator():
-            pass
+        test_data = self.data_gen.eval_data()
         print('Done')
 
         x, nan_masks, fut_np, fut_mask_np, fut_avail_mask_np, tasks_np, tasks_mask_np, phenos_np, phenos_mask_np, towards, _, _, idpatients_np = test_data
 
         # Store common input data into the output dataframe dictionary
-        self.df_dict["ori_motion"] = list(x)
-        self.df_dict["ori_motion_mask"] = list(nan_masks)
+        # The generator yields float32 features, stored in float64 as expected by the analysis notebooks. The motion
+        # and future masks are bit-packed, and unpacked by the notebooks with common.utils.unpack_motion_masks
+        self.df_dict["ori_motion"] = list(x.astype(np.float64))
+        self.df_dict["ori_motion_mask"] = list(pack_motion_masks(nan_masks))
         self.df_dict["task"] = list(tasks_np)
         self.df_dict["task_mask"] = list(tasks_mask_np)
         self.df_dict["pheno"] = list(phenos_np)
         self.df_dict["pheno_mask"] = list(phenos_mask_np)
         self.df_dict["direction"] = list(towards)
-        self.df_dict["ori_fut"] = list(fut_np)
-        self.df_dict["ori_fut_mask"] = list(fut_mask_np)
+        self.df_dict["ori_fut"] = list(fut_np.astype(np.float64))
+        self.df_dict["ori_fut_mask"] = list(pack_motion_masks(fut_mask_np))
         self.df_dict["fut_avail_mask"] = list(fut_avail_mask_np)
         self.df_dict["idpatients"] = list(idpatients_np)
 
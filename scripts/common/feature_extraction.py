@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import os
+import hashlib
+import multiprocessing
 import numpy as np
 import pandas as pd
 from glob import glob
-from .utils import read_oenpose_preprocessed_keypoints, fullfile, LabelsReader, write_df_pickle, load_df_pickle
+from .utils import fullfile, LabelsReader, write_df_pickle, load_df_pickle, \
+    NanWelfordAccumulator, is_feature_store, write_feature_store, read_oenpose_preprocessed_segments
 from .generator import SingleNumpy_DataGenerator
 from .keypoints_format import openpose_L_indexes, openpose_R_indexes, openpose_central_indexes
-from sklearn.metrics.pairwise import pairwise_distances
 
 
 class Imputator():
@@ -104,80 +106,71 @@ class FeatureExtractor():
     def _incremental_mean_estimation(self):
 
         data_gen = SingleNumpy_DataGenerator(self.data_dir, batch_size=1)
-        num = data_gen.num_files
-        data_accumulator = np.zeros([num] + [x for x in self.keyps_shape])
+        accumulator = NanWelfordAccumulator(self.keyps_shape)
 
         for idx, data_info in enumerate(data_gen.iterator()):
             print("\r%d/%d Estimating means incrementally from each data file." % (idx, data_gen.num_files), end="",
                   flush=True)
             data, _ = data_info
-            data_mean = np.nanmean(data, axis=0)
-            data_accumulator[idx] = data_mean
-        data_grand_mean = np.nanmean(data_accumulator, axis=0)
+            accumulator.add(self._file_mean(data))
+        data_grand_mean = accumulator.mean()
         return data_grand_mean
 
+    @staticmethod
+    def _file_mean(data):
+        """
+        Mean of each keypoint across the frames of a video, nan for the keypoints that are nan in all frames.
+        Every video has the same weight in the grand mean, regardless of its number of frames.
+        """
+        is_valid = np.logical_not(np.isnan(data))
+        counts = np.sum(is_valid, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, np.sum(np.where(is_valid, data, 0), axis=0) / counts, np.nan)
+
     def _iterative_workflow(self, data):
         """
-        Iterative data of each frame of a video, and calcualte the mean and std of relative euclidean distance between keypoints,
-        as well as the asymmetry
+        Calcualte the mean and std across the frames of a video, of relative euclidean distance between keypoints, as
+        well as the asymmetry. All frames are processed at once.
         Args:
             data: Numpy array with shape (num_frames, 25, 2)
         Returns:
             features: Numpy array with shape (666, )
         """
-        features_all_frames = []
+        # Per-frame features in float32. The mean and std across frames are accumulated in float64
+        data = np.asarray(data, dtype=np.float32)
 
-        for data_each_frame in data:  # data_each_frame ~ (25, 2)
+        # Relative euclidean distance
+        upper_tri_indices = np.triu_indices(n=self.keyps_shape[0], k=1)
+        keyps_diff = data[:, upper_tri_indices[0], :] - data[:, upper_tri_indices[1], :]  # Shape = (num_frames, 300, 2)
+        only_relative_dist = np.sqrt(np.sum(np.square(keyps_diff), axis=2))  # Shape = (num_frames, 300)
 
-            # Relative euclidean distance
-            pair_dist = pairwise_distances(data_each_frame, metric='euclidean')
-            upper_tri_indices = np.triu_indices(n=self.keyps_shape[0], k=1)
-            only_relative_dist = pair_dist[upper_tri_indices[0], upper_tri_indices[1]]  # Shape = (300,)
+        # Asymmetry
+        asymmetry = self._asymmetry_measure(data)  # Shape = (num_frames, 33)
 
-            # Asymmetry
-            asymmetry = self._asymmetry_measure(data_each_frame)  # Shape = (33, )
-
-            features_each_frame = np.append(only_relative_dist, asymmetry)  # Shape = (333, )
-            features_all_frames.append(features_each_frame)
-
-        features_all_frames_np = np.array(features_all_frames)  # Shape = (num_frames, 333)
-        mean, std = np.mean(features_all_frames_np, axis=0), np.std(features_all_frames_np,
-                                                                    axis=0)  # Shape = (333,) for both
+        features_all_frames_np = np.concatenate([only_relative_dist, asymmetry], axis=1)  # Shape = (num_frames, 333)
+        mean = np.mean(features_all_frames_np, axis=0, dtype=np.float64)  # Shape = (333,)
+        std = np.std(features_all_frames_np, axis=0, dtype=np.float64)  # Shape = (333,)
         features_flattened = np.append(mean, std)  # Shape = (666, )
         return features_flattened
 
-    def _asymmetry_measure(self, data_each_frame):
+    def _asymmetry_measure(self, data):
         """
-        Calculate the RATIO of  Euclidean distance of left keypoints to the right keypoints.
+        Calculate the RATIO of  Euclidean distance of left keypoints to the right keypoints, relative to each of the
+        central (anchor) keypoints.
         Args:
-            data_each_frame: Numpy array with shape (25, 2)
+            data: Numpy array with shape (..., 25, 2), e.g. (25, 2) for a frame or (num_frames, 25, 2)
         Returns:
-            asymmetry_features: Numpy array with shape (33, )
-        """
-
-        def degree_of_asymmetry(L_keyps, R_keyps, anchor):
-            """
-            Args:
-                L_keyps: Numpy array with shape (M, 2)
-                R_keyps: Numpy array with shape (M, 2)
-                anchor: Numpy array with shape (1, 2), accepting only one anchor vector in each function call.
-
-            """
-            L_eu_dist = np.linalg.norm(L_keyps - anchor, axis=1)  # Shape = (M, )
-            R_eu_dist = np.linalg.norm(R_keyps - anchor, axis=1)  # Shape = (M, )
-            asy_degree = L_eu_dist / (R_eu_dist + 0.00001)  # Shape = (M,)
-            return asy_degree
-
-        L_keyps = data_each_frame[openpose_L_indexes, :]  # Shape = (11, 2)
-        R_keyps = data_each_frame[openpose_R_indexes, :]  # Shape = (11, 2)
-        anchor_points = data_each_frame[openpose_central_indexes, :]  # Shape = (3, 2)
-        all_anchors_degree_list = []
-        for i in range(anchor_points.shape[0]):
-            each_anchor_point = anchor_points[[i], :]  # Shape = (1, 2)
-            degrees_each_anchor = degree_of_asymmetry(L_keyps, R_keyps, each_anchor_point)  # Shape = (11,)
-            all_anchors_degree_list.append(degrees_each_anchor)
-
-        asymmetry_features = np.array(all_anchors_degree_list).flatten()  # Shape = (11*3, ) = (33, )
+            asymmetry_features: Numpy array with shape (..., 33), ordered by anchor then by keypoint
+        """
+        L_keyps = data[..., np.newaxis, openpose_L_indexes, :]  # Shape = (..., 1, 11, 2)
+        R_keyps = data[..., np.newaxis, openpose_R_indexes, :]  # Shape = (..., 1, 11, 2)
+        anchor_points = data[..., openpose_central_indexes, np.newaxis, :]  # Shape = (..., 3, 1, 2)
+
+        L_eu_dist = np.sqrt(np.sum(np.square(L_keyps - anchor_points), axis=-1))  # Shape = (..., 3, 11)
+        R_eu_dist = np.sqrt(np.sum(np.square(R_keyps - anchor_points), axis=-1))  # Shape = (..., 3, 11)
+        asy_degree = L_eu_dist / (R_eu_dist + 0.00001)  # Shape = (..., 3, 11)
+
+        asymmetry_features = asy_degree.reshape(asy_degree.shape[:-2] + (-1,))  # Shape = (..., 11*3) = (..., 33)
         return asymmetry_features
 
     @staticmethod
@@ -213,10 +206,23 @@ class FeatureExtractorForODE(FeatureExtractor):
         2. The nan's are imputed by mean of the keypoints across a video (num_frames)
         3. The keypoints' coordinates are scaled to between float [0, 1]
 
-    This class handles input data that were first preprocessed by "OpenposePreprocesser" (Part-1 preprocessing)
+    This class handles input data that were first preprocessed by "OpenposePreprocesser" (Part-1 preprocessing).
+    Each contiguous segment of confident keypoints of a video (vid_info "segments" of the Part-1 output) gives its own
+    row, such that the low-confidence frames between segments are left out. The rows of a video share its name and
+    labels, and the per-video statistics below are taken over the frames of its segments.
+
+    The grand mean of the keypoints (for the videos that have a keypoint missing in all frames) is estimated in the
+    same pass as the extraction, and cached in stats_cache_path. Only the videos that need the grand mean are read a
+    second time, and none of them if the cache is up to date.
+
+    For parallel extraction (extract_parallel), the videos are split into contiguous shards. Each shard is extracted
+    by extract_shard() into its own dataframe file, which can also be re-run alone, and merge_shards() concatenates
+    them into df_save_path.
     """
+    df_columns = ("vid_name_roots", "features", "feature_masks", "tasks", "task_masks", "phenos", "pheno_masks",
+                  "idpatients", "towards_camera", "leg", "leg_masks")
 
-    def __init__(self, scr_keyps_dir, labels_path, df_save_path):
+    def __init__(self, scr_keyps_dir, labels_path, df_save_path, stats_cache_path="", label_tables=None):
         """
 
         Parameters
@@ -229,24 +235,34 @@ class FeatureExtractorForODE(FeatureExtractor):
             Path that contains the label of z_matrix which can be handled by common.utils.LabelReader class
 
         df_save_path : str
-            Path that you will store your dataframe after this "Part-2 preprocessing"
+            Path that you will store your dataframe after this "Part-2 preprocessing". If it ends with ".npz", the
+            dataframe is stored as a memory-mappable feature store (see common.utils.write_feature_store), otherwise
+            as a pickle.
+
+        stats_cache_path : str or None
+            Path of the .npz cache of the keypoints statistics (grand mean and variance across videos). If "", it is
+            placed next to df_save_path. If None, the statistics are neither cached nor read from the cache.
+
+        label_tables : dict or None
+            Labels already read by another LabelsReader (see LabelsReader.get_label_tables), to skip reading
+            labels_path.
         """
         self.scr_keyps_dir = scr_keyps_dir
         self.arrs_paths = sorted(glob(os.path.join(self.scr_keyps_dir, "*.npz")))
         self.total_paths_num = len(self.arrs_paths)
         self.df = pd.DataFrame()
-        self.lreader = LabelsReader(labels_path)
+        self.labels_path = labels_path
+        self.lreader = LabelsReader(labels_path, label_tables=label_tables)
         self.df_save_path = df_save_path
-
-        # Initialize lists
-        self.vid_name_roots_list, self.features_list, self.feature_masks_list = [], [], []
-        self.tasks_list, self.task_masks_list = [], []
-        self.phenos_list, self.pheno_masks_list = [], []
-        self.idpatients_list, self.towards_camera_list = [], []
-        self.leg_list, self.leg_mask_list = [], []
+        if stats_cache_path == "":
+            stats_cache_path = os.path.splitext(df_save_path)[0] + "_keyps_stats.npz"
+        self.stats_cache_path = stats_cache_path
 
         super(FeatureExtractorForODE, self).__init__(scr_keyps_dir, None)
-        self.data_grand_mean = self._incremental_mean_estimation()  # Shape = (25, 3)
+
+        # Statistics of the per-video keypoint means. Shape = (25, 3) for each. None until estimated or loaded
+        self.keyps_stats = self._load_keyps_stats()
+        self.data_grand_mean = None if self.keyps_stats is None else self.keyps_stats["mean"]
 
     def extract(self, filter_window=None, fut_dim=None):
         """
@@ -261,53 +277,128 @@ class FeatureExtractorForODE(FeatureExtractor):
         -------
         None
         """
+        rows = [None] * self.total_paths_num
+        accumulator = None if self.data_grand_mean is not None else NanWelfordAccumulator(self.keyps_shape)
+        deferred_indices = []
+
+        # Phase 1: Read every video once. Accumulate its mean for the grand mean, and extract it right away unless
+        # its imputation falls back to the grand mean, which is only known at the end of the pass
         for idx, arr_path in enumerate(self.arrs_paths):
             # Print progress
             print("\rSecond preprocessing %d/%d" % (idx, self.total_paths_num), flush=True, end="")
 
             # Load data
-            keyps_arr = np.load(arr_path)["positions_2d"]  # (num_frames, 25, 3)
-
-            # First column: vid_name_root
-            vid_name_root = os.path.splitext(os.path.split(arr_path)[1])[0]
-
-            # Second column: features + Forth column: nan_mask
-            feature, feature_mask = self._transform_to_features(keyps_arr)
-            feature_mask = np.invert(feature_mask)  # False = masked
-
-            # 3rd-5th column: labels
-            (task, pheno, idpatient, leg), (task_mask, pheno_mask, leg_mask) = self.lreader.get_label(vid_name_root)
-
-            # Detact walking direction
-            towards = self._check_towards(feature,
-                                          np.invert(feature_mask))  # For argument here, we want True = masked
-
-            # Append to lists
-            self.vid_name_roots_list.append(vid_name_root)
-            self.features_list.append(feature)
-            self.feature_masks_list.append(feature_mask)  # False = masked
-            self.tasks_list.append(task)
-            self.task_masks_list.append(task_mask)  # False = masked
-            self.phenos_list.append(pheno)
-            self.pheno_masks_list.append(pheno_mask)  # False = masked
-            self.idpatients_list.append(idpatient)  # None if not found
-            self.towards_camera_list.append(towards)  # 0=unknown, 1=towards, 2=away
-            self.leg_list.append(leg)
-            self.leg_mask_list.append(leg_mask)
-
-        # Create dataframe
-        self.df["vid_name_roots"] = self.vid_name_roots_list
-        self.df["features"] = self.features_list
-        self.df["feature_masks"] = self.feature_masks_list
-        self.df["tasks"] = self.tasks_list
-        self.df["task_masks"] = self.task_masks_list
-        self.df["phenos"] = self.phenos_list
-        self.df["pheno_masks"] = self.pheno_masks_list
-        self.df["idpatients"] = self.idpatients_list
-        self.df["towards_camera"] = self.towards_camera_list
-        self.df["leg"] = self.leg_list
-        self.df["leg_masks"] = self.leg_mask_list
+            keyps_segments = read_oenpose_preprocessed_segments(arr_path)  # [(num_frames, 25, 3), ...]
+
+            if accumulator is not None:
+                accumulator.add(self._file_mean(np.concatenate(keyps_segments)))
+                if any(self._has_allnan_keypoints(keyps_arr) for keyps_arr in keyps_segments):
+                    deferred_indices.append(idx)
+                    continue
+            rows[idx] = self._extract_rows(arr_path, keyps_segments)
+
+        # Phase 2: Read again only the videos that are imputed by the grand mean
+        if accumulator is not None:
+            self._set_keyps_stats(accumulator)
+        for num, idx in enumerate(deferred_indices):
+            print("\rSecond preprocessing (grand mean imputation) %d/%d" % (num, len(deferred_indices)), flush=True,
+                  end="")
+            arr_path = self.arrs_paths[idx]
+            rows[idx] = self._extract_rows(arr_path, read_oenpose_preprocessed_segments(arr_path))
+
+        # Create dataframe, filter and save
+        self.df = self._rows_to_df([row for video_rows in rows for row in video_rows])
+        self._filter_and_save(filter_window, fut_dim)
+
+    def shard_arrs_paths(self, shard_idx, num_shards):
+        """
+        Returns the input paths of a shard. The shards are contiguous ranges of the sorted input paths, such that
+        concatenating them in order of shard_idx gives the same rows as extract().
+        """
+        bounds = np.linspace(0, self.total_paths_num, num_shards + 1).astype(int)
+        return self.arrs_paths[bounds[shard_idx]:bounds[shard_idx + 1]]
+
+    def shard_df_path(self, shard_idx, num_shards):
+        return "{}.shard{}-of-{}".format(self.df_save_path, shard_idx, num_shards)
+
+    def estimate_keyps_stats(self, num_workers=1):
+        """
+        Estimate the keypoints statistics from all input videos (a pass dedicated to the statistics, sharded across
+        num_workers processes), and cache them. It is needed before extract_shard(), since the shards cannot wait for
+        each other's statistics.
+        """
+        num_workers = max(1, min(num_workers, self.total_paths_num))
+        shards_paths = [self.shard_arrs_paths(shard_idx, num_workers) for shard_idx in range(num_workers)]
+        if num_workers == 1:
+            shard_states = [_accumulate_keyps_stats(shards_paths[0], self.keyps_shape)]
+        else:
+            with multiprocessing.Pool(processes=num_workers) as pool:
+                shard_states = pool.starmap(_accumulate_keyps_stats,
+                                            [(shard_paths, self.keyps_shape) for shard_paths in shards_paths])
+        accumulator = NanWelfordAccumulator(self.keyps_shape)
+        for shard_state in shard_states:
+            accumulator.merge(NanWelfordAccumulator.from_state_dict(shard_state))
+        self._set_keyps_stats(accumulator)
+
+    def extract_shard(self, shard_idx, num_shards):
+        """
+        Extract the rows of one shard and save them as a dataframe in self.shard_df_path(shard_idx, num_shards).
+        Filtering is left to merge_shards().
 
+        Returns
+        -------
+        shard_df_path : str
+        """
+        if self.data_grand_mean is None:
+            self.estimate_keyps_stats()
+        shard_arrs_paths = self.shard_arrs_paths(shard_idx, num_shards)
+        rows = []
+        for idx, arr_path in enumerate(shard_arrs_paths):
+            print("\rShard %d second preprocessing %d/%d" % (shard_idx, idx, len(shard_arrs_paths)), flush=True, end="")
+            rows.extend(self._extract_rows(arr_path, read_oenpose_preprocessed_segments(arr_path)))
+        shard_df_path = self.shard_df_path(shard_idx, num_shards)
+        write_df_pickle(self._rows_to_df(rows), shard_df_path)
+        return shard_df_path
+
+    def merge_shards(self, num_shards, filter_window=None, fut_dim=None):
+        """
+        Concatenate the dataframes of all shards in order, then filter and save it as extract() does. The shard files
+        are kept, such that a single shard can be re-extracted and merged again.
+        """
+        shards_dfs = [load_df_pickle(self.shard_df_path(shard_idx, num_shards)) for shard_idx in range(num_shards)]
+        self.df = pd.concat(shards_dfs, ignore_index=True).infer_objects()
+        self._filter_and_save(filter_window, fut_dim)
+
+    def extract_parallel(self, num_workers=None, filter_window=None, fut_dim=None):
+        """
+        Same output as extract(), with the videos sharded across num_workers processes (all cores if None). The
+        keypoints statistics and the labels are computed once in this process and passed to the workers.
+        """
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_shards = max(1, min(num_workers, self.total_paths_num))
+        if self.data_grand_mean is None:
+            self.estimate_keyps_stats(num_shards)
+        if num_shards == 1:
+            self.extract_shard(0, num_shards)
+        else:
+            extractor_kwargs = dict(scr_keyps_dir=self.scr_keyps_dir, labels_path=self.labels_path,
+                                    df_save_path=self.df_save_path, stats_cache_path=None,
+                                    label_tables=self.lreader.get_label_tables())
+            shard_args = [(extractor_kwargs, self.keyps_stats, shard_idx, num_shards)
+                          for shard_idx in range(num_shards)]
+            with multiprocessing.Pool(processes=num_shards) as pool:
+                pool.starmap(_extract_ode_shard, shard_args)
+        self.merge_shards(num_shards, filter_window, fut_dim)
+
+    def _rows_to_df(self, rows):
+        df = pd.DataFrame()
+        columns = list(zip(*rows)) if len(rows) > 0 else [[] for _ in self.df_columns]
+        for column_name, column in zip(self.df_columns, columns):
+            df[column_name] = list(column)
+        return df
+
+    def _filter_and_save(self, filter_window, fut_dim):
         # Filter rows with number of frames smaller than "filter_window"
         if (filter_window is not None) and (isinstance(filter_window, int)) and (fut_dim is not None) and (isinstance(fut_dim, int)):
             self._filter(filter_window, fut_dim)
@@ -315,7 +406,83 @@ class FeatureExtractorForODE(FeatureExtractor):
             self._filter(filter_window, np.inf)
 
         # # Save dataframe
-        write_df_pickle(self.df, self.df_save_path)
+        if is_feature_store(self.df_save_path):
+            write_feature_store(self.df, self.df_save_path)
+        else:
+            write_df_pickle(self.df, self.df_save_path)
+
+    def _extract_rows(self, arr_path, keyps_segments):
+        """
+        Returns the rows of one video, one per segment of keypoints (see read_oenpose_preprocessed_segments)
+        """
+        return [self._extract_row(arr_path, keyps_arr) for keyps_arr in keyps_segments]
+
+    def _extract_row(self, arr_path, keyps_arr):
+        """
+        Returns the values of the 11 columns (see class docstring) for one segment of a video, in the order of
+        self.df_columns
+        """
+        # First column: vid_name_root
+        vid_name_root = os.path.splitext(os.path.split(arr_path)[1])[0]
+
+        # Second column: features + Forth column: nan_mask
+        feature, feature_mask = self._transform_to_features(keyps_arr)
+        feature_mask = np.invert(feature_mask)  # False = masked
+
+        # 3rd-5th column: labels
+        (task, pheno, idpatient, leg), (task_mask, pheno_mask, leg_mask) = self.lreader.get_label(vid_name_root)
+
+        # Detact walking direction
+        towards = self._check_towards(feature,
+                                      np.invert(feature_mask))  # For argument here, we want True = masked
+
+        return (vid_name_root, feature, feature_mask, task, task_mask, pheno, pheno_mask, idpatient, towards, leg,
+                leg_mask)
+
+    @staticmethod
+    def _has_allnan_keypoints(keyps_arr):
+        """
+        True if any keypoint coordinate is nan in all frames, i.e. CustomMeanImputator will impute by the grand mean.
+        """
+        return np.isnan(keyps_arr[:, :, 0:2]).all(axis=0).any()
+
+    def _keyps_fingerprint(self):
+        """
+        Fingerprint of the input videos from their names, sizes and modification times, without reading them.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(b"segments\n")  # Statistics over the frames of the segments, not of the whole cut duration
+        for arr_path in self.arrs_paths:
+            stat = os.stat(arr_path)
+            hasher.update("{}:{}:{}\n".format(os.path.basename(arr_path), stat.st_size, stat.st_mtime_ns).encode())
+        return hasher.hexdigest()
+
+    def _set_keyps_stats(self, accumulator):
+        self._use_keyps_stats({"mean": accumulator.mean(), "variance": accumulator.variance(),
+                               "count": accumulator.count})
+        if self.stats_cache_path is None:
+            return
+        tmp_path = self.stats_cache_path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            np.savez(fh, fingerprint=np.array(self._keyps_fingerprint()), **accumulator.state_dict())
+        os.replace(tmp_path, self.stats_cache_path)
+
+    def _use_keyps_stats(self, keyps_stats):
+        self.keyps_stats = keyps_stats
+        self.data_grand_mean = keyps_stats["mean"]
+
+    def _load_keyps_stats(self):
+        """
+        Returns the cached statistics (dict of mean, variance and count), or None if there is no cache or it was
+        computed from a different set of input videos.
+        """
+        if (self.stats_cache_path is None) or (not os.path.isfile(self.stats_cache_path)):
+            return None
+        with np.load(self.stats_cache_path, allow_pickle=False) as cache:
+            if str(cache["fingerprint"]) != self._keyps_fingerprint():
+                return None
+            accumulator = NanWelfordAccumulator.from_state_dict(cache)
+        return {"mean": accumulator.mean(), "variance": accumulator.variance(), "count": accumulator.count}
 
     def _filter(self, sequence_window_size=128, fut_dim=32):
         self.df["num_frames"] = self.df["features"].apply(lambda x: x.shape[0]).copy()
@@ -328,9 +495,12 @@ class FeatureExtractorForODE(FeatureExtractor):
         # Clipping (between [0, 250])
         keyps_arr_clipped = np.clip(keyps_arr, boundary[0], boundary[1])
 
-        # Imputation (nan -> mean)
+        # Imputation (nan -> mean). The grand mean is only used (and hence only needed) if a keypoint is all nan
+        data_grand_mean = self.data_grand_mean
+        if data_grand_mean is None:
+            data_grand_mean = np.full(self.keyps_shape, np.nan)
         keyps_imputed, nan_mask = self._mean_single_imputation(keyps_arr_clipped,
-                                                               self.data_grand_mean)  # (num_frames, 25, 2)
+                                                               data_grand_mean)  # (num_frames, 25, 2)
 
         # Rescaling (./250)
         keyps_rescaled = keyps_imputed / boundary[1]
@@ -370,3 +540,27 @@ class FeatureExtractorForODE(FeatureExtractor):
             return 2  # Back to camera
         else:
             return 0
+
+
+def _accumulate_keyps_stats(arrs_paths, keyps_shape):
+    """
+    Unit of work of FeatureExtractorForODE.estimate_keyps_stats() in each worker process.
+
+    Returns
+    -------
+    state : dict
+        NanWelfordAccumulator.state_dict() of the per-video means of arrs_paths
+    """
+    accumulator = NanWelfordAccumulator(keyps_shape)
+    for arr_path in arrs_paths:
+        accumulator.add(FeatureExtractor._file_mean(np.concatenate(read_oenpose_preprocessed_segments(arr_path))))
+    return accumulator.state_dict()
+
+
+def _extract_ode_shard(extractor_kwargs, keyps_stats, shard_idx, num_shards):
+    """
+    Unit of work of FeatureExtractorForODE.extract_parallel() in each worker process.
+    """
+    extractor = FeatureExtractorForODE(**extractor_kwargs)
+    extractor._use_keyps_stats(keyps_stats)
+    return extractor.extract_shard(shard_idx, num_shards)
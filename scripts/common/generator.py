@@ -1,9 +1,11 @@
 from glob import glob
 from abc import ABC, abstractmethod
-from .utils import LabelsReader, fullfile, load_df_pickle
+from .utils import LabelsReader, fullfile, load_features_df, read_oenpose_preprocessed_keypoints, pin_numpy_arrays
 from .keypoints_format import excluded_points_flatten
 import random
 import os
+import queue
+import threading
 import numpy as np
 import pandas as pd
 
@@ -43,7 +45,7 @@ class SingleNumpy_DataGenerator(DataGenerator):
     def _convert_paths_to_data(self, start, stop):
         batch_data_paths = self.all_data_paths[start:stop]
         for idx, batch_data_path in enumerate(batch_data_paths):
-            data_each = np.load(batch_data_path)['positions_2d']
+            data_each = read_oenpose_preprocessed_keypoints(batch_data_path)
 
             return (data_each, batch_data_path)
 
@@ -51,9 +53,15 @@ class SingleNumpy_DataGenerator(DataGenerator):
 class GaitGeneratorFromDF:
 
     def __init__(self, df_pickle_path, m=32, n=128, train_portion=0.95, seed=None):
-        self.df = load_df_pickle(df_pickle_path)
+        # The features and masks of all rows are also concatenated along the frames, such that batches can be
+        # gathered from them at once. Row i has the frames [frame_starts[i], frame_starts[i] + frame_counts[i])
+        self.df, (self.features_buffer, self.masks_buffer, offsets) = load_features_df(df_pickle_path,
+                                                                                        with_buffers=True)
+        self.df["frame_starts"], self.df["frame_counts"] = offsets[:-1], np.diff(offsets)
         self.total_num_rows = self.df.shape[0]
         self.seed = seed
+        self.eval_seed = seed
+        self._eval_data = None
         self.df = self.df.sample(frac=1, random_state=self.seed)
         self.train_portion = train_portion
         self.df_train, self.df_test = self._split_train_test()
@@ -74,7 +82,38 @@ class GaitGeneratorFromDF:
 
         Returns
         -------
+        Yields ((output_arr, output_arr_test), times): the training batch and a batch freshly drawn from the test set,
+        both with shape (m, n, 75), and the times with shape (n, ). GaitGeneratorFromDFforTemporalVAE yields the
+        training batches only, and its test set is drawn by eval_data().
+        """
+        df_shuffled, duration_indices = self._epoch_plan()
+
+        for start, stop in duration_indices:
+            info = self._convert_df_to_data(df_shuffled, start, stop)
+            yield info
+
+    def eval_data(self):
+        """
+        Evaluation batch drawn from the test set. It is built on the first call, with random draws seeded by the seed
+        given at initialization, and the same cached batch is returned afterwards.
+
+        Returns
+        -------
+        The batch in the same format as the training batches, i.e. (output_arr_test, times) for GaitGeneratorFromDF.
+        """
+        if self._eval_data is None:
+            self._eval_data = self._convert_df_to_eval_data(np.random.RandomState(self.eval_seed))
+        return self._eval_data
+
+    def _epoch_plan(self):
+        """
+        Shuffle the training rows for a new epoch.
 
+        Returns
+        -------
+        df_shuffled : pandas.DataFrame
+        duration_indices : list
+            (start, stop) of the rows of df_shuffled in each batch
         """
         duration_indices = []
         start = 0
@@ -88,21 +127,27 @@ class GaitGeneratorFromDF:
             np.random.seed(self.seed)
         df_shuffled = self.df_train.iloc[np.random.permutation(self.num_rows), :]
         self.seed += 1
+        return df_shuffled, duration_indices
 
-        for start, stop in duration_indices:
-            info = self._convert_df_to_data(df_shuffled, start, stop)
-            yield info
-
-    def _convert_df_to_data(self, df_shuffled, start, stop):
-
+    def _convert_df_to_data(self, df_shuffled, start, stop, rng=None):
+        """
+        Build the batch of the rows [start, stop) of df_shuffled. The random draws are taken from rng
+        (numpy.random.RandomState), or from the global numpy random state if rng is None.
+        """
         selected_df = df_shuffled.iloc[start:stop, :].copy()
-        output_arr, times = self._loop_for_array_construction(selected_df, self.m)
-        output_arr_test, _ = self._loop_for_array_construction(self.df_test, self.m)
+        output_arr, times = self._loop_for_array_construction(selected_df, self.m, rng)
+        output_arr_test, _ = self._loop_for_array_construction(self.df_test, self.m, rng)
         output_arr = output_arr.reshape(self.m, self.n, 25 * 3)
         output_arr_test = output_arr_test.reshape(self.m, self.n, 25 * 3)
         return (output_arr, output_arr_test), times
 
-    def _loop_for_array_construction(self, df, num_samples):
+    def _convert_df_to_eval_data(self, rng):
+        output_arr_test, times = self._loop_for_array_construction(self.df_test, self.m, rng)
+        output_arr_test = output_arr_test.reshape(self.m, self.n, 25 * 3)
+        return output_arr_test, times
+
+    def _loop_for_array_construction(self, df, num_samples, rng=None):
+        rng = np.random if rng is None else rng
         output_arr = np.zeros((num_samples, self.n, 25, 3))
 
         for i in range(num_samples):
@@ -111,7 +156,7 @@ class GaitGeneratorFromDF:
             label = df["tasks"].iloc[i] / self.label_range  # numpy.int64
 
             # Slice to the receptive window
-            slice_start = np.random.choice(fea_vec.shape[0] - self.n)
+            slice_start = rng.choice(fea_vec.shape[0] - self.n)
             fea_vec_sliced = fea_vec[slice_start:slice_start + self.n, :, :]
 
             # Expand label to match fea_vec_sliced
@@ -132,19 +177,25 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
 
         data_gen = GaitGeneratorFromDFforTemporalVAE(df_pickle_path, m, n, 0.95)
 
-        for (features_train, labels_train), (features_test, labels_test) in data_gen.iterator():
+        for (features_train, masks_train, ...) in data_gen.iterator():
             ...
+        features_test, masks_test, ... = data_gen.eval_data()
 
-    where features_train/test has shape (m, num_features=50, n), and labels_train/test has shape (m, )
+    where features_train has shape (m, num_features=50, n), and features_test has shape (eval_size, 50, n) (more rows
+    with gait_print). Unlike the base class, the iterator yields the training batches only, not (train_info,
+    test_info) pairs: the test set is a fixed batch, drawn once by eval_data().
 
     """
 
-    def __init__(self, df_pickle_path, m=32, n=128, train_portion=0.95, seed=None, gait_print=False):
+    def __init__(self, df_pickle_path, m=32, n=128, train_portion=0.95, seed=None, gait_print=False, eval_size=4,
+                 batch_sampler=None):
         """
 
         Parameters
         ----------
         df_pickle_path : str
+            Part-2 output of common.feature_extraction.FeatureExtractorForODE, either a feature store (.npz, memory-
+            mapped) or a dataframe pickle.
         m : int
             Number of samples drawn from training set for each iteration
         n : int
@@ -154,6 +205,14 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
             it is overridden by setting a particular number and no longer meaningful. See self._split_train_test() method.
         seed : int
             Random seed for data generator.
+        gait_print : bool
+            Complete the gait print of the patients in each batch. See self._complete_gaitprint() method.
+        eval_size : int
+            Number of samples drawn from the test set for the (fixed) evaluation batch of self.eval_data().
+        batch_sampler : PatientBatchSampler or None
+            If given, the training batches are drawn by it (patients, then tasks of each patient) instead of being
+            consecutive rows of the shuffled training set, and m is set to its batch_size. The gait print completion
+            of the training batches is then skipped, as the sampler already provides several tasks per patient.
 
         """
 
@@ -166,7 +225,7 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
         super(GaitGeneratorFromDFforTemporalVAE, self).__init__(df_pickle_path, m, n, train_portion, seed)
         self.batch_shape = (m, self.total_fea_dims, n)
         self.gait_print = gait_print
-        self.mt = 4  # number of samples to be drawn for test set
+        self.mt = eval_size  # number of samples to be drawn for test set
 
         # Get number of unique patients
         self.num_uni_patients = self._get_num_uni_patients()
@@ -174,6 +233,15 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
         # Construct df filtered out the nan
         self.df_nonan = self._construct_filtered_df()
 
+        # Index of the rows of df_nonan by patient and task, for completing the gait prints
+        self.gaitprint_index = self._construct_gaitprint_index()
+
+        self.batch_sampler = batch_sampler
+        if self.batch_sampler is not None:
+            self.batch_sampler.build(self.df_nonan, self.gaitprint_index)
+            self.m = self.batch_sampler.batch_size
+            self.batch_shape = (self.m, self.total_fea_dims, n)
+
         self.pheno_stats = []
 
     def _split_train_test(self):
@@ -183,54 +251,56 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
         df_train = self.df.loc[train_index].copy()
         return df_train, df_test
 
-    def _convert_df_to_data(self, df_shuffled, start, stop):
+    def _epoch_plan(self):
+        if self.batch_sampler is None:
+            return super(GaitGeneratorFromDFforTemporalVAE, self)._epoch_plan()
+
+        # One epoch has as many batches as the consecutive slicing of the training set would give
+        if self.seed is not None:
+            np.random.seed(self.seed)
+            self.seed += 1
+        num_batches = max(self.num_rows // self.m, 1)
+        rows = self.batch_sampler.sample(num_batches, np.random)
+        duration_indices = [(start, start + self.m) for start in range(0, num_batches * self.m, self.m)]
+        return self.df_nonan.iloc[rows], duration_indices
+
+    def _convert_df_to_data(self, df_shuffled, start, stop, rng=None):
         selected_df = df_shuffled.iloc[start:stop, :].copy()
+        if self.gait_print and self.batch_sampler is None:
+            selected_df, num_uni_ids_pheno_train = self._complete_gaitprint(selected_df, rng)
+            #self.pheno_stats = self.pheno_stats + num_uni_ids_pheno_train
+        return self._construct_batch(selected_df, rng)
 
+    def _convert_df_to_eval_data(self, rng):
+        selected_df_test = self.df_test.sample(n=self.mt, random_state=rng)
         if self.gait_print:
-            selected_df, num_uni_ids_pheno_train = self._complete_gaitprint(selected_df)
-            selected_df_test, num_uni_ids_pheno_test = self._complete_gaitprint(self.df_test.sample(n=self.mt))
-            #self.pheno_stats = self.pheno_stats + num_uni_ids_pheno_train
-        else:
-            selected_df_test = self.df_test.sample(n=self.mt)
+            selected_df_test, num_uni_ids_pheno_test = self._complete_gaitprint(selected_df_test, rng)
+        return self._construct_batch(selected_df_test, rng)
 
-        # Retrieve train data
-        x_train_info, fut_train_info, task_train_info, pheno_train_info, towards_train, leg_train_info, idpatients = self._loop_for_array_construction(
+    def _construct_batch(self, selected_df, rng=None):
+        x_info, fut_info, task_info, pheno_info, towards, leg_info, idpatients = self._loop_for_array_construction(
             selected_df,
-            selected_df.shape[0])
-        x_train, x_train_masks = x_train_info
-        fut_train, fut_train_masks, fut_avail_train_mask = fut_train_info
-        task_train, task_train_masks = task_train_info
-        pheno_train, pheno_train_masks = pheno_train_info
-        leg_train, leg_train_masks = leg_train_info
-
-        # Retrieve test data
-        x_test_info, fut_test_info, task_test_info, pheno_test_info, towards_test, leg_test_info, idpatients_test = self._loop_for_array_construction(
-            selected_df_test,
-            selected_df_test.shape[0])
-
-        x_test, x_test_masks = x_test_info
-        fut_test, fut_test_masks, fut_avail_test_mask = fut_test_info
-        task_test, task_test_masks = task_test_info
-        pheno_test, pheno_test_masks = pheno_test_info
-        leg_test, leg_test_masks = leg_test_info
-
-        # Combine as output
-        train_info = (x_train, x_train_masks, fut_train, fut_train_masks, fut_avail_train_mask, task_train, task_train_masks, pheno_train, pheno_train_masks,
-                      towards_train, leg_train, leg_train_masks, idpatients)
-        test_info = (x_test, x_test_masks, fut_test, fut_test_masks, fut_avail_test_mask, task_test, task_test_masks, pheno_test, pheno_test_masks,
-                     towards_test, leg_test, leg_test_masks, idpatients_test)
-
-        return train_info, test_info
-
-    def _loop_for_array_construction(self, df, num_samples):
+            selected_df.shape[0], rng)
+        x, x_masks = x_info
+        fut, fut_masks, fut_avail_mask = fut_info
+        task, task_masks = task_info
+        pheno, pheno_masks = pheno_info
+        leg, leg_masks = leg_info
+        return (x, x_masks, fut, fut_masks, fut_avail_mask, task, task_masks, pheno, pheno_masks, towards, leg,
+                leg_masks, idpatients)
+
+    def _loop_for_array_construction(self, df, num_samples, rng=None):
         """
 
         Parameters
         ----------
         df : pandas.DataFrame
-            Dataframe with columns "features" (numpy.darray (num_frames, 25, 2)) and "labels" (numpy.int64)
+            Dataframe with the label columns, and "frame_starts" and "frame_counts" of the rows in the concatenated
+            buffers self.features_buffer and self.masks_buffer
         num_samples : int
             Size of the sampled data
+        rng : numpy.random.RandomState or None
+            Source of the random window starts. The global numpy random state if None
 
         Returns
         -------
@@ -240,15 +310,15 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
             It has shape (num_samples, ) numpy.int64 [0, 7], as the labels for visualisation
 
         """
-        # fea_vec/fea_mask_vec ~ (num_frames, 25, 2), task ~ int, task_mask ~ bool (True for non-nan, False for nan)
+        # task ~ int, task_mask ~ bool (True for non-nan, False for nan)
         # pheno ~ int, pheno_mask ~ bool (True for non-nan, False for nan), towards ~ int (0=unknown, 1=left, 2=right)
         # leg ~ float, leg_mask ~ bool (True for non-nan, False for nan), idpatients  int, fut_avail_mask ~ bool (True when future is available)
-        select_list = ["features", "feature_masks", "tasks", "task_masks", "phenos", "pheno_masks",
+        select_list = ["tasks", "task_masks", "phenos", "pheno_masks",
                        "towards_camera", "leg", "leg_masks", "idpatients", "fut_avail_mask"]
 
         df_np = np.asarray(df[select_list].iloc[0:num_samples])
 
-        fea_vec, fea_mask_vec, task, task_mask, pheno, pheno_mask, towards, leg, leg_mask, idpatients, fut_avail_mask = list(df_np.T)
+        task, task_mask, pheno, pheno_mask, towards, leg, leg_mask, idpatients, fut_avail_mask = list(df_np.T)
 
         task, task_mask = task.astype(np.int), task_mask.astype(np.bool)
         pheno, pheno_mask = pheno.astype(np.int), pheno_mask.astype(np.bool)
@@ -256,42 +326,49 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
         idpatients = idpatients.astype(np.float)
         fut_avail_mask = fut_avail_mask.astype(np.bool)
 
-        features_arr = np.zeros((num_samples, self.total_fea_dims, self.n))
-        fea_masks_arr = np.zeros(features_arr.shape)
+        # Draw the window start of every sample (the same draws as np.random.choice for each sample in turn)
+        frame_starts = np.asarray(df["frame_starts"].iloc[0:num_samples], dtype=np.int64)
+        frame_counts = np.asarray(df["frame_counts"].iloc[0:num_samples], dtype=np.int64)
+        fut_dims = np.where(fut_avail_mask, self.fut_dim, 0)
+        rng = np.random if rng is None else rng
+        slice_starts = rng.randint(0, frame_counts - self.n - fut_dims)
+        window_starts = frame_starts + slice_starts
 
-        fut_features_arr = np.zeros((num_samples, self.total_fea_dims, self.fut_dim))
-        fut_fea_masks_arr = np.zeros(fut_features_arr.shape)
+        # Gather the windows from the concatenated buffers
+        features_arr, fea_masks_arr = self._gather_windows(window_starts, self.n)
+        fut_features_arr, fut_fea_masks_arr = self._gather_windows(window_starts + self.n, self.fut_dim)
+        fut_features_arr[fut_avail_mask == False] = 0
+        fut_fea_masks_arr[fut_avail_mask == False] = False
 
-        for i in range(num_samples):
-            if fut_avail_mask[i]:
-                fut_dim = self.fut_dim
-            else:
-                fut_dim = 0
-
-            # Slice to the receptive window
-            slice_start = np.random.choice(fea_vec[i,].shape[0] - self.n - fut_dim)
-            fea_vec_sliced = fea_vec[i][slice_start:slice_start + self.n, :, :]
-            fea_mask_vec_sliced = fea_mask_vec[i][slice_start:slice_start + self.n, :, :]
-
-            # Construct output
-            x_end_idx, y_end_idx = self.keyps_x_dims, self.keyps_x_dims + self.keyps_y_dims
-            features_arr[i, 0:x_end_idx, :] = fea_vec_sliced[:, :, 0].T  # Store x-coordinates
-            features_arr[i, x_end_idx:y_end_idx, :] = fea_vec_sliced[:, :, 1].T  # Store y-coordinates
-            fea_masks_arr[i, 0:x_end_idx, :] = fea_mask_vec_sliced[:, :, 0].T  # Store x-coordinates
-            fea_masks_arr[i, x_end_idx:y_end_idx, :] = fea_mask_vec_sliced[:, :, 1].T  # Store y-coordinates
+        return (features_arr, fea_masks_arr), (fut_features_arr, fut_fea_masks_arr, fut_avail_mask), (task, task_mask), (pheno, pheno_mask), towards, \
+               (leg, leg_mask), idpatients
 
-            if fut_avail_mask[i]:
-                fut_fea_vec_sliced = fea_vec[i][slice_start + self.n:slice_start + self.n + self.fut_dim, :, :]
-                fut_fea_mask_vec_sliced = fea_mask_vec[i][slice_start + self.n:slice_start + self.n + self.fut_dim, :, :]
+    def _gather_windows(self, window_starts, window_size):
+        """
+        Gather the features and masks of the frames [start, start + window_size) for all starts at once. Frames beyond
+        the end of the buffers are clipped, and are expected to be zeroed by the caller.
 
-                fut_features_arr[i, 0:x_end_idx, :] = fut_fea_vec_sliced[:, :, 0].T
-                fut_features_arr[i, x_end_idx:y_end_idx, :] = fut_fea_vec_sliced[:, :, 1].T
-                fut_fea_masks_arr[i, 0:x_end_idx, :] = fut_fea_mask_vec_sliced[:, :, 0].T
-                fut_fea_masks_arr[i, x_end_idx:y_end_idx, :] = fut_fea_mask_vec_sliced[:, :, 1].T
+        Returns
+        -------
+        features_arr : numpy.darray
+            float32 with shape (num_samples, 50, window_size). x-coordinates in rows 0:25, y-coordinates in 25:50
+        fea_masks_arr : numpy.darray
+            bool with the same shape as features_arr
+        """
+        frame_indexes = window_starts.reshape(-1, 1) + np.arange(window_size).reshape(1, -1)
+        frame_indexes = np.minimum(frame_indexes, self.features_buffer.shape[0] - 1)
 
+        # (num_samples, window_size, 25, 2) -> (num_samples, 2, 25, window_size) -> (num_samples, 50, window_size)
+        features_windows = self.features_buffer[frame_indexes]
+        features_arr = features_windows.transpose(0, 3, 2, 1).reshape(-1, self.total_fea_dims, window_size)
+        features_arr = np.ascontiguousarray(features_arr, dtype=np.float32)
 
-        return (features_arr, fea_masks_arr), (fut_features_arr, fut_fea_masks_arr, fut_avail_mask), (task, task_mask), (pheno, pheno_mask), towards, \
-               (leg, leg_mask), idpatients
+        # Masks are unpacked only for the gathered frames
+        # (num_samples, window_size, 25) -> (num_samples, 25, window_size) -> (num_samples, 50, window_size)
+        masks_windows = np.unpackbits(self.masks_buffer[frame_indexes], axis=-1, count=self.keyps_x_dims).view(bool)
+        masks_windows = masks_windows.transpose(0, 2, 1)
+        fea_masks_arr = np.concatenate([masks_windows, masks_windows], axis=1)  # x and y share the keypoint's mask
+        return features_arr, fea_masks_arr
 
     def _get_num_uni_patients(self):
         idpatients = self.df["idpatients"]
@@ -310,35 +387,304 @@ class GaitGeneratorFromDFforTemporalVAE(GaitGeneratorFromDF):
         self.df_train["idpatients"] = self.df_train["idpatients"].apply(lambda x: conversion_dict.get(x, np.nan))
         self.df_test["idpatients"] = self.df_test["idpatients"].apply(lambda x: conversion_dict.get(x, np.nan))
 
-    def _complete_gaitprint(self, df):
-
-        id_nan_mask = df["idpatients"].isnull() == False
-        current_uni_ids = np.unique(df[id_nan_mask]["idpatients"])
-
-        indexes_to_add = []
-        sum_uni_ids_with_pheno = 0
-        for uni_id in current_uni_ids:
-
-            df_patient_tasks = self.df_nonan[self.df_nonan["idpatients"] == uni_id]["tasks"]
-            grand_id_tasks = np.unique(df_patient_tasks)
+    def _complete_gaitprint(self, df, rng=None):
+        """
+        Append to df one randomly drawn row of self.df_nonan for each task that a patient of df has in self.df_nonan,
+        but not in df.
 
-            uni_id_tasks = np.unique(df[(df["idpatients"] == uni_id)]["tasks"])
+        Parameters
+        ----------
+        df : pandas.DataFrame
+        rng : numpy.random.RandomState or None
+            Global numpy random state if None.
 
-            for grand_id_tasks_each in grand_id_tasks:
-                if grand_id_tasks_each not in uni_id_tasks:
-                    add_indexes = df_patient_tasks[df_patient_tasks == grand_id_tasks_each].index
-                    if add_indexes.shape[0] == 0:
-                        continue
-                    sampled_add_index = list(np.random.choice(add_indexes, size=1))
-                    indexes_to_add += sampled_add_index
-            if list(df[(df["idpatients"] == uni_id)]["pheno_masks"])[0] == True :
-                sum_uni_ids_with_pheno += 1
-        df_to_append = self.df_nonan.loc[indexes_to_add]
+        Returns
+        -------
+        df : pandas.DataFrame
+            Input df with the completing rows appended.
+        sum_uni_ids_with_pheno : int
+            Number of unique patients in the input df whose (first) row has a phenotype label.
+        """
+        rng = np.random if rng is None else rng
+        task_values, pair_keys, pair_offsets, pair_rows, patient_offsets = self.gaitprint_index
+
+        idpatients = df["idpatients"].to_numpy(dtype=np.float64)
+        id_nonan_mask = np.isnan(idpatients) == False
+        current_uni_ids, first_indexes = np.unique(idpatients[id_nonan_mask], return_index=True)
+        current_uni_ids = current_uni_ids.astype(np.int64)
+        pheno_masks = df["pheno_masks"].to_numpy()[id_nonan_mask]
+        sum_uni_ids_with_pheno = int(np.sum(pheno_masks[first_indexes] == True))
+
+        # (patient, task) pairs of the patients in df, sorted by patient then task
+        pair_starts, pair_stops = patient_offsets[current_uni_ids], patient_offsets[current_uni_ids + 1]
+        num_pairs = pair_stops - pair_starts
+        pairs = np.arange(num_pairs.sum()) + np.repeat(pair_starts - (np.cumsum(num_pairs) - num_pairs), num_pairs)
+
+        # Pairs not present in df get one of their rows, drawn in the order of the pairs
+        batch_keys = self._gaitprint_keys(idpatients[id_nonan_mask], df["tasks"].to_numpy()[id_nonan_mask])
+        missing_pairs = pairs[np.isin(pair_keys[pairs], batch_keys) == False]
+        if missing_pairs.shape[0] > 0:
+            sampled = rng.randint(0, pair_offsets[missing_pairs + 1] - pair_offsets[missing_pairs])
+            df_to_append = self.df_nonan.iloc[pair_rows[pair_offsets[missing_pairs] + sampled]]
+        else:
+            df_to_append = self.df_nonan.iloc[[]]
         df = pd.concat([df, df_to_append], axis=0)
 
         return df, sum_uni_ids_with_pheno
 
+    def _construct_gaitprint_index(self):
+        """
+        CSR-style index of the rows of self.df_nonan by (patient, task) pair.
+
+        Returns
+        -------
+        task_values : numpy.darray
+            Sorted unique tasks of self.df_nonan. A pair is keyed by idpatient * len(task_values) + task position.
+        pair_keys : numpy.darray
+            Sorted keys of the pairs present in self.df_nonan.
+        pair_offsets : numpy.darray
+            Rows of pair i are pair_rows[pair_offsets[i]:pair_offsets[i + 1]].
+        pair_rows : numpy.darray
+            Positions in self.df_nonan, grouped by pair and in the order of self.df_nonan within each pair.
+        patient_offsets : numpy.darray
+            Pairs of patient p are pair_keys[patient_offsets[p]:patient_offsets[p + 1]].
+        """
+        idpatients = self.df_nonan["idpatients"].to_numpy(dtype=np.float64)
+        tasks = self.df_nonan["tasks"].to_numpy()
+        task_values = np.unique(tasks)
+        row_keys = np.searchsorted(task_values, tasks) + idpatients.astype(np.int64) * task_values.shape[0]
+
+        pair_rows = np.argsort(row_keys, kind="stable")
+        pair_keys, pair_starts = np.unique(row_keys[pair_rows], return_index=True)
+        pair_offsets = np.append(pair_starts, row_keys.shape[0])
+        patient_offsets = np.searchsorted(pair_keys // max(task_values.shape[0], 1),
+                                          np.arange(self.num_uni_patients + 1))
+        return task_values, pair_keys, pair_offsets, pair_rows, patient_offsets
+
+    def _gaitprint_keys(self, idpatients, tasks):
+        # Keys of (patient, task) pairs as in self.gaitprint_index, -1 for tasks absent from self.df_nonan
+        task_values = self.gaitprint_index[0]
+        if task_values.shape[0] == 0:
+            return np.full(tasks.shape[0], -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(task_values, tasks), task_values.shape[0] - 1)
+        return np.where(task_values[positions] == tasks,
+                        positions + idpatients.astype(np.int64) * task_values.shape[0], -1)
+
     def _construct_filtered_df(self):
         mask = (self.df_train["idpatients"].isnull() == False) & (self.df_train["task_masks"] == True)
         df_nonan = self.df_train[mask]
         return df_nonan
+
+
+class PatientBatchSampler:
+    """
+    Draws fixed-size training batches of GaitGeneratorFromDFforTemporalVAE for PhenotypeNet: num_patients patients,
+    then tasks_per_patient rows of each of them, taken from the rows with patient and task labels (df_nonan).
+
+    Example of usage:
+
+        sampler = PatientBatchSampler(num_patients=8, tasks_per_patient=8, strategy="pheno_stratified")
+        data_gen = GaitGeneratorFromDFforTemporalVAE(df_pickle_path, n=128, seed=0, batch_sampler=sampler)
+
+    The tasks of a patient are drawn without replacement as long as the patient has untaken ones, then with
+    replacement to fill the tasks_per_patient slots. Each slot takes a random row of its (patient, task) pair.
+
+    Strategies for drawing the patients of a batch (without replacement within a batch, if there are enough):
+        "uniform": all patients are equally likely.
+        "label_balanced": each phenotype label (the patients without phenotype label count as one more label) is
+            equally likely, i.e. a patient is weighted by 1 / the number of patients with its label.
+        "pheno_stratified": each label gets a fixed number of patients per batch: one if num_patients allows it, the
+            rest proportional to its number of patients (largest remainder rounding).
+    """
+
+    strategies = ("uniform", "label_balanced", "pheno_stratified")
+
+    def __init__(self, num_patients=8, tasks_per_patient=8, strategy="uniform"):
+        if strategy not in self.strategies:
+            raise ValueError("strategy must be one of {}, got {}".format(self.strategies, strategy))
+        self.num_patients = num_patients
+        self.tasks_per_patient = tasks_per_patient
+        self.strategy = strategy
+        self.batch_size = num_patients * tasks_per_patient
+
+    def build(self, df_nonan, gaitprint_index):
+        """
+        Precompute the patients and their phenotype labels from the index of
+        GaitGeneratorFromDFforTemporalVAE._construct_gaitprint_index().
+
+        Parameters
+        ----------
+        df_nonan : pandas.DataFrame
+        gaitprint_index : tuple
+        """
+        _, _, self.pair_offsets, self.pair_rows, patient_offsets = gaitprint_index
+        num_pairs = np.diff(patient_offsets)
+        self.patients = np.nonzero(num_pairs > 0)[0]
+        if self.patients.shape[0] == 0:
+            raise ValueError("No rows with both patient and task labels to sample from")
+        self.patient_pair_starts = patient_offsets[self.patients]
+        self.patient_num_pairs = num_pairs[self.patients]
+
+        # Phenotype label of each patient from its first row, -1 for no label
+        first_rows = self.pair_rows[self.pair_offsets[self.patient_pair_starts]]
+        phenos = df_nonan["phenos"].to_numpy()[first_rows]
+        pheno_masks = df_nonan["pheno_masks"].to_numpy()[first_rows] == True
+        labels = np.where(pheno_masks, phenos, -1)
+        self.label_values, self.patient_labels, label_counts = np.unique(labels, return_inverse=True,
+                                                                          return_counts=True)
+        self.patient_weights = 1 / label_counts[self.patient_labels]
+        self.patient_weights /= self.patient_weights.sum()
+
+        # Number of patients per label in each batch for "pheno_stratified": one for each label if possible, the
+        # rest in proportion to the number of patients
+        min_quota = 1 if self.num_patients >= label_counts.shape[0] else 0
+        quotas = min_quota + label_counts * (self.num_patients - min_quota * label_counts.shape[0]) \
+            / self.patients.shape[0]
+        self.label_quotas = np.floor(quotas).astype(np.int64)
+        remainders_order = np.argsort(self.label_quotas - quotas, kind="stable")
+        self.label_quotas[remainders_order[:self.num_patients - self.label_quotas.sum()]] += 1
+        self.label_patients = [np.nonzero(self.patient_labels == label_idx)[0]
+                               for label_idx in range(self.label_values.shape[0])]
+
+    def sample(self, num_batches, rng):
+        """
+        Parameters
+        ----------
+        num_batches : int
+        rng : numpy.random.RandomState or numpy.random
+
+        Returns
+        -------
+        rows : numpy.darray
+            Positions in df_nonan of the rows of the batches, of shape (num_batches * batch_size, ), batch after batch.
+        """
+        patients = np.stack([self._sample_patients(rng) for _ in range(num_batches)]).reshape(-1)
+        num_pairs = self.patient_num_pairs[patients]
+
+        # Random permutation of the pairs of each patient, padded pairs sorted last. The first slots take the
+        # permutation, the slots beyond the patient's number of pairs take random positions in it.
+        max_pairs = max(num_pairs.max(), self.tasks_per_patient)
+        sort_keys = rng.rand(patients.shape[0], max_pairs)
+        sort_keys[np.arange(max_pairs) >= num_pairs[:, np.newaxis]] = np.inf
+        permutations = np.argsort(sort_keys, axis=1)
+        slots = np.arange(self.tasks_per_patient)[np.newaxis, :]
+        refill = rng.randint(0, np.repeat(num_pairs[:, np.newaxis], self.tasks_per_patient, axis=1))
+        slots = np.where(slots < num_pairs[:, np.newaxis], slots, refill)
+        pairs = self.patient_pair_starts[patients][:, np.newaxis] + np.take_along_axis(permutations, slots, axis=1)
+
+        # One random row of each (patient, task) pair
+        pairs = pairs.reshape(-1)
+        pair_starts = self.pair_offsets[pairs]
+        return self.pair_rows[pair_starts + rng.randint(0, self.pair_offsets[pairs + 1] - pair_starts)]
+
+    def _sample_patients(self, rng):
+        num_uni_patients = self.patients.shape[0]
+        replace = self.num_patients > num_uni_patients
+        if self.strategy == "uniform":
+            return rng.choice(num_uni_patients, size=self.num_patients, replace=replace)
+        if self.strategy == "label_balanced":
+            return rng.choice(num_uni_patients, size=self.num_patients, replace=replace, p=self.patient_weights)
+        sampled = []
+        for label_patients, quota in zip(self.label_patients, self.label_quotas):
+            sampled.append(rng.choice(label_patients, size=quota, replace=quota > label_patients.shape[0]))
+        return rng.permutation(np.concatenate(sampled))
+
+
+class PrefetchIterator:
+    """
+    Drop-in for data_gen.iterator() of GaitGeneratorFromDF and its subclasses, with the batches built ahead of time
+    by background threads while the consumer (e.g. the GPU) works on the current one.
+
+    Example of usage:
+
+        prefetcher = PrefetchIterator(data_gen, num_workers=2, seed=0)
+        for epoch in range(n_epochs):
+            for train_data in prefetcher.iterator():
+                ...
+
+    Batches are yielded in the same order as data_gen.iterator() (the shuffling of each epoch is unchanged). Batch i
+    is built by worker i % num_workers, with random draws (window starts, gait print) taken from a
+    numpy.random.RandomState seeded from (seed, epoch, i). The batches are hence reproducible for a given seed,
+    whatever num_workers (num_workers=0 builds them in the calling thread), but not identical to those of
+    data_gen.iterator(), which draws from the global state.
+    """
+
+    def __init__(self, data_gen, num_workers=2, queue_depth=2, seed=None, pin_memory=None):
+        """
+
+        Parameters
+        ----------
+        data_gen : GaitGeneratorFromDF
+        num_workers : int
+            Number of threads building batches. With 0, the batches are built serially when requested.
+        queue_depth : int
+            Maximum number of built batches waiting per worker.
+        seed : int or None
+            Root of the random streams of the batches. data_gen.seed (or 0) if None.
+        pin_memory : bool or None
+            If True, the arrays of the batches are copied into pinned memory by the workers, such that numpy2tensor()
+            and mask2tensor() copy them to the GPU asynchronously (they keep the pinned arrays referenced until the
+            copies have completed). If None, enabled when CUDA is available.
+        """
+        self.data_gen = data_gen
+        self.num_workers = num_workers
+        self.queue_depth = queue_depth
+        self.seed = seed if seed is not None else (data_gen.seed or 0)
+        if pin_memory is None:
+            import torch
+            pin_memory = torch.cuda.is_available()
+        self.pin_memory = pin_memory
+        self.epoch = 0
+
+    def __iter__(self):
+        return self.iterator()
+
+    def iterator(self):
+        df_shuffled, duration_indices = self.data_gen._epoch_plan()
+        epoch = self.epoch
+        self.epoch += 1
+
+        def build_batch(batch_idx):
+            rng = np.random.RandomState(np.random.MT19937(np.random.SeedSequence([self.seed, epoch, batch_idx])))
+            start, stop = duration_indices[batch_idx]
+            batch = self.data_gen._convert_df_to_data(df_shuffled, start, stop, rng=rng)
+            return pin_numpy_arrays(batch) if self.pin_memory else batch
+
+        if self.num_workers == 0:
+            for batch_idx in range(len(duration_indices)):
+                yield build_batch(batch_idx)
+            return
+
+        batch_queues = [queue.Queue(maxsize=self.queue_depth) for _ in range(self.num_workers)]
+        stop_event = threading.Event()
+
+        def put(q, item):
+            while not stop_event.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def build_batches(worker_idx):
+            try:
+                for batch_idx in range(worker_idx, len(duration_indices), self.num_workers):
+                    put(batch_queues[worker_idx], (build_batch(batch_idx), None))
+            except Exception as e:
+                put(batch_queues[worker_idx], (None, e))
+
+        workers = [threading.Thread(target=build_batches, args=(worker_idx,), daemon=True)
+                   for worker_idx in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+        try:
+            for batch_idx in range(len(duration_indices)):
+                batch, error = batch_queues[batch_idx % self.num_workers].get()
+                if error is not None:
+                    raise error
+                yield batch
+        finally:
+            # Also reached if the consumer stops early (break, exception or garbage-collected generator)
+            stop_event.set()
+            for worker in workers:
+                worker.join()
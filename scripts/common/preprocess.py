@@ -1,14 +1,26 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
 from glob import glob
 
-import matplotlib.pyplot as plt
 import numpy as np
 import skvideo.io as skv
 from skimage.transform import resize
 
 from .keypoints_format import openpose2detectron_indexes, openpose_L_indexes, openpose_R_indexes
-from .utils import fullfile, read_openpose_keypoints, read_and_select_openpose_keypoints, moving_average, \
-    OnlineFilter_scalar, OnlineFilter_np, extract_contagious
+from .visualisation import draw_keypoints_overlay
+from .utils import fullfile, read_openpose_pose_keypoints, read_and_select_openpose_keypoints, moving_average, \
+    OnlineFilter_scalar, OnlineFilter_np, extract_contagious, run_length_encoding, json2dict, dict2json, \
+    pack_openpose_keypoints, read_openpose_keypoints_archive, is_openpose_keypoints_archive, pad_people_keypoints, \
+    select_people_keypoints, preprocessed_openpose_format_version
 
 
 def reverse_flips(keyps):
@@ -67,8 +79,13 @@ def get_com(keypts_all):
     return com_l, com_r
 
 
-def save_data_openpose(save_path, video_size, cut_duration, keypoints_list, records=None):
+def save_data_openpose(save_path, video_size, cut_duration, keypoints_list, records=None, segments=None):
     """
+    Save the preprocessed keypoints as an uncompressed .npz file without pickled objects (format version 2). All
+    arrays can be read with np.load(allow_pickle=False), or memory-mapped (see common.utils.load_npz_member_mmap()).
+    See common.utils.read_preprocessed_openpose_data() for reading all arrays, and
+    common.utils.read_oenpose_preprocessed_keypoints() for reading only the keypoints.
+
     Args:
         video_size (tuple): Size of the video (width, height)
 
@@ -77,22 +94,41 @@ def save_data_openpose(save_path, video_size, cut_duration, keypoints_list, reco
         cut_duration (tuple): (start_index, end_index) between start and end is the duration of the preprocessed video compared to original
 
         keypoints_list (list): [keypoints_1, keypoints_2, ..., keypoints_k] for video with k frames. 
-                                keypoints_k ~ ndarray with shape (17, 3)
+                                keypoints_k ~ ndarray with shape (25, 3). Stored as "positions_2d" with float32.
 
         records (list): Optional. For saving records of how to transform keypoints to the new coordinate system, after cropping the video.
                         List of dictionarys [record_1, record_2, ..., record_k] for video with k frames.
-                        record_k = {'translation': X, # X = ndarray with shape (2, 1)
+                        record_k = {'translation': X, # X = ndarray with shape (1, 2)
                                     'resizing': Y, # Y = float
-                                    'bbox': Z } # Z = ndarray with shape (5, )                  
+                                    'bbox': Z } # Z = ndarray with shape (4, )
+                        Stored as columns "translation" (k, 2), "resizing" (k, ) and "bbox" (k, 4).
+
+        segments (ndarray): Optional. Shape (num_segments, 2). (start_index, end_index) of each contiguous segment with
+                            confident keypoints, in the frame indexes of the original video. Default: [cut_duration]
     Returns:
         None
     """
-
-    keypoints_list_np = np.asarray(keypoints_list)  # ndarray with shape (num_frames, 25, 3)
-    metadata = {'layout_name': 'body_25', 'num_joints': 25,
-                'keypoints_symmetry': [[12, 13, 14, 5, 6, 7], [9, 10, 11, 2, 3, 4]]}
-    vid_info = {'video_shape': video_size, 'cut_duration': cut_duration}
-    np.savez(save_path, metadata=metadata, positions_2d=keypoints_list_np, vid_info=vid_info, preprocess_info=records)
+    arrays = {
+        "format_version": np.array(preprocessed_openpose_format_version),
+        "positions_2d": np.asarray(keypoints_list, dtype=np.float32).reshape(-1, 25, 3),
+        "video_shape": np.asarray(video_size, dtype=np.int64),
+        "cut_duration": np.asarray(cut_duration, dtype=np.int64),
+        "segments": np.asarray(segments if segments is not None else [cut_duration], dtype=np.int64).reshape(-1, 2),
+        "layout_name": np.array("body_25"),
+        "num_joints": np.array(25),
+        "keypoints_symmetry": np.array([[12, 13, 14, 5, 6, 7], [9, 10, 11, 2, 3, 4]])
+    }
+    if records is not None:
+        arrays["translation"] = np.array([np.asarray(record["translation"]).reshape(2) for record in records],
+                                         dtype=np.int64).reshape(-1, 2)
+        arrays["resizing"] = np.array([record["resizing"] for record in records], dtype=np.float64)
+        arrays["bbox"] = np.array([record["bbox"] for record in records], dtype=np.int64).reshape(-1, 4)
+
+    # Write to a temporary file first, such that an interrupted run never leaves a truncated output
+    tmp_path = save_path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmp_path, save_path)
 
 
 def find_torso_length_from_keyps(keypoints_xy_input, padding):
@@ -124,21 +160,474 @@ def find_torso_length_from_keyps(keypoints_xy_input, padding):
     return torso_length, box_half_length, [ears_centre_xy, neck_xy, hip_centre_xy, ankle_centre_xy]
 
 
+def find_torso_lengths_from_keyps(keypoints_xy_input, padding):
+    """
+    Batch version of find_torso_length_from_keyps() for all frames at once.
+
+    Parameters
+    ==========
+    keypoints_xy_input : numpy.darray
+        (num_frames, 25, 3)
+    padding : int
+
+    Returns
+    -------
+    torso_lengths : numpy.darray
+        (num_frames, )
+    box_half_lengths : numpy.darray
+        (num_frames, )
+    central_points : numpy.darray
+        (num_frames, 4, 2), for ears' centre, neck, hip centre and ankles' centre. Ears' centre is nan if both ears
+        have zero confidence.
+    """
+    keypoints_xy = np.asarray(keypoints_xy_input, dtype=float)
+
+    # Mean of the ears with non-zero confidence, equivalent to the masked mean of the per-frame version
+    ears_valid = (keypoints_xy[:, [17, 18], 2] != 0)[:, :, np.newaxis]  # (num_frames, 2, 1)
+    ears_sum = np.sum(np.where(ears_valid, keypoints_xy[:, [17, 18], 0:2], 0), axis=1)
+    ears_count = np.sum(ears_valid, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ears_centre_xy = ears_sum / ears_count  # (num_frames, 2)
+    neck_xy = keypoints_xy[:, 1, 0:2]
+    hip_centre_xy = keypoints_xy[:, 8, 0:2]
+    ankle_centre_xy = np.mean(keypoints_xy[:, [11, 14], 0:2], axis=1)
+
+    def rowwise_norm(vecs):
+        # Same dot-product reduction as np.linalg.norm() on each (2, ) vector, to keep the results identical
+        return np.sqrt(np.matmul(vecs[:, np.newaxis, :], vecs[:, :, np.newaxis])[:, 0, 0])
+
+    # Norm of the fully masked ears' vector is 0 in the per-frame version
+    ears_neck_length = rowwise_norm(ears_centre_xy - neck_xy)
+    ears_neck_length[ears_count[:, 0] == 0] = 0
+    torso_lengths = ears_neck_length + rowwise_norm(neck_xy - hip_centre_xy) + rowwise_norm(
+        hip_centre_xy - ankle_centre_xy)
+
+    box_half_lengths = (torso_lengths / 2) * 1.3 + padding
+
+    central_points = np.stack([ears_centre_xy, neck_xy, hip_centre_xy, ankle_centre_xy], axis=1)
+    return torso_lengths, box_half_lengths, central_points
+
+
+def fill_missing_centres(centres, vid_w, vid_h):
+    """
+    Replace the non-finite centres (frames whose subject has no confident keypoint) by the last finite centre before
+    them, or by the centre of the frame if there is none.
+
+    Parameters
+    ----------
+    centres : numpy.darray
+        (num_frames, 2), (x, y) centres of the subject
+    vid_w, vid_h : int
+        Width and height of the video
+
+    Returns
+    -------
+    centres_filled : numpy.darray
+        (num_frames, 2)
+    """
+    finite = np.all(np.isfinite(centres), axis=1)
+    last_finite_indices = np.maximum.accumulate(np.where(finite, np.arange(finite.shape[0]), -1))
+    frame_centre = np.array([vid_w / 2, vid_h / 2])
+    return np.where((last_finite_indices >= 0)[:, np.newaxis], centres[np.maximum(last_finite_indices, 0)],
+                    frame_centre)
+
+
+def find_clipping_boxes(centres, box_half_lengths, vid_w, vid_h, cut_video_size):
+    """
+    Find the squared bounding boxes of all frames at once, shifted such that they do not cross the frame boundary.
+
+    Parameters
+    ----------
+    centres : numpy.darray
+        (num_frames, 2), smoothened (x, y) centres of the bounding boxes.
+    box_half_lengths : numpy.darray
+        (num_frames, ), temporally filtered half length of the bounding boxes.
+    vid_w, vid_h : int
+        Width and height of the video
+    cut_video_size : tuple
+        (width, height) of the output video
+
+    Returns
+    -------
+    bboxes : numpy.darray
+        (num_frames, 4) int, (x_min, y_min, x_max, y_max) of the bounding boxes after the boundary shifting.
+    translations : numpy.darray
+        (num_frames, 2) int, (x_min, y_min) of the bounding boxes before the boundary shifting.
+    resizing_factors : numpy.darray
+        (num_frames, ), ratio of the output video size to the bounding box length.
+    """
+    centre_x, centre_y = centres[:, 0], centres[:, 1]
+    bboxes = np.around(np.stack([
+        centre_x - box_half_lengths, centre_y - box_half_lengths,
+        centre_x + box_half_lengths, centre_y + box_half_lengths
+    ], axis=1)).astype(int)
+    translations = bboxes[:, 0:2].copy()
+
+    # Ensuring bounding box does not cross the frame boundary
+    x_diff = np.where(bboxes[:, 0] < 0, -bboxes[:, 0], 0) - np.where(bboxes[:, 2] > vid_w, bboxes[:, 2] - vid_w, 0)
+    y_diff = np.where(bboxes[:, 1] < 0, -bboxes[:, 1], 0) - np.where(bboxes[:, 3] > vid_h, bboxes[:, 3] - vid_h, 0)
+    bboxes += np.stack([x_diff, y_diff, x_diff, y_diff], axis=1)
+
+    resizing_factors = cut_video_size[0] / (bboxes[:, 2] - bboxes[:, 0])
+    return bboxes, translations, resizing_factors
+
+
+def transform_keypoints_to_bbox(keypoints, translations, resizing_factors, cut_video_size):
+    """
+    Vectorised keypoints transformation of OpenposePreprocessor._find_video_clipping_area() for all frames at once:
+    translation to the bounding box's coordinate system, resizing, and setting unconfident/out-of-box keypoints to nan.
+
+    Parameters
+    ----------
+    keypoints : numpy.darray
+        (num_frames, 25, 3), x, y and confidence of the selected subject.
+    translations : numpy.darray
+        (num_frames, 2), top-left corner (x, y) of the bounding box of each frame, before boundary correction.
+    resizing_factors : numpy.darray
+        (num_frames, ), ratio of the output video size to the bounding box length.
+    cut_video_size : tuple
+        (width, height) of the output video.
+
+    Returns
+    -------
+    keypoints_xy : numpy.darray
+        (num_frames, 25, 3), transformed copy of the keypoints.
+    """
+    keypoints_xy = np.array(keypoints, dtype=float)
+    translations = np.asarray(translations).reshape(-1, 1, 2)
+    resizing_factors = np.asarray(resizing_factors).reshape(-1, 1, 1)
+    keypoints_xy[:, :, 0:2] = keypoints_xy[:, :, 0:2] - translations
+    keypoints_xy[:, :, 0:2] = keypoints_xy[:, :, 0:2] * resizing_factors
+
+    # set unconfident data to nan
+    unconfident_mask = (keypoints_xy[:, :, 2] < 0.1) | \
+                       (keypoints_xy[:, :, 0] < 0) | (keypoints_xy[:, :, 0] > cut_video_size[0]) | \
+                       (keypoints_xy[:, :, 1] < 0) | (keypoints_xy[:, :, 1] > cut_video_size[1])
+    keypoints_xy[unconfident_mask, :] = np.nan
+    return keypoints_xy
+
+
+def video_shape_sidecar_path(input_video_path):
+    """
+    /data/videos_converted/vid.mp4 -> /data/videos_converted/vid.shape.json
+    """
+    return os.path.splitext(input_video_path)[0] + ".shape.json"
+
+
+def write_video_shape_sidecar(input_video_path):
+    """
+    Store the shape of the video (from its container metadata) into a side-car .json file, such that the
+    keypoints-only preprocessing does not need the video anymore.
+    """
+    num_frames, vid_h, vid_w, vid_channels = read_video_shape(input_video_path)
+    dict2json(video_shape_sidecar_path(input_video_path),
+              {"num_frames": num_frames, "height": vid_h, "width": vid_w, "channels": vid_channels})
+
+
+def read_video_shape(input_video_path):
+    """
+    Read the shape of the video without decoding any frame. The shape is taken from the side-car file (see
+    video_shape_sidecar_path()) if it exists, otherwise from the container metadata via ffprobe.
+
+    Returns
+    -------
+    video_shape : tuple
+        (num_frames, height, width, channels)
+    """
+    sidecar_path = video_shape_sidecar_path(input_video_path)
+    if os.path.isfile(sidecar_path):
+        shape_dict = json2dict(sidecar_path)
+        return shape_dict["num_frames"], shape_dict["height"], shape_dict["width"], shape_dict.get("channels", 3)
+    viddict = skv.ffprobe(input_video_path)["video"]
+    return int(viddict["@nb_frames"]), int(viddict["@height"]), int(viddict["@width"]), 3
+
+
+def crop_and_resize_frame(vid_frame, bbox, cut_video_size):
+    """
+    Crop the video frame to the bounding box, and resize it to cut_video_size.
+
+    Parameters
+    ----------
+    vid_frame : numpy.darray
+        (height, width, 3) video frame
+    bbox : numpy.darray
+        (4, ) int, (x_min, y_min, x_max, y_max) of the bounding box
+    cut_video_size : tuple
+        (height, width) of the output frame
+
+    Returns
+    -------
+    output_frame : numpy.darray
+        (cut_video_size[0], cut_video_size[1], 3) int, with range [0, 255]
+    """
+    output_frame = vid_frame[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+    output_frame = resize(output_frame, cut_video_size, anti_aliasing=True)
+    return np.around(output_frame * 255).astype(int)
+
+
+def render_cropped_video(vid_frames, vwriter, start_idx, bboxes, cut_video_size, num_workers=2, queue_depth=4,
+                         batch_size=8, progress_name="", frame_overlay=None):
+    """
+    Crop and resize the frames from start_idx to (start_idx + len(bboxes) - 1) of a video and encode them, with a
+    pipeline of bounded queues:
+        decoder thread --(batches of frames)--> worker threads (crop & resize) --(batches)--> encoder thread
+    such that decoding and encoding (the ffmpeg pipes) overlap with the crop/resize computation. The encoder writes
+    the batches in the order of the frames. An exception in any of the threads stops the pipeline and is re-raised.
+
+    Parameters
+    ----------
+    vid_frames : iterable
+        Video frames from the frame index 0, e.g. skvideo.io.FFmpegReader.nextFrame()
+    vwriter : skvideo.io.FFmpegWriter
+    start_idx : int
+        Frame index of the first frame to be rendered.
+    bboxes : numpy.darray
+        (num_frames, 4) int, bounding box of each rendered frame. See crop_and_resize_frame()
+    cut_video_size : tuple
+    num_workers : int
+        Number of crop/resize worker threads.
+    queue_depth : int
+        Maximum number of batches waiting in each of the two queues.
+    batch_size : int
+        Number of frames per batch.
+    progress_name : str
+        Name printed with the progress of encoding.
+    frame_overlay : callable
+        Optional. f(output_idx, output_frame) -> output_frame, applied to each cropped and resized frame in the worker
+        threads, e.g. draw_keypoints_overlay(). output_idx is the frame index relative to start_idx.
+
+    Returns
+    -------
+    num_rendered : int
+        Number of frames encoded.
+    """
+    num_frames = bboxes.shape[0]
+    decoded_queue = queue.Queue(maxsize=queue_depth)
+    resized_queue = queue.Queue(maxsize=queue_depth)
+    stop_event = threading.Event()
+    errors = []
+    num_rendered = [0]
+
+    def put(q, item):
+        while not stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(q):
+        # None is both the end-of-stream marker and the return value once the pipeline stops
+        while not stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def stop_on_error(stage_func):
+        def stage():
+            try:
+                stage_func()
+            except Exception as e:
+                errors.append(e)
+                stop_event.set()
+        return stage
+
+    @stop_on_error
+    def decode():
+        try:
+            batch, batch_idx = [], 0
+            for frame_idx, vid_frame in enumerate(vid_frames):
+                if stop_event.is_set() or frame_idx >= start_idx + num_frames:
+                    break
+                if frame_idx < start_idx:
+                    continue
+                batch.append(vid_frame)
+                if len(batch) == batch_size:
+                    put(decoded_queue, (batch_idx, batch_idx * batch_size, batch))
+                    batch, batch_idx = [], batch_idx + 1
+            if len(batch) > 0:
+                put(decoded_queue, (batch_idx, batch_idx * batch_size, batch))
+        finally:
+            for _ in range(num_workers):
+                put(decoded_queue, None)
+
+    @stop_on_error
+    def crop_and_resize():
+        try:
+            while True:
+                item = get(decoded_queue)
+                if item is None:
+                    break
+                batch_idx, first_idx, batch = item
+                output_frames = [crop_and_resize_frame(vid_frame, bboxes[first_idx + i], cut_video_size)
+                                 for i, vid_frame in enumerate(batch)]
+                if frame_overlay is not None:
+                    output_frames = [frame_overlay(first_idx + i, output_frame)
+                                     for i, output_frame in enumerate(output_frames)]
+                put(resized_queue, (batch_idx, output_frames))
+        finally:
+            put(resized_queue, None)
+
+    @stop_on_error
+    def encode():
+        pending_batches = dict()
+        next_batch_idx, num_finished_workers = 0, 0
+        while num_finished_workers < num_workers:
+            item = get(resized_queue)
+            if stop_event.is_set():
+                break
+            if item is None:
+                num_finished_workers += 1
+                continue
+            pending_batches[item[0]] = item[1]
+            while next_batch_idx in pending_batches:
+                for output_frame in pending_batches.pop(next_batch_idx):
+                    vwriter.writeFrame(output_frame)
+                    num_rendered[0] += 1
+                next_batch_idx += 1
+                print("\r{}: {}/{}".format(progress_name, num_rendered[0], num_frames), flush=True, end="")
+
+    threads = [threading.Thread(target=decode), threading.Thread(target=encode)]
+    threads += [threading.Thread(target=crop_and_resize) for _ in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return num_rendered[0]
+
+
+def ffmpeg_crop_commands(bboxes, vid_w, vid_h, filter_name="crop@box"):
+    """
+    Write the sendcmd script which sets the crop area of the ffmpeg crop filter "filter_name" in every frame.
+    The frame index is used as the timestamp (in seconds) of each frame, see render_cropped_video_ffmpeg().
+
+    Parameters
+    ----------
+    bboxes : numpy.darray
+        (num_frames, 4) int, (x_min, y_min, x_max, y_max) of the bounding box of each frame
+    vid_w, vid_h : int
+        Width and height of the video. The bounding boxes are clipped to the frame.
+
+    Returns
+    -------
+    crop_areas : numpy.darray
+        (num_frames, 4) int, (width, height, x, y) of the crop area of each frame
+    commands : str
+        Content of the sendcmd script
+    """
+    x_min = np.clip(bboxes[:, 0], 0, vid_w - 1)
+    y_min = np.clip(bboxes[:, 1], 0, vid_h - 1)
+    x_max = np.clip(bboxes[:, 2], x_min + 1, vid_w)
+    y_max = np.clip(bboxes[:, 3], y_min + 1, vid_h)
+    crop_areas = np.stack([x_max - x_min, y_max - y_min, x_min, y_min], axis=1).astype(int)
+
+    # Each command is sent half a frame before the frame, to be robust against timestamp rounding
+    commands = []
+    for frame_idx, (crop_w, crop_h, crop_x, crop_y) in enumerate(crop_areas):
+        commands.append("{:.1f} {name} w {}, {name} h {}, {name} x {}, {name} y {};".format(
+            max(frame_idx - 0.5, 0), crop_w, crop_h, crop_x, crop_y, name=filter_name))
+    return crop_areas, "\n".join(commands) + "\n"
+
+
+def render_cropped_video_ffmpeg(input_video_path, output_video_path, start_idx, bboxes, vid_w, vid_h,
+                                cut_video_size, ffmpeg_path="ffmpeg"):
+    """
+    Crop the frames from start_idx to (start_idx + len(bboxes) - 1) of a video to their bounding boxes, and scale
+    them to cut_video_size, in a single ffmpeg invocation. The per-frame crop areas are sent to ffmpeg's crop filter
+    by a sendcmd script, so no frame passes through Python.
+
+    The scaling is ffmpeg's "area" interpolation instead of the anti-aliased resizing of skimage, hence the pixel
+    values are slightly different from render_cropped_video().
+
+    Parameters
+    ----------
+    input_video_path : str
+    output_video_path : str
+    start_idx : int
+        Frame index of the first frame to be rendered.
+    bboxes : numpy.darray
+        (num_frames, 4) int, bounding box of each rendered frame. See ffmpeg_crop_commands()
+    vid_w, vid_h : int
+    cut_video_size : tuple
+        (height, width) of the output video
+    ffmpeg_path : str
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If ffmpeg fails. Its error messages are in the exception's "stderr".
+    """
+    crop_areas, commands = ffmpeg_crop_commands(bboxes, vid_w, vid_h)
+    fd, commands_path = tempfile.mkstemp(suffix=".cmd", prefix="crop_")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            fh.write(commands)
+        crop_w, crop_h, crop_x, crop_y = crop_areas[0]
+        filters = [
+            "trim=start_frame={}:end_frame={}".format(start_idx, start_idx + bboxes.shape[0]),
+            "setpts=N/TB",  # timestamp = frame index in seconds, as addressed by the sendcmd script
+            "format=rgb24",
+            "sendcmd=f={}".format(commands_path),
+            "crop@box=w={}:h={}:x={}:y={}".format(crop_w, crop_h, crop_x, crop_y),
+            "scale={}:{}:flags=area".format(cut_video_size[1], cut_video_size[0]),
+            "setpts=N/FRAME_RATE/TB",
+            "format=yuv420p"
+        ]
+        subprocess.run([ffmpeg_path, "-y", "-loglevel", "error", "-i", input_video_path, "-an",
+                        "-vf", ",".join(filters), output_video_path],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(commands_path)
+
+
 class VideoManager():
-    def __init__(self, input_video_path, output_video_path):
-        self.vreader = skv.FFmpegReader(input_video_path)
-        self.vwriter = skv.FFmpegWriter(output_video_path)
+    def __init__(self, input_video_path, output_video_path, decode_video=True):
+        """
+        Parameters
+        ----------
+        input_video_path : str
+        output_video_path : str
+        decode_video : bool
+            If False, the video is neither decoded nor written. Only its shape is read by read_video_shape().
+        """
+        self.input_video_path, self.output_video_path = input_video_path, output_video_path
+        # The video is written to a temporary path (with the same extension, for the container format) and moved to
+        # output_video_path by finalize_output_video(), such that an interrupted run never leaves a truncated video
+        self.output_video_tmp_path = "{}.tmp{}".format(*os.path.splitext(output_video_path))
         self.vid_name = fullfile(input_video_path)[0]
         self.vid_name_root = fullfile(input_video_path)[1][1]
-        self.num_frames, self.vid_h, self.vid_w, self.vid_channels = self.vreader.getShape()
+        if decode_video:
+            self.vreader = skv.FFmpegReader(input_video_path)
+            self.vwriter = skv.FFmpegWriter(self.output_video_tmp_path)
+            self.num_frames, self.vid_h, self.vid_w, self.vid_channels = self.vreader.getShape()
+        else:
+            self.vreader, self.vwriter = None, None
+            self.num_frames, self.vid_h, self.vid_w, self.vid_channels = read_video_shape(input_video_path)
+
+    def finalize_output_video(self):
+        """
+        Close the output video and move it from its temporary path to output_video_path.
+        """
+        if self.vwriter is not None:
+            self.vwriter.close()
+            self.vwriter = None
+        if os.path.isfile(self.output_video_tmp_path):
+            os.replace(self.output_video_tmp_path, self.output_video_path)
 
     def __del__(self):
-        self.vreader.close()
-        self.vwriter.close()
+        if self.vreader is not None:
+            self.vreader.close()
+        if self.vwriter is not None:
+            self.vwriter.close()
 
 
 class OpenposePreprocessor(VideoManager):
-    def __init__(self, input_video_path, openpose_data_each_video_dir, output_video_path, output_data_path):
+    def __init__(self, input_video_path, openpose_data_each_video_dir, output_video_path, output_data_path,
+                 keypoints_only=False, selection_rule="rightmost", min_segment_length=1):
         """
         Preprocess each video (raw video file and the corresponding keypoints inferred by OpenPose)
 
@@ -146,57 +635,89 @@ class OpenposePreprocessor(VideoManager):
         ----------
         input_video_path : str
         openpose_data_each_video_dir : str
-            Each directory has the same name of the video, and holds the keypoints of every video frame as separate file
+            Each directory has the same name of the video, and holds the keypoints of every video frame as separate file.
+            It can also be the consolidated keypoints archive of the video (see pack_openpose_keypoints_wrapper()).
         output_video_path : str
         output_data_path : str
+        keypoints_only : bool
+            If True, the video is never decoded, and only the keypoints are preprocessed. The video shape is read from
+            the side-car file or container metadata instead (see read_video_shape()).
+        selection_rule : str or callable
+            Rule to select the patient among the people detected in each frame.
+            See common.utils.select_people_keypoints()
+        min_segment_length : int
+            Minimum number of frames of a contiguous segment with confident keypoints. Shorter segments are discarded.
+            See self._find_extracted_duration(). Part-2 (FeatureExtractorForODE) makes a row of each segment, without
+            the frames between them.
         """
+        params = self.preprocess_params(selection_rule=selection_rule, min_segment_length=min_segment_length)
+        self.keypoints_only = keypoints_only
+        self.selection_rule = selection_rule
         self.op_data_each_video_dir = openpose_data_each_video_dir
         self.output_data_path = output_data_path
         self.all_keyps_dicts, self.all_num_people = [], []
-        self.keyps_confidence_threshold = -0.2
-        self.cut_padding = 0
-        self.cut_video_size = (250, 250)
-        self.box_length_filter = OnlineFilter_scalar(kernel_size=15)
-        self.keypoints_filter = OnlineFilter_np(input_size=(25, 2), kernel_size=3)
-        super(OpenposePreprocessor, self).__init__(input_video_path, output_video_path)
+        self.keyps_confidence_threshold = params["keyps_confidence_threshold"]
+        self.min_segment_length = params["min_segment_length"]
+        self.cut_padding = params["cut_padding"]
+        self.cut_video_size = tuple(params["cut_video_size"])
+        self.box_length_filter = OnlineFilter_scalar(kernel_size=params["box_length_kernel_size"])
+        self.keypoints_filter = OnlineFilter_np(input_size=(25, 2), kernel_size=params["keypoints_kernel_size"])
+        super(OpenposePreprocessor, self).__init__(input_video_path, output_video_path,
+                                                   decode_video=not keypoints_only)
+
+    @staticmethod
+    def preprocess_params(selection_rule="rightmost", min_segment_length=1):
+        """
+        Parameters which determine the preprocessed output. They are recorded in the preprocessing manifest (see
+        openpose_preprocess_wrapper()), such that a change of any of them triggers the reprocessing.
+
+        Returns
+        -------
+        params : dict
+            JSON-serialisable
+        """
+        return {
+            "keyps_confidence_threshold": -0.2,
+            "cut_padding": 0,
+            "cut_video_size": [250, 250],
+            "box_length_kernel_size": 15,
+            "keypoints_kernel_size": 3,
+            "selection_rule": selection_rule if isinstance(selection_rule, str) else getattr(
+                selection_rule, "__name__", repr(selection_rule)),
+            "min_segment_length": min_segment_length,
+            "output_format_version": preprocessed_openpose_format_version
+        }
 
     def initialize(self):
         """
         This function does the necessary steps before processing the data frame by frame:
             1. Eliminate the flipping artefact by reversing the wrong coordinates
             2. Check if the number of frames in video match the number of .json files
-            3. Find the duration where the whole skeleton is visible, by keypoints' confidence
+            3. Find the duration (and its segments) where the whole skeleton is visible, by keypoints' confidence
         Keypoints' confidence is calculated by counting the number of keypoints with <0.01 confidence
 
         """
 
-        # Check if the number of frames in video match the number of .json files
-        self.all_kepys_data_paths = sorted(glob(os.path.join(self.op_data_each_video_dir, "*.json")))
-        assert self.num_frames == len(self.all_kepys_data_paths)
-        # Initialize lists
-        selected_keyps_list = []
-        keyps_confidence_list = []
-        selected_centres_list = []
-        for keyps_path in self.all_kepys_data_paths:
-            # Read data and store them into a list, which can be re-used in other sections
-            keyps_dict, num_people, _ = read_openpose_keypoints(keyps_path)
-            # Select the patient's keypoints, excluding the other human subjects' in the video
-            # The below method also calculates the keypoint confidence aggregated from all keypoints' confidence
-            selected_centre, selected_keypoints, keyps_confidence = self._return_selected_keypoints(keyps_dict,
-                                                                                                    num_people)
-            selected_keyps_list.append(selected_keypoints)
-            keyps_confidence_list.append(keyps_confidence)
-            selected_centres_list.append(selected_centre)
-
-        self.selected_keyps = np.stack(selected_keyps_list)  # (num_frames, 25, 3)
+        # Check if the number of frames in video match the number of .json files (or frames in the archive)
+        all_people_keyps = self._read_all_people_keypoints()
+        assert self.num_frames == len(all_people_keyps)
+
+        # Select the patient's keypoints in all frames, excluding the other human subjects' in the video
+        # The keypoint confidence is aggregated from all keypoints' confidence of the selected subject
+        people_keyps, people_mask = pad_people_keypoints(all_people_keyps)
+        self.selected_keyps, person_indices = select_people_keypoints(people_keyps, people_mask,
+                                                                      rule=self.selection_rule)  # (num_frames, 25, 3)
+        has_subject = person_indices >= 0
+        self.keyps_confidences = np.where(has_subject, self.calc_confidence(self.selected_keyps), -25)  # (num_frames,)
+        self.selected_centres = self._calc_centres(self.selected_keyps, has_subject)  # (num_frames, 3)
         self.selected_keyps[:, :, 0:2], _ = reverse_flips(self.selected_keyps[:, :, 0:2])
-        self.keyps_confidences = np.stack(keyps_confidence_list)  # (num_frames,)
-        self.selected_centres = np.stack(selected_centres_list)  # (num_frames, 3)
 
-        # Find the centre coordinates of the skeleton and low-pass filter them.
+        # Find the centre coordinates of the skeleton and low-pass filter them. Frames without a confident keypoint
+        # take the previous centre (or the frame centre), such that the nan's do not spread through the filter.
         kernel_size = 30
-        selected_centres_x_smooth = moving_average(self.selected_centres[:, 0], kernel_size)
-        selected_centres_y_smooth = moving_average(self.selected_centres[:, 1], kernel_size)
+        centres_xy = fill_missing_centres(self.selected_centres[:, 0:2], self.vid_w, self.vid_h)
+        selected_centres_x_smooth = moving_average(centres_xy[:, 0], kernel_size)
+        selected_centres_y_smooth = moving_average(centres_xy[:, 1], kernel_size)
         self.selected_centres_smooth = np.stack(
             [selected_centres_x_smooth, selected_centres_y_smooth]).T  # (num_frames, 2)
 
@@ -204,7 +725,8 @@ class OpenposePreprocessor(VideoManager):
         # based on the keypoint confidence
         self._find_extracted_duration()
 
-    def preprocess(self, write_video=True, plot_keypoints=False):
+    def preprocess(self, write_video=True, plot_keypoints=False, render_mode="pipeline", render_workers=2,
+                   render_queue_depth=4, render_batch_size=8):
         """
         Start preprocessing:
         1. Translation of keypoints to the bounding box's cooridnate system
@@ -213,15 +735,44 @@ class OpenposePreprocessor(VideoManager):
         4. Extract only the video segment with whole skeleton visible
         5. Save the videos and processed keypoints
 
+        If neither the video nor the keypoints plot is written, the video is not decoded at all and the keypoints of
+        all frames are transformed in one vectorised pass (see self._preprocess_keypoints_only()).
+        Otherwise, the keypoints are transformed in the same way, and the video is rendered by a threaded
+        decode/crop-resize/encode pipeline (see render_cropped_video()), or by a single ffmpeg invocation without the
+        keypoints plot (see render_cropped_video_ffmpeg()). The keypoints are plotted directly on the frames' raster
+        (see common.visualisation.draw_keypoints_overlay()).
+
         Parameters
         ----------
         write_video : bool
         plot_keypoints : bool
+        render_mode : str
+            How the video is rendered. "pipeline" for the threaded pipeline, "ffmpeg" for ffmpeg (without the
+            keypoints plot), or "serial" for processing the video frame by frame.
+        render_workers : int
+            Number of crop/resize threads of the rendering pipeline.
+        render_queue_depth : int
+            Maximum number of frame batches waiting in each queue of the rendering pipeline.
+        render_batch_size : int
+            Number of frames per batch in the rendering pipeline.
 
         Returns
         -------
         None
         """
+        if self.keypoints_only or not (write_video or plot_keypoints):
+            if write_video or plot_keypoints:
+                raise ValueError("Video cannot be written, since the preprocessor was created with keypoints_only=True")
+            self._preprocess_keypoints_only()
+            return None
+        if render_mode not in ("pipeline", "ffmpeg", "serial"):
+            raise ValueError("render_mode must be \"pipeline\", \"ffmpeg\" or \"serial\", got {}".format(render_mode))
+        if plot_keypoints and render_mode == "ffmpeg":
+            raise ValueError("Keypoints cannot be plotted with render_mode=\"ffmpeg\"")
+        if render_mode != "serial":
+            self._preprocess_pipelined(render_mode, plot_keypoints, render_workers, render_queue_depth,
+                                       render_batch_size)
+            return None
 
         all_keypoints = []
         all_records = []
@@ -246,83 +797,170 @@ class OpenposePreprocessor(VideoManager):
                 # Plotting (optional)
                 if plot_keypoints:
                     new_torso_length, _, _ = find_torso_length_from_keyps(keypoints_xy_box_frame, 0)
-                    fig, ax = plt.subplots()
-                    ax.imshow(output_frame)
-                    ax.scatter(only_xy[openpose_L_indexes, 0], only_xy[openpose_L_indexes, 1], marker="x", c="r")
-                    ax.scatter(only_xy[openpose_R_indexes, 0], only_xy[openpose_R_indexes, 1], marker="x", c="b")
-                    # central_line = np.vstack(central_points)
-                    # ax.plot(central_line[:, 0], central_line[:, 1])
-                    fig.suptitle("Torso length:\n%0.2f" % (new_torso_length))
-                    fig.canvas.draw()
-                    data = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
-                    data = data.reshape(fig.canvas.get_width_height()[::-1] + (3,))
-                    self.vwriter.writeFrame(data)
-                    plt.close()
+                    output_frame = draw_keypoints_overlay(output_frame, only_xy,
+                                                          caption="Torso length:\n%0.2f" % (new_torso_length))
+                    self.vwriter.writeFrame(output_frame)
                 elif write_video:
                     self.vwriter.writeFrame(output_frame)
 
         # Save the keypoints information with the extracted duration
-        # for the Part 2 preprocessing (not covered in this class)
+        # for the Part 2 preprocessing (not covered in this class). The keypoints file is written last, as it marks
+        # the video as done
+        self.finalize_output_video()
+        cut_duration = (self.start_idx, self.end_idx)
+        save_data_openpose(self.output_data_path, self.cut_video_size, cut_duration, all_keypoints, all_records,
+                           segments=self.segments)
+
+    def _preprocess_keypoints_only(self):
+        """
+        Same keypoints output as self.preprocess(), but without decoding the video.
+        """
+        all_keypoints, all_records = self._transform_all_keypoints()
         cut_duration = (self.start_idx, self.end_idx)
-        save_data_openpose(self.output_data_path, self.cut_video_size, cut_duration, all_keypoints, all_records)
+        save_data_openpose(self.output_data_path, self.cut_video_size, cut_duration, list(all_keypoints), all_records,
+                           segments=self.segments)
+
+    def _preprocess_pipelined(self, render_mode, plot_keypoints, render_workers, render_queue_depth,
+                              render_batch_size):
+        """
+        Same keypoints and video output as the frame-by-frame processing of self.preprocess(). The bounding boxes of
+        all frames are found before rendering, so the video frames can be cropped and resized in a pipeline,
+        or by ffmpeg.
+        """
+        all_keypoints, all_records = self._transform_all_keypoints()
+        bboxes = np.stack([records["bbox"] for records in all_records])
+        frame_overlay = None
+        if plot_keypoints:
+            new_torso_lengths, _, _ = find_torso_lengths_from_keyps(all_keypoints, 0)
+
+            def frame_overlay(output_idx, output_frame):
+                return draw_keypoints_overlay(output_frame, all_keypoints[output_idx, :, 0:2],
+                                              caption="Torso length:\n%0.2f" % (new_torso_lengths[output_idx]))
+
+        if render_mode == "ffmpeg":
+            render_cropped_video_ffmpeg(self.input_video_path, self.output_video_tmp_path, self.start_idx, bboxes,
+                                        self.vid_w, self.vid_h, self.cut_video_size)
+        else:
+            render_cropped_video(self.vreader.nextFrame(), self.vwriter, self.start_idx, bboxes, self.cut_video_size,
+                                 num_workers=render_workers, queue_depth=render_queue_depth,
+                                 batch_size=render_batch_size, progress_name=self.vid_name,
+                                 frame_overlay=frame_overlay)
+        self.finalize_output_video()
+        cut_duration = (self.start_idx, self.end_idx)
+        save_data_openpose(self.output_data_path, self.cut_video_size, cut_duration, list(all_keypoints), all_records,
+                           segments=self.segments)
+
+    def _transform_all_keypoints(self):
+        """
+        Transform the keypoints of all frames in the extracted duration to their bounding boxes' coordinate systems.
+        The temporal filtering of the bounding box length and the keypoints is vectorised as well (see filter_all() of
+        OnlineFilter_scalar and OnlineFilter_np).
+
+        Returns
+        -------
+        all_keypoints : numpy.darray
+            (num_frames, 25, 3)
+        all_records : list
+            Transformation records of each frame, see save_data_openpose()
+        """
+        frame_indices = np.arange(self.start_idx, self.end_idx + 1)
+        bboxes, translations, resizing_factors, all_keypoints = self._find_video_clipping_areas(frame_indices)
+
+        # Temporal filtering to the x,y coordinates, but not the confidence
+        all_keypoints[:, :, 0:2] = self.keypoints_filter.filter_all(all_keypoints[:, :, 0:2])
+        all_records = []
+        for idx in range(all_keypoints.shape[0]):
+            all_records.append({"translation": translations[idx].reshape(1, 2),
+                                "resizing": resizing_factors[idx],
+                                "bbox": bboxes[idx]})
+        return all_keypoints, all_records
 
     def _find_extracted_duration(self):
-        start_idx_found, end_idx_found = False, False
+        """
+        Find all contiguous segments of at least self.min_segment_length frames whose filtered keypoint confidence is
+        above self.keyps_confidence_threshold.
+
+        self.segments is the (num_segments, 2) array of the (start, end) frame indexes (inclusive) of each segment.
+        self.start_idx and self.end_idx are the outer bounds of all segments.
+
+        Raises
+        ------
+        ValueError
+            If no segment qualifies.
+        """
         self.keyps_confidence_np_filtered = moving_average(self.keyps_confidences, 5)
 
-        for i in range(self.num_frames - 1):
-            reverse_i = self.num_frames - 1 - i
-            current_confidence_forward = self.keyps_confidence_np_filtered[i]
-            current_confidence_backward = self.keyps_confidence_np_filtered[reverse_i]
-            if (current_confidence_forward > self.keyps_confidence_threshold) and (start_idx_found == False):
-                self.start_idx = i
-                start_idx_found = True
-            if (current_confidence_backward > self.keyps_confidence_threshold) and (end_idx_found == False):
-                self.end_idx = reverse_i
-                end_idx_found = True
+        above_threshold = self.keyps_confidence_np_filtered > self.keyps_confidence_threshold
+        starts, lengths, values = run_length_encoding(above_threshold)
+        qualified = values & (lengths >= self.min_segment_length)
+        self.segments = np.stack([starts[qualified], starts[qualified] + lengths[qualified] - 1], axis=1)
+        if self.segments.shape[0] == 0:
+            raise ValueError("No segment of at least {} frames has keypoint confidence above {} in {}".format(
+                self.min_segment_length, self.keyps_confidence_threshold, self.op_data_each_video_dir))
+        self.start_idx = int(self.segments[0, 0])
+        self.end_idx = int(self.segments[-1, 1])
         return None
 
-    def _return_selected_keypoints(self, keyps_dict, num_people):
-
-        if num_people == 0:
-            keyps_selected = np.zeros((25, 3))
-            keyps_confidence = -25
-            keyps_centre = np.array([0, 0, 0])
-            return keyps_centre, keyps_selected, keyps_confidence
-
-        elif num_people == 1:
-            keyps_selected = np.asarray(keyps_dict['people'][0]['pose_keypoints_2d']).reshape(25, 3)
-            keyps_centre = np.mean(keyps_selected[(keyps_selected[:, 2] > 0.05), :], axis=0)  # (3, )
-            keyps_confidence = self.calc_confidence(keyps_selected)
-        elif num_people > 1:
-            max_x = 0
-            max_index = 0
-            # Find the person in the most right across all candidates
-            for j in range(num_people):
-                keyps_np = np.asarray(keyps_dict['people'][j]['pose_keypoints_2d']).reshape(25, 3)
-                keyps_np_mask = np.ma.array(keyps_np, mask=False)
-                filter_indexes = np.where(keyps_np[:, 2] < 0.005)  # We don't want to include low-confidence keypoints
-                keyps_np_mask.mask[filter_indexes[0], :] = True
-                mean_x = keyps_np_mask[:, 0].mean()
-                if mean_x > max_x:
-                    max_x = mean_x
-                    max_index = j
-            keyps_selected = np.asarray(keyps_dict['people'][max_index]['pose_keypoints_2d']).reshape(25, 3)
-            keyps_centre = np.mean(keyps_selected[(keyps_selected[:, 2] > 0.05), :], axis=0)  # (3, )
-            keyps_confidence = self.calc_confidence(keyps_selected)
-
-        return keyps_centre, keyps_selected, keyps_confidence
+    def _read_all_people_keypoints(self):
+        """
+        Returns
+        -------
+        all_people_keyps : list
+            Keypoints of every video frame, each as numpy.darray with shape (num_people, 25, 3)
+        """
+        if is_openpose_keypoints_archive(self.op_data_each_video_dir):
+            people_keyps_list, _, _ = read_openpose_keypoints_archive(self.op_data_each_video_dir)
+            return [people_keyps.astype(float) for people_keyps in people_keyps_list]
 
-    def _find_video_clipping_area(self, vid_frame, frame_idx):
+        all_people_keyps = []
+        for keyps_path in sorted(glob(os.path.join(self.op_data_each_video_dir, "*.json"))):
+            people_keyps, _, _ = read_openpose_pose_keypoints(keyps_path)
+            all_people_keyps.append(people_keyps)
+        return all_people_keyps
 
-        output_frame = vid_frame.copy()
-        transformation_records = dict()
+    @staticmethod
+    def _calc_centres(keyps_selected, has_subject):
+        """
+        Mean of the keypoints (x, y, confidence) with confidence > 0.05. It is nan if no keypoint is confident, and
+        (0, 0, 0) for frames without any person.
 
+        Parameters
+        ----------
+        keyps_selected : numpy.darray
+            (num_frames, 25, 3)
+        has_subject : numpy.darray
+            (num_frames, ) bool
+        """
+        confident = (keyps_selected[:, :, 2] > 0.05)[:, :, np.newaxis]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            keyps_centres = np.sum(np.where(confident, keyps_selected, 0), axis=1) / np.sum(confident, axis=1)
+        keyps_centres[~has_subject] = 0
+        return keyps_centres
+
+    def _find_bbox(self, frame_idx):
+        """
+        Find the squared bounding box of the subject in the frame, with its length temporally filtered.
+
+        Returns
+        -------
+        bbox_boundary : numpy.darray
+            (4, ) int, (x_min, y_min, x_max, y_max) of the bounding box, shifted to be inside the frame boundary.
+        translation_vec : numpy.darray
+            (1, 2) int, (x_min, y_min) of the bounding box before the shifting.
+        resizing_factor : float
+            Ratio of the output video size to the bounding box length.
+        box_length_half : float
+        central_points : list
+            See find_torso_length_from_keyps()
+        """
         # Find the square box length and the torso length. The length of the squared box was determined by torso length.
         keypoints_xy = self.selected_keyps[frame_idx, :, :]  # keypoints_xy (25, 3)
         _, box_length_half, central_points = find_torso_length_from_keyps(keypoints_xy, self.cut_padding)
         if box_length_half == 0:
+            # Length of the previous box, or the full frame if no torso has been found yet
             box_length_half = self.box_length_filter.get_last()
+            if box_length_half is None:
+                box_length_half = min(self.vid_w, self.vid_h) / 2
         else:
             box_length_half = self.box_length_filter.add(box_length_half)  # Temporal filtering
 
@@ -349,22 +987,69 @@ class OpenposePreprocessor(VideoManager):
             diff = bbox_boundary[3] - self.vid_h
             y_diff -= diff
 
-        # Translation of keypoints
         translation_vec = np.array([bbox_boundary[0], bbox_boundary[1]]).reshape(1, 2)
-        keypoints_xy[:, [0, 1]] = keypoints_xy[:, [0, 1]] - translation_vec
         bbox_boundary[0] += x_diff
         bbox_boundary[1] += y_diff
         bbox_boundary[2] += x_diff
         bbox_boundary[3] += y_diff
-        transformation_records["translation"] = translation_vec
 
         # Resize the cropping (bounding box) size to the pre-defined value
         # This also ensures the normalization of torso length, as "bbox_boundary" is determined by torso length
         old_width = bbox_boundary[2] - bbox_boundary[0]
         new_width = self.cut_video_size[0]
         resizing_factor = new_width / old_width
-        output_frame = output_frame[bbox_boundary[1]:bbox_boundary[3], bbox_boundary[0]:bbox_boundary[2]]
-        output_frame = resize(output_frame, self.cut_video_size, anti_aliasing=True)
+        return bbox_boundary, translation_vec, resizing_factor, box_length_half, central_points
+
+    def _find_video_clipping_areas(self, frame_indices):
+        """
+        Batch version of self._find_video_clipping_area() for the keypoints, without the video frames.
+
+        Parameters
+        ----------
+        frame_indices : numpy.darray
+            (num_frames, ) consecutive frame indexes to be processed, in ascending order.
+
+        Returns
+        -------
+        bboxes : numpy.darray
+            (num_frames, 4) int, see find_clipping_boxes()
+        translations : numpy.darray
+            (num_frames, 2) int
+        resizing_factors : numpy.darray
+            (num_frames, )
+        keypoints_xy : numpy.darray
+            (num_frames, 25, 3), keypoints in the bounding box's coordinate system, with unconfident keypoints as nan.
+        """
+        keypoints_xy = self.selected_keyps[frame_indices]
+        _, box_half_lengths, _ = find_torso_lengths_from_keyps(keypoints_xy, self.cut_padding)
+
+        # Temporal filtering of the box length. Frames without a valid length take the last valid (unfiltered) length,
+        # as self.box_length_filter.get_last() does frame by frame, or the full frame before the first valid length.
+        valid = box_half_lengths != 0
+        last_valid_indices = np.maximum.accumulate(np.where(valid, np.arange(valid.shape[0]), -1))
+        box_half_lengths_filtered = np.where(last_valid_indices >= 0, box_half_lengths[last_valid_indices],
+                                             min(self.vid_w, self.vid_h) / 2)
+        box_half_lengths_filtered[valid] = self.box_length_filter.filter_all(box_half_lengths[valid])
+
+        bboxes, translations, resizing_factors = find_clipping_boxes(self.selected_centres_smooth[frame_indices],
+                                                                     box_half_lengths_filtered,
+                                                                     self.vid_w, self.vid_h, self.cut_video_size)
+        keypoints_xy = transform_keypoints_to_bbox(keypoints_xy, translations, resizing_factors, self.cut_video_size)
+        return bboxes, translations, resizing_factors, keypoints_xy
+
+    def _find_video_clipping_area(self, vid_frame, frame_idx):
+
+        output_frame = vid_frame.copy()
+        transformation_records = dict()
+        keypoints_xy = self.selected_keyps[frame_idx, :, :]  # keypoints_xy (25, 3)
+        bbox_boundary, translation_vec, resizing_factor, box_length_half, central_points = self._find_bbox(frame_idx)
+
+        # Translation of keypoints
+        keypoints_xy[:, [0, 1]] = keypoints_xy[:, [0, 1]] - translation_vec
+        transformation_records["translation"] = translation_vec
+
+        # Resize the cropping (bounding box) to the pre-defined size
+        output_frame = crop_and_resize_frame(output_frame, bbox_boundary, self.cut_video_size)
         keypoints_xy[:, [0, 1]] = keypoints_xy[:, [0, 1]] * resizing_factor
         transformation_records["resizing"] = resizing_factor
         transformation_records["bbox"] = bbox_boundary
@@ -378,19 +1063,28 @@ class OpenposePreprocessor(VideoManager):
         keypoints_xy[(keypoints_xy[:, 1] < 0) | (keypoints_xy[:, 1] > self.cut_video_size[1]),
         :] = np.nan
 
-        output_frame = np.around(output_frame * 255).astype(int)
         return output_frame, keypoints_xy, transformation_records, box_length_half, central_points
 
     @staticmethod
     def calc_confidence(keyps_selected):
+        """
+        Parameters
+        ----------
+        keyps_selected : numpy.darray
+            (..., 25, 3), keypoints of one or more frames
 
+        Returns
+        -------
+        keyps_confidence : int or numpy.darray
+            (...), negative number of the unconfident keypoints
+        """
         base_confidence = 0
-        keyps_selected_for_confidence = keyps_selected.copy()
+        keyps_selected_for_confidence = keyps_selected[..., 2].copy()
         # Nose and eyes are not included for confidence calculation. The maximum of left/right ears are selected to include.
-        keyps_selected_for_confidence[[17, 18], 2] = np.max(keyps_selected[[17, 18], 2])
+        keyps_selected_for_confidence[..., [17, 18]] = np.max(keyps_selected[..., [17, 18], 2], axis=-1, keepdims=True)
         # Indexes of nose, right and left_eye are 0,15,16 respectively
-        keyps_confidence = base_confidence - np.sum(keyps_selected_for_confidence[1:15, 2] < 0.1) - np.sum(
-            keyps_selected_for_confidence[17:, 2] < 0.1)
+        keyps_confidence = base_confidence - np.sum(keyps_selected_for_confidence[..., 1:15] < 0.1, axis=-1) - np.sum(
+            keyps_selected_for_confidence[..., 17:] < 0.1, axis=-1)
 
         return keyps_confidence
 
@@ -401,9 +1095,253 @@ class OpenposePreprocessor(VideoManager):
             pass
 
 
+def default_manifest_path(output_data_dir):
+    # Next to the output directory rather than inside it, since Part-2 reads every file of the output directory
+    return os.path.normpath(output_data_dir) + "_preprocess_manifest.jsonl"
+
+
+def keypoints_input_fingerprint(keyps_path):
+    """
+    Fingerprint of the keypoints input of a video, from the names, sizes and modification times of the .json files
+    (or of the consolidated archive), without reading their contents.
+
+    Returns
+    -------
+    fingerprint : str
+        sha1 hex digest
+    """
+    hasher = hashlib.sha1()
+    if os.path.isfile(keyps_path):
+        stat = os.stat(keyps_path)
+        hasher.update("{}:{}:{}\n".format(os.path.basename(keyps_path), stat.st_size, stat.st_mtime_ns).encode())
+    else:
+        for entry in sorted(os.scandir(keyps_path), key=lambda entry: entry.name):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                hasher.update("{}:{}:{}\n".format(entry.name, stat.st_size, stat.st_mtime_ns).encode())
+    return hasher.hexdigest()
+
+
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def file_sha1(file_path, chunk_size=1 << 20):
+    hasher = hashlib.sha1()
+    with open(file_path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def read_preprocess_manifest(manifest_path):
+    """
+    Read the JSON-lines manifest of the preprocessing. Later entries of a video supersede the earlier ones.
+    A truncated last line (from an interrupted run) is ignored.
+
+    Returns
+    -------
+    manifest_entries : dict
+        Video name -> latest manifest entry (dict)
+    """
+    manifest_entries = dict()
+    if not os.path.isfile(manifest_path):
+        return manifest_entries
+    with open(manifest_path, "r") as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            manifest_entries[entry["video"]] = entry
+    return manifest_entries
+
+
+def append_preprocess_manifest(manifest_path, entry):
+    """
+    Append one entry to the manifest. The line is written with a single O_APPEND write, such that the entries of
+    concurrent worker processes do not interleave.
+    """
+    line = (json.dumps(entry, sort_keys=True) + "\n").encode()
+    fd = os.open(manifest_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def output_file_stat(file_path):
+    """
+    Size and modification time (ns) of an output, recorded in the manifest to check it without hashing it.
+    """
+    stat = os.stat(file_path)
+    return {"output_size": stat.st_size, "output_mtime_ns": stat.st_mtime_ns}
+
+
+def is_manifest_entry_up_to_date(entry, input_fingerprint, params_digest, output_keypoints_path):
+    """
+    True if the manifest entry is a finished preprocessing of the same input and parameters, whose output is intact.
+    The output is compared by size and modification time first. It is only hashed if its size is unchanged but its
+    modification time is not (e.g. copied or touched), or if the entry has no size and time.
+    """
+    if (entry is None) or (entry["status"] != "done") or (entry["input_fingerprint"] != input_fingerprint) \
+            or (entry["params_hash"] != params_digest) or (not os.path.isfile(output_keypoints_path)):
+        return False
+    if "output_size" in entry:
+        output_stat = output_file_stat(output_keypoints_path)
+        if output_stat["output_size"] != entry["output_size"]:
+            return False
+        if output_stat["output_mtime_ns"] == entry["output_mtime_ns"]:
+            return True
+    return file_sha1(output_keypoints_path) == entry["output_sha1"]
+
+
+def is_adoptable_keypoints_output(output_keypoints_path, params):
+    """
+    True if the keypoints output can be opened, i.e. it is a complete .npz file (a truncated zip file misses its
+    central directory at the end), and it was written in the current format with the output size of "params". The
+    other parameters are not recorded in the output, and are assumed to be those of "params".
+    """
+    try:
+        with np.load(output_keypoints_path, allow_pickle=False) as npz:
+            return ("positions_2d" in npz.files) and ("format_version" in npz.files) \
+                and (int(npz["format_version"]) == params["output_format_version"]) \
+                and np.array_equal(npz["video_shape"], params["cut_video_size"])
+    except Exception:
+        return False
+
+
+def _video_name_root(subfolder_path_each):
+    vid_name_root = os.path.split(subfolder_path_each)[1]
+    if is_openpose_keypoints_archive(subfolder_path_each):
+        vid_name_root = os.path.splitext(vid_name_root)[0]
+    return vid_name_root
+
+
+def _preprocess_single_video(subfolder_path_each, src_vid_dir, output_vid_dir, output_data_dir, plot_keypoints,
+                             write_video, selection_rule="rightmost", min_segment_length=1, render_kwargs=None,
+                             manifest_path=None, manifest_entry=None, adopt_existing_outputs=False):
+    """
+    Preprocess the video whose OpenPose keypoints are stored in "subfolder_path_each".
+
+    Without "manifest_path", the video is skipped if its output exists. Otherwise, it is skipped only if
+    "manifest_entry" is up to date (see is_manifest_entry_up_to_date()), and a new entry is appended to the manifest
+    with status "done" or "failed". With "adopt_existing_outputs", a video without manifest entry whose output exists
+    (e.g. from a run without the manifest) and is adoptable (see is_adoptable_keypoints_output()) is recorded as done
+    with the current input and parameters, and skipped.
+
+    Returns
+    -------
+    processed : bool
+        False if the video was skipped, True otherwise.
+    """
+    # Define paths
+    vid_name_root = _video_name_root(subfolder_path_each)
+    input_video_path = os.path.join(src_vid_dir, vid_name_root + ".mp4")
+    output_vid_path = os.path.join(output_vid_dir, vid_name_root + ".mp4")
+    output_keypoints_path = os.path.join(output_data_dir, vid_name_root + ".npz")
+
+    if manifest_path is None:
+        # Skip if the outputp already exists
+        if os.path.isfile(output_keypoints_path):
+            print("Skipped: ", vid_name_root)
+            return False
+    else:
+        # Skip if the output is up to date with the input and parameters
+        params = OpenposePreprocessor.preprocess_params(selection_rule=selection_rule,
+                                                        min_segment_length=min_segment_length)
+        params.update({"write_video": write_video, "plot_keypoints": plot_keypoints})
+        input_fingerprint = keypoints_input_fingerprint(subfolder_path_each)
+        params_digest = params_hash(params)
+        if is_manifest_entry_up_to_date(manifest_entry, input_fingerprint, params_digest, output_keypoints_path):
+            print("Skipped: ", vid_name_root)
+            return False
+        adopt_output = adopt_existing_outputs and (manifest_entry is None) and os.path.isfile(output_keypoints_path) \
+            and is_adoptable_keypoints_output(output_keypoints_path, params)
+        manifest_entry = {"video": vid_name_root, "input_fingerprint": input_fingerprint,
+                          "params_hash": params_digest, "params": params}
+        if adopt_output:
+            manifest_entry.update({"status": "done", "output_sha1": file_sha1(output_keypoints_path),
+                                   "adopted": True, "time": time.time()})
+            manifest_entry.update(output_file_stat(output_keypoints_path))
+            append_preprocess_manifest(manifest_path, manifest_entry)
+            print("Skipped (adopted into the manifest): ", vid_name_root)
+            return False
+
+    # Start preprocessing
+    try:
+        preprop = OpenposePreprocessor(input_video_path=input_video_path,
+                                       openpose_data_each_video_dir=subfolder_path_each,
+                                       output_video_path=output_vid_path,
+                                       output_data_path=output_keypoints_path,
+                                       keypoints_only=not (write_video or plot_keypoints),
+                                       selection_rule=selection_rule,
+                                       min_segment_length=min_segment_length)
+        preprop.initialize()
+
+        preprop.preprocess(plot_keypoints=plot_keypoints, write_video=write_video, **(render_kwargs or dict()))
+    except Exception:
+        if manifest_path is not None:
+            manifest_entry.update({"status": "failed", "output_sha1": None, "time": time.time()})
+            append_preprocess_manifest(manifest_path, manifest_entry)
+        raise
+
+    if manifest_path is not None:
+        manifest_entry.update({"status": "done", "output_sha1": file_sha1(output_keypoints_path),
+                               "time": time.time()})
+        manifest_entry.update(output_file_stat(output_keypoints_path))
+        append_preprocess_manifest(manifest_path, manifest_entry)
+    return True
+
+
+def _preprocess_shard(shard_idx, subfolder_paths, src_vid_dir, output_vid_dir, output_data_dir, error_log_path,
+                      plot_keypoints, write_video, selection_rule="rightmost", min_segment_length=1,
+                      render_kwargs=None, manifest_path=None, manifest_entries=None, adopt_existing_outputs=False):
+    """
+    Preprocess a shard (subset) of the keypoints subfolders serially. It is the unit of work of each worker process
+    in openpose_preprocess_wrapper(). Tracebacks are appended to "error_log_path", which is owned by this shard only.
+    "manifest_entries" are the manifest entries (video name -> entry) of the videos in this shard.
+
+    Returns
+    -------
+    num_processed, num_skipped, num_failed : int
+    """
+    num_vids = len(subfolder_paths)
+    num_processed, num_skipped, num_failed = 0, 0, 0
+    for idx, subfolder_path_each in enumerate(subfolder_paths):
+        try:
+            # Monitor progress
+            print("\rShard {} preprocessing {}/{}: from {}".format(shard_idx, idx, num_vids, subfolder_path_each))
+
+            if _preprocess_single_video(subfolder_path_each, src_vid_dir, output_vid_dir, output_data_dir,
+                                        plot_keypoints=plot_keypoints, write_video=write_video,
+                                        selection_rule=selection_rule, min_segment_length=min_segment_length,
+                                        render_kwargs=render_kwargs, manifest_path=manifest_path,
+                                        manifest_entry=(manifest_entries or dict()).get(
+                                            _video_name_root(subfolder_path_each)),
+                                        adopt_existing_outputs=adopt_existing_outputs):
+                num_processed += 1
+            else:
+                num_skipped += 1
+
+        except Exception:
+            num_failed += 1
+            if error_log_path:
+                with open(error_log_path, "a") as fh:
+                    fh.write("\n{}\n".format("=" * 30))
+                    traceback.print_exc(file=fh)
+                print("\nError encountered, logged.")
+            else:
+                traceback.print_exc()
+
+    return num_processed, num_skipped, num_failed
+
+
 def openpose_preprocess_wrapper(src_vid_dir, input_data_main_dir, output_vid_dir,
                                 output_data_dir, error_log_path="", plot_keypoints=False,
-                                write_video=True):
+                                write_video=True, num_workers=None, selection_rule="rightmost",
+                                min_segment_length=1, render_mode="pipeline", render_workers=2, render_queue_depth=4,
+                                render_batch_size=8, manifest_path="", adopt_existing_outputs=False):
     """
     This function preprocesses the raw videos and keypoints that were inferred by OpenPose, and output the
     processed keypoints and (optiional) visualization to the designated directories.
@@ -413,7 +1351,8 @@ def openpose_preprocess_wrapper(src_vid_dir, input_data_main_dir, output_vid_dir
     src_vid_dir : str
         Directory that you store your raw videos.
     input_data_main_dir : str
-        Directory that you store the subfolders of keypoints, inferred from OpenPose.
+        Directory that you store the subfolders of keypoints, inferred from OpenPose, or their consolidated keypoints
+        archives (see pack_openpose_keypoints_wrapper()).
     output_vid_dir : str
         Directory that you store the output preprocessed visualisation videos.
     output_data_dir : str
@@ -425,50 +1364,160 @@ def openpose_preprocess_wrapper(src_vid_dir, input_data_main_dir, output_vid_dir
         False if you don't do the plotting. The processing will then be faster.
     write_video : bool
         True if you want to store the output preprocessed visualisation videos.
+    num_workers : int or None
+        Number of worker processes. The subfolders are sharded across the workers, and each worker keeps its own
+        error log which is merged into "error_log_path" (shard by shard) after all workers finish.
+        None = number of CPU cores. 1 = process all videos in the current process.
+    selection_rule : str
+        Rule to select the patient among the people detected in each frame, as a key of
+        common.utils.subject_selection_rules. "track" links the people across frames and keeps the longest track,
+        which avoids identity swaps when other people walk past.
+    min_segment_length : int
+        Minimum number of frames of a contiguous segment with confident keypoints. The segments are stored in
+        vid_info["segments"] of the output keypoints file, and split into separate rows by FeatureExtractorForODE.
+    render_mode : str
+        How each output visualisation video is rendered. "pipeline" for the threaded pipeline
+        (see render_cropped_video()), "ffmpeg" for one ffmpeg crop/scale invocation per video without the keypoints
+        plot (see render_cropped_video_ffmpeg()), or "serial" for frame by frame.
+    render_workers, render_queue_depth, render_batch_size : int
+        Number of crop/resize threads, maximum number of frame batches in each queue, and frames per batch of the
+        pipeline rendering each output visualisation video (write_video=True, plot_keypoints=False).
+        See render_cropped_video()
+    manifest_path : str or None
+        JSON-lines manifest recording the input fingerprint, the preprocessing parameters, the output checksum, size
+        and modification time, and the status of each video. Only the videos whose manifest entries are failed or
+        stale (changed input or parameters, or missing/modified output) are (re)processed, as well as the videos
+        without entry. "" = "<output_data_dir>_preprocess_manifest.jsonl", next to output_data_dir. None = no
+        manifest, skip the videos whose output exists.
+    adopt_existing_outputs : bool
+        If True, the existing outputs of the videos without manifest entry are adopted into the manifest instead of
+        being reprocessed, if they are in the current format and output size (so the first run with a manifest
+        resumes from the outputs of earlier runs). Only use it if the outputs were made with the current parameters,
+        since the others (e.g. the selection rule) cannot be checked.
     """
-    import traceback
-
     subfolder_paths = sorted(glob(os.path.join(input_data_main_dir, "*")))
     num_vids = len(subfolder_paths)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, num_vids))
     if error_log_path:
         with open(error_log_path, "w") as fh:
             fh.write("\n")
 
-    for idx, subfolder_path_each in enumerate(subfolder_paths):
-        try:
-            # Monitor progress
-            print("\rPreprocessing {}/{}: from {}".format(idx, num_vids, subfolder_path_each))
-
-            # Define paths
-            vid_name_root = os.path.split(subfolder_path_each)[1]
-            input_video_path = os.path.join(src_vid_dir, vid_name_root + ".mp4")
-            output_vid_path = os.path.join(output_vid_dir, vid_name_root + ".mp4")
-            output_keypoints_path = os.path.join(output_data_dir, vid_name_root + ".npz")
+    # Create output_vid and output_data directory if not exist
+    os.makedirs(output_vid_dir, exist_ok=True)
+    os.makedirs(output_data_dir, exist_ok=True)
+
+    render_kwargs = {"render_mode": render_mode, "render_workers": render_workers,
+                     "render_queue_depth": render_queue_depth, "render_batch_size": render_batch_size}
+    if manifest_path == "":
+        manifest_path = default_manifest_path(output_data_dir)
+    manifest_entries = read_preprocess_manifest(manifest_path) if manifest_path is not None else dict()
+    time_start = time.time()
+    if num_workers == 1:
+        shard_results = [_preprocess_shard(0, subfolder_paths, src_vid_dir, output_vid_dir, output_data_dir,
+                                           error_log_path, plot_keypoints, write_video, selection_rule,
+                                           min_segment_length, render_kwargs, manifest_path, manifest_entries,
+                                           adopt_existing_outputs)]
+    else:
+        # Strided sharding, such that every worker gets a similar mixture of the sorted subfolders
+        shard_error_log_paths = []
+        shard_args = []
+        for shard_idx in range(num_workers):
+            shard_error_log_path = "{}.shard{}".format(error_log_path, shard_idx) if error_log_path else ""
+            shard_error_log_paths.append(shard_error_log_path)
+            shard_subfolder_paths = subfolder_paths[shard_idx::num_workers]
+            shard_manifest_entries = {_video_name_root(path): manifest_entries[_video_name_root(path)]
+                                      for path in shard_subfolder_paths if _video_name_root(path) in manifest_entries}
+            shard_args.append((shard_idx, shard_subfolder_paths, src_vid_dir, output_vid_dir,
+                               output_data_dir, shard_error_log_path, plot_keypoints, write_video, selection_rule,
+                               min_segment_length, render_kwargs, manifest_path, shard_manifest_entries,
+                               adopt_existing_outputs))
+
+        with multiprocessing.Pool(processes=num_workers) as pool:
+            shard_results = pool.starmap(_preprocess_shard, shard_args)
+
+        # Merge the error logs of all workers, one shard after another
+        if error_log_path:
+            with open(error_log_path, "a") as fh:
+                for shard_error_log_path in shard_error_log_paths:
+                    if os.path.isfile(shard_error_log_path):
+                        with open(shard_error_log_path, "r") as shard_fh:
+                            fh.write(shard_fh.read())
+                        os.remove(shard_error_log_path)
+    time_elapsed = time.time() - time_start
 
-            # Create output_vid and output_data directory if not exist
-            os.makedirs(output_vid_dir, exist_ok=True)
-            os.makedirs(output_data_dir, exist_ok=True)
+    # Report aggregate throughput
+    num_processed, num_skipped, num_failed = np.sum(np.array(shard_results).reshape(-1, 3), axis=0)
+    print("\nPreprocessed {} videos ({} skipped, {} failed) with {} worker(s) in {:.1f}s: {:.3f} videos/s".format(
+        num_processed, num_skipped, num_failed, num_workers, time_elapsed, num_processed / max(time_elapsed, 1e-6)))
 
-            # Skip if the outputp already exists
-            if os.path.isfile(output_keypoints_path):
-                print("Skipped: ", vid_name_root)
-                continue
 
-            # Start preprocessing
-            preprop = OpenposePreprocessor(input_video_path=input_video_path,
-                                           openpose_data_each_video_dir=subfolder_path_each,
-                                           output_video_path=output_vid_path,
-                                           output_data_path=output_keypoints_path)
-            preprop.initialize()
+def pack_openpose_keypoints_wrapper(input_data_main_dir, output_archive_dir, remove_json=False):
+    """
+    Pack the per-frame .json keypoints of each video into one consolidated archive per video
+    (see common.utils.pack_openpose_keypoints()), to cut the number of files for the preprocessing.
+    The output_archive_dir can then be used as "input_data_main_dir" of openpose_preprocess_wrapper().
 
-            preprop.preprocess(plot_keypoints=plot_keypoints, write_video=write_video)
+    Parameters
+    ----------
+    input_data_main_dir : str
+        Directory that you store the subfolders of keypoints, inferred from OpenPose.
+    output_archive_dir : str
+        Directory that you store the output archives, named as "<video name>.npz".
+    remove_json : bool
+        True if you want to delete the .json files of a video after its archive is written.
+    """
+    subfolder_paths = sorted(glob(os.path.join(input_data_main_dir, "*")))
+    num_vids = len(subfolder_paths)
+    os.makedirs(output_archive_dir, exist_ok=True)
 
-        except Exception:
-            with open(error_log_path, "a") as fh:
-                fh.write("\n{}\n".format("=" * 30))
-                traceback.print_exc(file=fh)
-                print("\nError encountered, logged.")
+    for idx, subfolder_path_each in enumerate(subfolder_paths):
+        print("\rPacking keypoints {}/{}: from {}".format(idx, num_vids, subfolder_path_each), flush=True, end="")
+        vid_name_root = os.path.split(subfolder_path_each)[1]
+        archive_path = os.path.join(output_archive_dir, vid_name_root + ".npz")
+        if not os.path.isfile(archive_path):
+            pack_openpose_keypoints(subfolder_path_each, archive_path)
+        if remove_json:
+            for json_path in glob(os.path.join(subfolder_path_each, "*.json")):
+                os.remove(json_path)
+    print()
 
 
 if __name__ == "__main__":
-    pass
+    # Usage (from the "scripts" directory): python -m common.preprocess SRC_VID_DIR INPUT_DATA_MAIN_DIR ...
+    parser = argparse.ArgumentParser(description="Preprocess the raw videos and their OpenPose keypoints. "
+                                                 "See openpose_preprocess_wrapper()")
+    parser.add_argument("src_vid_dir")
+    parser.add_argument("input_data_main_dir")
+    parser.add_argument("output_vid_dir")
+    parser.add_argument("output_data_dir")
+    parser.add_argument("--error-log-path", default="")
+    parser.add_argument("--plot-keypoints", action="store_true")
+    parser.add_argument("--no-video", action="store_true", help="Do not write the visualisation videos")
+    parser.add_argument("--num-workers", type=int, default=None, help="Number of processes. Default: CPU cores")
+    parser.add_argument("--selection-rule", default="rightmost")
+    parser.add_argument("--min-segment-length", type=int, default=1)
+    parser.add_argument("--manifest-path", default="",
+                        help="Default: OUTPUT_DATA_DIR_preprocess_manifest.jsonl, next to OUTPUT_DATA_DIR")
+    parser.add_argument("--no-manifest", action="store_true",
+                        help="Skip the videos whose output exists, instead of checking the manifest")
+    parser.add_argument("--adopt-existing-outputs", action="store_true",
+                        help="Record the existing outputs of the videos without manifest entry as done, if they have "
+                             "the current format and output size")
+    parser.add_argument("--render-mode", default="pipeline", choices=["pipeline", "ffmpeg", "serial"])
+    parser.add_argument("--render-workers", type=int, default=2, help="Crop/resize threads per video")
+    parser.add_argument("--render-queue-depth", type=int, default=4, help="Maximum frame batches in each queue")
+    parser.add_argument("--render-batch-size", type=int, default=8, help="Frames per batch")
+    args = parser.parse_args()
+
+    openpose_preprocess_wrapper(args.src_vid_dir, args.input_data_main_dir, args.output_vid_dir,
+                                args.output_data_dir, error_log_path=args.error_log_path,
+                                plot_keypoints=args.plot_keypoints, write_video=not args.no_video,
+                                num_workers=args.num_workers, selection_rule=args.selection_rule,
+                                min_segment_length=args.min_segment_length, render_mode=args.render_mode,
+                                render_workers=args.render_workers,
+                                render_queue_depth=args.render_queue_depth,
+                                render_batch_size=args.render_batch_size,
+                                manifest_path=None if args.no_manifest else args.manifest_path,
+                                adopt_existing_outputs=args.adopt_existing_outputs)
@@ -2,8 +2,8 @@
 
 import os
 import json
+import collections
 import numpy as np
-import re
 import pickle
 import pandas as pd
 import torch
@@ -89,9 +89,55 @@ def tensor2numpy(*tensor_arrs):
 
 
 def numpy2tensor(device, *numpy_arrs):
+    # Arrays in pinned memory (see pin_numpy_arrays) are copied asynchronously, others with a plain copy
     output_list = []
     for arr in numpy_arrs:
-        output_list.append(torch.from_numpy(arr).float().to(device))
+        output_list.append(_host_to_device(torch.from_numpy(arr).float(), device))
+    return output_list
+
+
+# Pinned host tensors of the asynchronous host-to-device copies in flight, each with the CUDA event recorded after its
+# copy. A pinned buffer is kept referenced until its event has completed, such that it cannot be freed (and its
+# memory reused for the next pinned batch) while the GPU still reads from it
+_pending_host_copies = collections.deque()
+
+
+def _host_to_device(host_tensor, device):
+    if (torch.device(device).type != "cuda") or (not host_tensor.is_pinned()):
+        return host_tensor.to(device)
+    device_tensor = host_tensor.to(device, non_blocking=True)
+    copy_event = torch.cuda.Event()
+    copy_event.record()
+    _pending_host_copies.append((copy_event, host_tensor))
+    while _pending_host_copies and _pending_host_copies[0][0].query():  # Events complete in the recorded order
+        _pending_host_copies.popleft()
+    return device_tensor
+
+
+def pin_numpy_arrays(data, min_size=1024):
+    """
+    Copy the numpy arrays (of at least min_size elements) in a nested tuple/list into page-locked (pinned) memory,
+    such that the host-to-device copies of numpy2tensor() and mask2tensor() can be asynchronous. The arrays are
+    returned as numpy arrays (views of the pinned tensors), with the same structure and values. Floating-point arrays
+    are cast to float32 before pinning, since numpy2tensor() would otherwise convert them into a pageable copy.
+    """
+    if isinstance(data, (tuple, list)):
+        return type(data)(pin_numpy_arrays(item, min_size) for item in data)
+    if isinstance(data, np.ndarray) and (data.size >= min_size) and (data.dtype != object):
+        if np.issubdtype(data.dtype, np.floating):
+            data = data.astype(np.float32, copy=False)
+        return torch.from_numpy(np.ascontiguousarray(data)).pin_memory().numpy()
+    return data
+
+
+def mask2tensor(device, *mask_arrs, eps=1e-5):
+    """
+    Convert boolean masks to float tensors of (mask + eps). The masks are moved to the device as booleans (1 byte per
+    entry) and only converted to float there.
+    """
+    output_list = []
+    for arr in mask_arrs:
+        output_list.append(_host_to_device(torch.from_numpy(np.asarray(arr, dtype=bool)), device).float() + eps)
     return output_list
 
 def slice_by_mask(mask, *arrs):
@@ -100,6 +146,32 @@ def slice_by_mask(mask, *arrs):
         new_arrs.append(arr[mask,])
     return new_arrs
 
+def run_length_encoding(arr):
+    """
+    Run-length encoding of a 1D array.
+
+    Parameters
+    ----------
+    arr : numpy.darray
+        (num_frames, )
+
+    Returns
+    -------
+    starts : numpy.darray
+        (num_runs, ) int, index of the first element of each run
+    lengths : numpy.darray
+        (num_runs, ) int, number of elements in each run
+    values : numpy.darray
+        (num_runs, ), value of each run
+    """
+    arr = np.asarray(arr)
+    if arr.shape[0] == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), arr[0:0]
+    starts = np.concatenate([[0], np.flatnonzero(arr[1:] != arr[:-1]) + 1])
+    lengths = np.diff(np.append(starts, arr.shape[0]))
+    return starts, lengths, arr[starts]
+
+
 def extract_contagious(binary_train, max_neigh):
     """
 
@@ -117,31 +189,13 @@ def extract_contagious(binary_train, max_neigh):
     group_arr : numpy.darray
         (num_frames, ), each value in the array represents the number of contagious 1's that value neighbours with (including itself.)
     """
-    contagious_arr = np.zeros(binary_train.shape)
-    group_arr = np.zeros(binary_train.shape)
-    filtered_binary_arr = np.zeros(binary_train.shape)
-    for i in range(binary_train.shape[0]):
-
-        if binary_train[i] == 1:
-            if i == 0:
-                contagious_arr[i] = 1
-            else:
-                contagious_arr[i] = contagious_arr[i - 1] + 1
-        else:
-            contagious_arr[i] = 0
-
-    focus = contagious_arr[-1]
-    for i in reversed(range(binary_train.shape[0])):
-
-        if contagious_arr[i] == 0:
-            if i != 0:
-                focus = contagious_arr[i - 1]
-            else:
-                focus = contagious_arr[i]
-        else:
-            group_arr[i] = focus
+    is_one = np.asarray(binary_train) == 1
+    starts, lengths, values = run_length_encoding(is_one)
 
-    filtered_binary_arr[(group_arr <= max_neigh) & (group_arr > 0)] = 1
+    # Position within the run of 1's (1, 2, 3, ...), and the length of the run that each 1 belongs to
+    contagious_arr = ((np.arange(is_one.shape[0]) - np.repeat(starts, lengths) + 1) * is_one).astype(float)
+    group_arr = np.repeat(np.where(values, lengths, 0), lengths).astype(float)
+    filtered_binary_arr = ((group_arr <= max_neigh) & (group_arr > 0)).astype(float)
 
     return filtered_binary_arr, (contagious_arr, group_arr)
 
@@ -227,6 +281,11 @@ class MeterAssembly:
         for key in kwargs:
             self.meter_dicts[key].update(kwargs[key])
 
+    def reset_meters(self, prefix=""):
+        for key in self.meter_dicts.keys():
+            if key.startswith(prefix):
+                self.meter_dicts[key].reset()
+
     def get_meter_avg(self):
         output_dict = dict()
         for key in self.meter_dicts.keys():
@@ -245,50 +304,150 @@ class MeterAssembly:
         return self.recorder
 
 
+def _causal_window_mean(arr, kernel_size, ignore_nan):
+    """
+    Mean of the last (up to) kernel_size elements along axis 0, at every position of axis 0.
+
+    Parameters
+    ----------
+    arr : numpy.darray
+        (num_frames, ...)
+    kernel_size : int
+    ignore_nan : bool
+        If True, nan's are excluded from the mean, which is nan only if the whole window is nan (as np.nanmean).
+        Otherwise, the mean is nan if any element in the window is nan (as np.mean).
+
+    Returns
+    -------
+    window_mean : numpy.darray
+        Same shape as arr.
+    """
+    arr = np.asarray(arr, dtype=float)
+    is_nan = np.isnan(arr)
+    padding = np.zeros((1,) + arr.shape[1:])
+    sums_cum = np.concatenate([padding, np.cumsum(np.where(is_nan, 0, arr), axis=0)])
+    nans_cum = np.concatenate([padding, np.cumsum(is_nan, axis=0)])
+    ends = np.arange(1, arr.shape[0] + 1)
+    begins = np.maximum(ends - kernel_size, 0)
+    window_sums = sums_cum[ends] - sums_cum[begins]
+    window_nans = nans_cum[ends] - nans_cum[begins]
+    window_lengths = (ends - begins).reshape((-1,) + (1,) * (arr.ndim - 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if ignore_nan:
+            window_counts = window_lengths - window_nans
+            return np.where(window_counts > 0, window_sums / window_counts, np.nan)
+        return np.where(window_nans > 0, np.nan, window_sums / window_lengths)
+
+
 class OnlineFilter_scalar():
+    """
+    Causal moving average over the last kernel_size inputs, kept in a ring buffer with a running sum.
+    """
+    __slots__ = ("kernel_size", "input_records", "input_times", "_sum")
+
     def __init__(self, kernel_size):
         self.kernel_size = kernel_size
         self.input_records = np.zeros(kernel_size)
         self.input_times = 0
+        self._sum = 0.0
 
     def add(self, input_val):
-        if self.input_times < self.kernel_size:
-            self.input_records[self.input_times] = input_val
-            self.input_times += 1
-            return np.mean(self.input_records[0:self.input_times])
-        else:
-            arr_idx = self.input_times % self.kernel_size
-            self.input_records[arr_idx] = input_val
-            self.input_times += 1
-            return np.mean(self.input_records)
+        arr_idx = self.input_times % self.kernel_size
+        if self.input_times >= self.kernel_size:
+            self._sum -= self.input_records[arr_idx]
+        self.input_records[arr_idx] = input_val
+        self.input_times += 1
+        self._sum += input_val
+
+        # Refresh the running sum once per cycle to avoid drifting by rounding error, or when a nan left the window
+        if (arr_idx == self.kernel_size - 1) or not np.isfinite(self._sum):
+            self._sum = float(np.sum(self.input_records[0:min(self.input_times, self.kernel_size)]))
+        return self._sum / min(self.input_times, self.kernel_size)
 
     def get_last(self):
+        """
+        Returns the last inserted input value (not filtered), or None if nothing is inserted yet.
+        """
         if self.input_times > 0:
-            return self.input_records[-1]
+            return self.input_records[(self.input_times - 1) % self.kernel_size]
+
+    def filter_all(self, arr):
+        """
+        Filter all inputs at once, the same as calling self.add() for every element of arr on a new filter.
+        The state of this filter is neither used nor changed.
+
+        Parameters
+        ----------
+        arr : numpy.darray
+            (num_frames, )
+
+        Returns
+        -------
+        arr_filtered : numpy.darray
+            (num_frames, )
+        """
+        return _causal_window_mean(arr, self.kernel_size, ignore_nan=False)
 
 
 class OnlineFilter_np():
+    """
+    Causal moving average (ignoring nan's) over the last kernel_size input arrays, kept in a ring buffer with running
+    sums and counts of the non-nan values.
+    """
+    __slots__ = ("input_size", "kernel_size", "input_records", "input_times", "_valid_records", "_sum", "_count")
+
     def __init__(self, input_size, kernel_size):
         self.input_size = input_size
         self.kernel_size = kernel_size
         self.input_records = self._create_records_arr()
         self.input_times = 0
+        self._valid_records = np.zeros(self.input_records.shape, dtype=bool)  # True for the non-nan input values
+        self._sum = np.zeros(input_size)
+        self._count = np.zeros(input_size, dtype=int)
 
     def add(self, input_val):
         assert input_val.shape == self.input_size
-        if self.input_times < self.kernel_size:
-            self.input_records[self.input_times,] = input_val
-            self.input_times += 1
-            return np.nanmean(self.input_records[0:self.input_times, ], axis=0)
-        else:
-            arr_idx = self.input_times % self.kernel_size
-            self.input_records[arr_idx,] = input_val
-            self.input_times += 1
-            return np.nanmean(self.input_records, axis=0)
+        arr_idx = self.input_times % self.kernel_size
+        if self.input_times >= self.kernel_size:
+            np.subtract(self._sum, self.input_records[arr_idx, ], out=self._sum, where=self._valid_records[arr_idx, ])
+            self._count -= self._valid_records[arr_idx, ]
+        input_valid = self._valid_records[arr_idx, ]
+        np.logical_not(np.isnan(input_val), out=input_valid)
+        self.input_records[arr_idx, ] = input_val
+        self.input_times += 1
+        np.add(self._sum, input_val, out=self._sum, where=input_valid)
+        self._count += input_valid
+
+        # Refresh the running sum once per cycle to avoid drifting by rounding error
+        if arr_idx == self.kernel_size - 1:
+            self._sum = np.nansum(self.input_records, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self._count > 0, self._sum / self._count, np.nan)
 
     def get_last(self):
+        """
+        Returns the last inserted input array (not filtered), or None if nothing is inserted yet.
+        """
         if self.input_times > 0:
-            return self.input_records[-1,]
+            return self.input_records[(self.input_times - 1) % self.kernel_size, ]
+
+    def filter_all(self, arr):
+        """
+        Filter all inputs at once, the same as calling self.add() for every frame of arr on a new filter.
+        The state of this filter is neither used nor changed.
+
+        Parameters
+        ----------
+        arr : numpy.darray
+            (num_frames, ) + input_size, e.g. (num_frames, 25, 2)
+
+        Returns
+        -------
+        arr_filtered : numpy.darray
+            Same shape as arr
+        """
+        assert arr.shape[1:] == tuple(self.input_size)
+        return _causal_window_mean(arr, self.kernel_size, ignore_nan=True)
 
     def _create_records_arr(self):
         """
@@ -302,13 +461,96 @@ class OnlineFilter_np():
         return input_records
 
 
+class NanWelfordAccumulator():
+    """
+    Streaming element-wise mean and variance (Welford's algorithm) of a sequence of equally shaped arrays. Nan entries
+    of an added array are skipped for that element only, such that mean() equals np.nanmean(np.stack(inputs), axis=0)
+    without keeping the inputs in memory.
+    """
+    __slots__ = ("input_size", "count", "_mean", "_m2")
+
+    def __init__(self, input_size):
+        self.input_size = tuple(input_size)
+        self.count = np.zeros(self.input_size, dtype=np.int64)
+        self._mean = np.zeros(self.input_size)
+        self._m2 = np.zeros(self.input_size)  # Sum of squared deviations from the mean
+
+    def add(self, input_val):
+        assert input_val.shape == self.input_size
+        input_valid = np.logical_not(np.isnan(input_val))
+        self.count += input_valid
+        delta = np.where(input_valid, input_val - self._mean, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self._mean += np.where(input_valid, delta / self.count, 0)
+        self._m2 += np.where(input_valid, delta * (input_val - self._mean), 0)
+
+    def merge(self, other):
+        """
+        Combine the statistics of another accumulator (e.g. from another shard of the inputs) into this one, as if all
+        of its inputs had been added here (Chan et al.'s parallel update).
+        """
+        assert other.input_size == self.input_size
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self._mean = np.where(count > 0, self._mean + delta * other.count / count, 0)
+            self._m2 = np.where(count > 0, self._m2 + other._m2 + delta ** 2 * self.count * other.count / count, 0)
+        self.count = count
+
+    def mean(self):
+        """
+        Returns the element-wise mean, nan for the elements that never had a valid input.
+        """
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def variance(self, ddof=0):
+        """
+        Returns the element-wise variance (as np.nanvar with the same ddof), nan where count <= ddof.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > ddof, self._m2 / (self.count - ddof), np.nan)
+
+    def state_dict(self):
+        return {"count": self.count, "mean": self._mean, "m2": self._m2}
+
+    @classmethod
+    def from_state_dict(cls, state):
+        accumulator = cls(np.shape(state["count"]))
+        accumulator.count = np.asarray(state["count"], dtype=np.int64)
+        accumulator._mean = np.asarray(state["mean"], dtype=float)
+        accumulator._m2 = np.asarray(state["m2"], dtype=float)
+        return accumulator
+
+
 class LabelsReader():
-    def __init__(self, labels_path):
+    def __init__(self, labels_path, label_tables=None):
+        """
+
+        Parameters
+        ----------
+        labels_path : str
+        label_tables : dict or None
+            Output of get_label_tables() of another LabelsReader. If given, labels_path is not read, such that the
+            labels can be shared with worker processes without reading and preprocessing the labels again.
+        """
         self.labels_path = labels_path
-        self.loaded_df = self._read_data_meta_info()
-        self.all_filenames = []
         self.output_cols = ["fn_mp4", 'task', "phenotyp_label", "idpatient", "phenotyp_order", "aver_leg"]
-        self.vid2task, self.vid2pheno, self.vid2idpatients, self.vid2leg = self._construct_conversion_dict()
+        if label_tables is None:
+            self.loaded_df = self._read_data_meta_info()
+            self.all_filenames = []
+            self.vid2task, self.vid2pheno, self.vid2idpatients, self.vid2leg = self._construct_conversion_dict()
+        else:
+            self.loaded_df = None
+            self.all_filenames = label_tables["all_filenames"]
+            self.vid2task, self.vid2pheno = label_tables["vid2task"], label_tables["vid2pheno"]
+            self.vid2idpatients, self.vid2leg = label_tables["vid2idpatients"], label_tables["vid2leg"]
+
+    def get_label_tables(self):
+        """
+        Returns the lookup tables of the labels (picklable dict), see label_tables in __init__()
+        """
+        return {"all_filenames": self.all_filenames, "vid2task": self.vid2task, "vid2pheno": self.vid2pheno,
+                "vid2idpatients": self.vid2idpatients, "vid2leg": self.vid2leg}
 
     def get_label(self, vid_name_root):
 
@@ -490,8 +732,7 @@ def read_openpose_keypoints(json_path):
         frame_idx: (int) Index of the corresponding video frame, as indicated in the file name of .json
     """
     # Find frame index
-    file_base_name = fullfile(json_path)[0]
-    frame_idx = int(re.findall('_(\\d{12})_', file_base_name)[0])
+    frame_idx = openpose_frame_index(json_path)
 
     # Find keypoints and number of people
     keypoints_dict = json2dict(json_path)
@@ -499,35 +740,651 @@ def read_openpose_keypoints(json_path):
     return keypoints_dict, num_people, frame_idx
 
 
-def read_oenpose_preprocessed_keypoints(np_path):
-    return np.load(np_path)['positions_2d']
+def openpose_frame_index(json_path):
+    """
+    /data/vid_000000000042_keypoints.json -> 42
+    """
+    return int(os.path.basename(json_path).rsplit("_", 2)[-2])
 
 
-def read_and_select_openpose_keypoints(json_path):
+def read_openpose_pose_keypoints(json_path):
     """
-    Extended from function read_openpose_keypoints(). Read and select the keypoints of the person in the rightest of the frame.
+    Fast version of read_openpose_keypoints() for the body keypoints only. Instead of building the whole dictionary
+    tree with json module, only the "pose_keypoints_2d" arrays are parsed, straight into a preallocated numpy array.
+    Face and hand keypoints are skipped.
 
     Args:
         json_path: (str) Path to the .json keypoints file
     Returns:
-        keypoints: (ndarray) Numpy array of keypoints with shape (3,25), representing x,y,confidence of the 25 keypoints
+        people_keypoints: (ndarray) Shape (num_people, 25, 3), x,y,confidence of the 25 keypoints of each person
+        num_people: (int) Number of people detected by openpose. It can be equal or greater than 0
+        frame_idx: (int) Index of the corresponding video frame, as indicated in the file name of .json
+    """
+    frame_idx = openpose_frame_index(json_path)
+    with open(json_path, "r") as fh:
+        text = fh.read()
+
+    pose_key = '"pose_keypoints_2d"'
+    num_people = text.count(pose_key)
+    people_keypoints = np.empty((num_people, 25, 3))
+    people_keypoints_flat = people_keypoints.reshape(num_people, 75)
+    end = 0
+    for person_idx in range(num_people):
+        start = text.index("[", text.index(pose_key, end)) + 1
+        end = text.index("]", start)
+        people_keypoints_flat[person_idx] = np.fromstring(text[start:end], sep=",")
+    return people_keypoints, num_people, frame_idx
+
+
+def pack_openpose_keypoints(openpose_data_each_video_dir, archive_path):
+    """
+    Pack the OpenPose .json keypoints files of all frames of a video into one consolidated archive (.npz, without
+    pickled objects), with the arrays:
+        num_people: (num_frames, ) int32, number of people detected in each frame
+        frame_indices: (num_frames, ) int64, index of the video frame, as indicated in the file name of .json
+        keypoints: (total_num_people, 25, 3) float32, keypoints of all people of all frames, concatenated in frame order
+
+    Args:
+        openpose_data_each_video_dir: (str) Directory that holds the .json keypoints file of every frame of the video
+        archive_path: (str) Path of the output archive. It should end with ".npz"
+    """
+    from glob import glob
+    json_paths = sorted(glob(os.path.join(openpose_data_each_video_dir, "*.json")))
+    num_people, frame_indices, keypoints_list = [], [], []
+    for json_path in json_paths:
+        people_keypoints, num_people_each, frame_idx = read_openpose_pose_keypoints(json_path)
+        num_people.append(num_people_each)
+        frame_indices.append(frame_idx)
+        keypoints_list.append(people_keypoints)
+    keypoints = np.concatenate(keypoints_list) if keypoints_list else np.zeros((0, 25, 3))
+
+    # Write to a temporary file first, such that an interrupted packing does not leave a truncated archive. It is
+    # hidden, such that the "*" globs over the archive directory (e.g. of openpose_preprocess_wrapper()) skip it
+    archive_dir, archive_name = os.path.split(archive_path)
+    tmp_archive_path = os.path.join(archive_dir, "." + archive_name + ".tmp")
+    with open(tmp_archive_path, "wb") as fh:
+        np.savez(fh,
+                 num_people=np.asarray(num_people, dtype=np.int32),
+                 frame_indices=np.asarray(frame_indices, dtype=np.int64),
+                 keypoints=keypoints.astype(np.float32))
+    os.replace(tmp_archive_path, archive_path)
+
+
+def read_openpose_keypoints_archive(archive_path):
+    """
+    Read the consolidated keypoints archive written by pack_openpose_keypoints().
+
+    Args:
+        archive_path: (str) Path to the archive
+    Returns:
+        people_keypoints_list: (list) Per-frame numpy arrays with shape (num_people, 25, 3), float32
+        num_people: (ndarray) Shape (num_frames, ), number of people detected in each frame
+        frame_indices: (ndarray) Shape (num_frames, ), index of the corresponding video frame
+    """
+    with np.load(archive_path, allow_pickle=False) as archive:
+        num_people = archive["num_people"]
+        frame_indices = archive["frame_indices"]
+        keypoints = archive["keypoints"]
+    people_keypoints_list = np.split(keypoints, np.cumsum(num_people)[:-1])
+    return people_keypoints_list, num_people, frame_indices
+
+
+def is_openpose_keypoints_archive(keyps_path):
+    return os.path.isfile(keyps_path) and keyps_path.endswith(".npz")
+
+
+# Version of the pickle-free .npz format of the preprocessed keypoints (Part-1 output), see
+# common.preprocess.save_data_openpose(). Files without "format_version" are of the old format with pickled objects.
+preprocessed_openpose_format_version = 2
+
+
+def load_npz_member_mmap(npz_path, key):
     """
-    keypoints_dict, num_people, _ = read_openpose_keypoints(json_path)
-    if num_people == 0:
-        return np.zeros((3, 25))
-    elif num_people == 1:
-        data_flat = np.asarray(keypoints_dict['people'][0]['pose_keypoints_2d'])
-        data = data_flat.reshape(int(len(data_flat) / 3), 3).T
+    Memory-map an array stored in an uncompressed .npz file (e.g. by np.savez), which np.load(mmap_mode=...) does
+    not do for .npz files.
+
+    Args:
+        npz_path: (str) Path to the .npz file
+        key: (str) Name of the array
+    Returns:
+        arr: (numpy.memmap) Read-only
+    Raises:
+        ValueError: If the array is compressed or is an object array.
+    """
+    import zipfile
+    with zipfile.ZipFile(npz_path) as zf:
+        info = zf.getinfo(key + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("{} in {} is compressed and cannot be memory-mapped".format(key, npz_path))
+    with open(npz_path, "rb") as fh:
+        # Skip the zip local file header (30 bytes + file name + extra field) to the start of the .npy file
+        fh.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(fh.read(4), dtype="<u2")
+        fh.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(fh)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fh)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fh)
+        offset = fh.tell()
+    if dtype.hasobject:
+        raise ValueError("{} in {} is an object array and cannot be memory-mapped".format(key, npz_path))
+    return np.memmap(npz_path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
+
+
+def read_oenpose_preprocessed_keypoints(np_path, mmap_mode=None):
+    """
+    Read only the keypoints of a preprocessed (Part-1 output) .npz file, without deserialising anything else.
+
+    Args:
+        np_path: (str) Path to the .npz file written by common.preprocess.save_data_openpose()
+        mmap_mode: (str) None to load the array into memory, or "r" to memory-map it (see load_npz_member_mmap())
+    Returns:
+        positions_2d: (ndarray) Shape (num_frames, 25, 3). float32, or float64 for the old format.
+    """
+    if mmap_mode is not None:
+        return load_npz_member_mmap(np_path, "positions_2d")
+    with np.load(np_path, allow_pickle=False) as data:
+        return data["positions_2d"]
+
+
+def read_oenpose_preprocessed_segments(np_path):
+    """
+    Read the keypoints of a preprocessed (Part-1 output) .npz file, split into its contiguous segments of confident
+    keypoints (see OpenposePreprocessor._find_extracted_duration()). The low-confidence frames between the segments
+    are dropped.
+
+    Args:
+        np_path: (str) Path to the .npz file written by common.preprocess.save_data_openpose()
+    Returns:
+        keyps_segments: (list) Keypoints of each segment, ndarray with shape (num_frames_of_segment, 25, 3). The whole
+            positions_2d as a single segment for files written without segments.
+    """
+    with np.load(np_path, allow_pickle=False) as npz:
+        new_format = "format_version" in npz.files
+        if new_format:
+            positions_2d, cut_duration, segments = npz["positions_2d"], npz["cut_duration"], npz["segments"]
+    if not new_format:
+        data = read_preprocessed_openpose_data(np_path)
+        positions_2d, cut_duration, segments = data["positions_2d"], data["cut_duration"], data["segments"]
+    return [positions_2d[start:end + 1] for start, end in segments - cut_duration[0]]
+
+
+def read_preprocessed_openpose_data(np_path, mmap_mode=None):
+    """
+    Read all arrays of a preprocessed (Part-1 output) .npz file as columns.
+
+    Args:
+        np_path: (str) Path to the .npz file written by common.preprocess.save_data_openpose()
+        mmap_mode: (str) None to load the arrays into memory, or "r" to memory-map them (new format only)
+    Returns:
+        data: (dict) With keys
+            positions_2d: (ndarray) Shape (num_frames, 25, 3)
+            translation: (ndarray) Shape (num_frames, 2)
+            resizing: (ndarray) Shape (num_frames, )
+            bbox: (ndarray) Shape (num_frames, 4)
+            video_shape: (ndarray) Shape (2, )
+            cut_duration: (ndarray) Shape (2, )
+            segments: (ndarray) Shape (num_segments, 2)
+            format_version, layout_name, num_joints, keypoints_symmetry
+        Files of the old format (with pickled objects) are converted to the same columns.
+    """
+    with np.load(np_path, allow_pickle=False) as npz:
+        keys = list(npz.keys())
+    if "format_version" in keys:
+        if mmap_mode is not None:
+            data = {key: load_npz_member_mmap(np_path, key) for key in keys}
+        else:
+            with np.load(np_path, allow_pickle=False) as npz:
+                data = {key: npz[key] for key in keys}
+        data["layout_name"] = str(data["layout_name"])
+        data["num_joints"] = int(data["num_joints"])
         return data
-    elif num_people > 1:
-        all_people_keypoints = []
-        for i in range(num_people):
-            data_flat_each_person = np.asarray(keypoints_dict['people'][i]['pose_keypoints_2d'])
-            data_each_person = data_flat_each_person.reshape(int(len(data_flat_each_person) / 3), 3).T  # (3, 25)
-            all_people_keypoints.append(data_each_person)
-        all_people_keypoints_np = np.asarray(all_people_keypoints)
-        person_idx = np.argmax(np.mean(all_people_keypoints_np[:, [0], :], axis=2), axis=0)
-        return all_people_keypoints_np[int(person_idx), :, :]
+
+    # Old format
+    with np.load(np_path, allow_pickle=True) as npz:
+        metadata, vid_info = npz["metadata"].item(), npz["vid_info"].item()
+        records = npz["preprocess_info"]
+        data = {"format_version": np.array(1), "positions_2d": npz["positions_2d"]}
+    data["translation"] = np.array([np.asarray(record["translation"]).reshape(2) for record in records])
+    data["resizing"] = np.array([record["resizing"] for record in records])
+    data["bbox"] = np.array([record["bbox"] for record in records])
+    data["video_shape"] = np.asarray(vid_info["video_shape"])
+    data["cut_duration"] = np.asarray(vid_info["cut_duration"])
+    data["segments"] = np.asarray(vid_info.get("segments", [vid_info["cut_duration"]])).reshape(-1, 2)
+    data["layout_name"] = metadata["layout_name"]
+    data["num_joints"] = metadata["num_joints"]
+    data["keypoints_symmetry"] = np.asarray(metadata["keypoints_symmetry"])
+    return data
+
+
+feature_store_format_version = 2
+
+
+class PackedKeypointsMask():
+    """
+    Boolean mask of shape (num_frames, num_keypoints, 2) kept bit-packed, with one bit per keypoint of a frame since
+    the x- and y-coordinates of a keypoint are masked together. Indexing unpacks only the frames selected by the first
+    index, and otherwise behaves as indexing the unpacked numpy array, e.g. mask[start:stop, :, 0].
+    """
+    __slots__ = ("packed", "shape", "packed_coords")
+
+    def __init__(self, packed, num_keypoints=25, packed_coords=1):
+        self.packed = packed  # (num_frames, ceil(num_keypoints * packed_coords / 8)) uint8
+        self.shape = (packed.shape[0], num_keypoints, 2)
+        self.packed_coords = packed_coords  # 2 if each coordinate has its own bit (feature store format version 1)
+
+    @classmethod
+    def from_mask(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        keypoints_mask = np.all(mask, axis=2)  # False (masked) if any coordinate of the keypoint is masked
+        return cls(np.packbits(keypoints_mask, axis=1), mask.shape[1])
+
+    def unpack(self, frames=slice(None)):
+        packed_frames = self.packed[frames]
+        unpacked = np.unpackbits(packed_frames.reshape(-1, self.packed.shape[1]), axis=1,
+                                 count=self.shape[1] * self.packed_coords).view(bool)
+        unpacked = unpacked.reshape(packed_frames.shape[:-1] + (self.shape[1], self.packed_coords))
+        return np.repeat(unpacked, 2 // self.packed_coords, axis=-1)
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if (len(key) == 0) or (key[0] is Ellipsis):
+            return self.unpack()[key]
+        frames = key[0]
+        if isinstance(frames, slice) or (np.ndim(frames) > 0):
+            return self.unpack(frames)[(slice(None),) + key[1:]]
+        return self.unpack(frames)[key[1:]]  # A single frame, without the frame axis
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        unpacked = self.unpack()
+        return unpacked if dtype is None else unpacked.astype(dtype)
+
+
+def pack_motion_masks(masks):
+    """
+    Bit-pack the masks of a batch of motion sequences, with one bit per keypoint and frame.
+
+    Parameters
+    ----------
+    masks : numpy.darray
+        Shape (num_samples, 50, seq_len), with the x-coordinates of the 25 keypoints in rows 0:25 and the y-coordinates
+        in rows 25:50. True = confident keypoint
+
+    Returns
+    -------
+    packed : numpy.darray
+        uint8 with shape (num_samples, 25, ceil(seq_len / 8))
+    """
+    masks = np.asarray(masks, dtype=bool)
+    num_keypoints = masks.shape[1] // 2
+    keypoints_masks = masks[:, 0:num_keypoints, :] & masks[:, num_keypoints:, :]
+    return np.packbits(keypoints_masks, axis=2)
+
+
+def unpack_motion_masks(packed, seq_len):
+    """
+    Inverse of pack_motion_masks(). Dense masks of shape (num_samples, 50, seq_len), as saved before the packing, are
+    returned as bool.
+
+    Parameters
+    ----------
+    packed : numpy.darray
+        uint8 with shape (num_samples, 25, ceil(seq_len / 8))
+    seq_len : int
+
+    Returns
+    -------
+    masks : numpy.darray
+        bool with shape (num_samples, 50, seq_len)
+    """
+    if packed.dtype != np.uint8:
+        return packed.astype(bool)
+    keypoints_masks = np.unpackbits(packed, axis=-1, count=seq_len).view(bool)
+    return np.concatenate([keypoints_masks, keypoints_masks], axis=-2)
+
+
+def is_feature_store(store_path):
+    return os.path.splitext(store_path)[1] == ".npz"
+
+
+def _concat_feature_columns(df):
+    num_frames = np.array([feature.shape[0] for feature in df["features"]], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(num_frames)]).astype(np.int64)
+    if num_frames.shape[0] == 0:
+        return np.zeros((0, 25, 2), dtype=np.float32), np.zeros((0, 4), dtype=np.uint8), offsets
+    features = np.concatenate(list(df["features"])).astype(np.float32)
+    feature_masks = PackedKeypointsMask.from_mask(np.concatenate([np.asarray(mask) for mask in
+                                                                  df["feature_masks"]])).packed
+    return features, feature_masks, offsets
+
+
+def write_feature_store(df, store_path):
+    """
+    Write the dataframe of FeatureExtractorForODE (Part-2 output) as a columnar feature store, an uncompressed .npz
+    file without pickled objects:
+        features: (total_num_frames, 25, 2) float32, the "features" of all rows concatenated along the frames
+        feature_masks: (total_num_frames, 4) uint8, the "feature_masks" of all rows, bit-packed with a bit per
+            keypoint (see PackedKeypointsMask)
+        offsets: (num_rows + 1, ) int64, the frames of row i are [offsets[i], offsets[i+1])
+        label_columns: names of the other columns (tasks, phenos, idpatients, ...), each stored as "label_<name>"
+        columns: names of all columns, in the order of df
+    All arrays can be memory-mapped, see read_feature_store().
+
+    Args:
+        df: (pandas.DataFrame) With columns "features" and "feature_masks" of arrays (num_frames, 25, 2), and other
+            columns of scalars (numbers, booleans or strings)
+        store_path: (str) Path of the .npz file
+    """
+    features, feature_masks, offsets = _concat_feature_columns(df)
+    arrays = {
+        "format_version": np.array(feature_store_format_version),
+        "offsets": offsets,
+        "features": features,
+        "feature_masks": feature_masks
+    }
+    label_columns = [column for column in df.columns if column not in ("features", "feature_masks")]
+    arrays["label_columns"] = np.array(label_columns, dtype=str)
+    arrays["columns"] = np.array(list(df.columns), dtype=str)
+    for column in label_columns:
+        label_arr = np.asarray(df[column].tolist())
+        if label_arr.dtype.hasobject:
+            label_arr = np.asarray(df[column].astype(float).tolist())  # e.g. idpatients with None
+        arrays["label_" + column] = label_arr
+
+    # Write to a temporary file first, such that an interrupted run never leaves a truncated output
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmp_path, store_path)
+
+
+def read_feature_store(store_path, mmap_mode="r"):
+    """
+    Read a feature store written by write_feature_store() as the same dataframe that it was written from. The
+    "features" cells are views of the memory-mapped concatenated array, and the "feature_masks" cells are
+    PackedKeypointsMask of the memory-mapped bit-packed masks, such that only the frames that are accessed are read
+    from disk.
+
+    Args:
+        store_path: (str) Path of the .npz file
+        mmap_mode: (str) "r" to memory-map the features and masks, or None to load them into memory
+    Returns:
+        df: (pandas.DataFrame)
+    """
+    with np.load(store_path, allow_pickle=False) as npz:
+        format_version = int(npz["format_version"])
+        offsets = npz["offsets"]
+        label_columns = [str(column) for column in npz["label_columns"]]
+        columns = [str(column) for column in npz["columns"]]
+        labels = {column: npz["label_" + column] for column in label_columns}
+        if mmap_mode is None:
+            features, feature_masks = npz["features"], npz["feature_masks"]
+    if mmap_mode is not None:
+        features = load_npz_member_mmap(store_path, "features")
+        feature_masks = load_npz_member_mmap(store_path, "feature_masks")
+    num_rows = offsets.shape[0] - 1
+    labels["features"] = [features[offsets[i]:offsets[i + 1]] for i in range(num_rows)]
+    packed_coords = 2 if format_version == 1 else 1
+    labels["feature_masks"] = [PackedKeypointsMask(feature_masks[offsets[i]:offsets[i + 1]], features.shape[1],
+                                                   packed_coords) for i in range(num_rows)]
+    df = pd.DataFrame()
+    for column in columns:
+        df[column] = labels[column]
+    return df
+
+
+def concat_feature_rows(df):
+    """
+    Concatenate the "features" and "feature_masks" of all rows of a Part-2 dataframe into buffers of the feature store
+    layout (see write_feature_store()), and replace the cells of df by views of the buffers, such that the data is held
+    only once.
+
+    Args:
+        df: (pandas.DataFrame) Modified in place
+    Returns:
+        features: (ndarray) float32 with shape (total_num_frames, 25, 2)
+        feature_masks: (ndarray) uint8 with shape (total_num_frames, 4), bit-packed (see PackedKeypointsMask)
+        offsets: (ndarray) int64 with shape (num_rows + 1, ), the frames of row i are [offsets[i], offsets[i+1])
+    """
+    features, feature_masks, offsets = _concat_feature_columns(df)
+    num_rows = offsets.shape[0] - 1
+    df["features"] = [features[offsets[i]:offsets[i + 1]] for i in range(num_rows)]
+    df["feature_masks"] = [PackedKeypointsMask(feature_masks[offsets[i]:offsets[i + 1]], features.shape[1])
+                           for i in range(num_rows)]
+    return features, feature_masks, offsets
+
+
+def load_features_df(df_path, with_buffers=False):
+    """
+    Load the Part-2 output, either a feature store (.npz, see read_feature_store()) or a dataframe pickle.
+
+    Args:
+        df_path: (str)
+        with_buffers: (bool) If True, also return the concatenated features, the bit-packed masks and the offsets of
+            the rows, as returned by concat_feature_rows(). For a feature store, they are memory-mapped.
+    Returns:
+        df: (pandas.DataFrame)
+        buffers: (tuple) Only if with_buffers is True
+    """
+    if not with_buffers:
+        return read_feature_store(df_path) if is_feature_store(df_path) else load_df_pickle(df_path)
+    if not is_feature_store(df_path):
+        df = load_df_pickle(df_path)
+        return df, concat_feature_rows(df)
+    with np.load(df_path, allow_pickle=False) as npz:
+        format_version, offsets = int(npz["format_version"]), npz["offsets"]
+    if format_version == 1:  # Masks with a bit per coordinate. Re-pack them with a bit per keypoint
+        df = read_feature_store(df_path)
+        return df, concat_feature_rows(df)
+    buffers = (load_npz_member_mmap(df_path, "features"), load_npz_member_mmap(df_path, "feature_masks"), offsets)
+    return read_feature_store(df_path), buffers
+
+
+def read_and_select_openpose_keypoints(json_path, frame_idx=None, archive=None):
+    """
+    Extended from function read_openpose_keypoints(). Read and select the keypoints of the person in the rightest of the frame.
+
+    Args:
+        json_path: (str) Path to the .json keypoints file. Not used if archive is given.
+        frame_idx: (int) Index of the video frame. Only needed with archive.
+        archive: (tuple) Consolidated keypoints archive of the video (see pack_openpose_keypoints()), as returned by
+                 read_openpose_keypoints_archive(). Read it once for all frames of the video.
+    Returns:
+        keypoints: (ndarray) Numpy array of keypoints with shape (3,25), representing x,y,confidence of the 25 keypoints
+    """
+    if archive is not None:
+        people_keypoints_list, _, frame_indices = archive
+        people_keypoints = people_keypoints_list[int(np.nonzero(frame_indices == frame_idx)[0][0])].astype(float)
+    else:
+        people_keypoints, _, _ = read_openpose_pose_keypoints(json_path)
+
+    people_keyps, people_mask = pad_people_keypoints([people_keypoints])
+    selected_keyps, _ = select_people_keypoints(people_keyps, people_mask, rule="rightmost")
+    return selected_keyps[0].T
+
+
+def pad_people_keypoints(people_keypoints_list):
+    """
+    Pad the keypoints of a varying number of people per frame to one array.
+
+    Args:
+        people_keypoints_list: (list) Per-frame numpy arrays with shape (num_people, 25, 3)
+    Returns:
+        people_keyps: (ndarray) Shape (num_frames, max_people, 25, 3). Padded entries are 0.
+        people_mask: (ndarray) Shape (num_frames, max_people), True for the detected (non-padded) people.
+    """
+    num_people = np.array([people_keypoints.shape[0] for people_keypoints in people_keypoints_list], dtype=int)
+    max_people = max(int(np.max(num_people)) if num_people.shape[0] > 0 else 0, 1)
+    people_mask = np.arange(max_people)[np.newaxis, :] < num_people[:, np.newaxis]
+    people_keyps = np.zeros((num_people.shape[0], max_people, 25, 3))
+    if num_people.sum() > 0:
+        people_keyps[people_mask] = np.concatenate(people_keypoints_list)
+    return people_keyps, people_mask
+
+
+def _select_rightmost(people_keyps, people_mask):
+    """
+    The person with the largest mean x-coordinate of the keypoints with confidence >= 0.005. A person whose mean is not
+    positive is never preferred over the first person, and the first one is taken for ties.
+    """
+    confident = people_keyps[..., 2] >= 0.005  # (num_frames, max_people, 25)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = np.sum(np.where(confident, people_keyps[..., 0], 0), axis=2) / np.sum(confident, axis=2)
+    return np.argmax(np.where(people_mask & (mean_x > 0), mean_x, 0), axis=1)
+
+
+def _select_largest(people_keyps, people_mask):
+    """
+    The person with the largest area of the bounding box spanned by the keypoints with confidence >= 0.005.
+    """
+    confident = (people_keyps[..., 2] >= 0.005)[..., np.newaxis]  # (num_frames, max_people, 25, 1)
+    xy_max = np.max(np.where(confident, people_keyps[..., 0:2], -np.inf), axis=2)
+    xy_min = np.min(np.where(confident, people_keyps[..., 0:2], np.inf), axis=2)
+    with np.errstate(invalid="ignore"):
+        area = np.prod(xy_max - xy_min, axis=2)
+    return np.argmax(np.where(people_mask & np.isfinite(area), area, -1), axis=1)
+
+
+def _people_centres(people_keyps):
+    """
+    Mean (x, y) of the keypoints with confidence > 0.05 of each person. nan if none of the keypoints is confident.
+    """
+    confident = (people_keyps[..., 2] > 0.05)[..., np.newaxis]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sum(np.where(confident, people_keyps[..., 0:2], 0), axis=-2) / np.sum(confident, axis=-2)
+
+
+def _select_closest(people_keyps, people_mask):
+    """
+    The person whose centre is the closest to the centre of the person selected in the previous frame.
+    The first frame (or the frames before any centre is found) falls back to the rightmost rule.
+
+    Unlike the other rules, it is a recurrence over frames. Only the frames with two or more people with a centre
+    depend on the previous selection, and only they are processed frame by frame (about 20 us each). The other frames
+    are selected at once: their single person with a centre, or the rightmost rule if there is none.
+    """
+    centres = _people_centres(people_keyps)  # (num_frames, max_people, 2)
+    person_indices = _select_rightmost(people_keyps, people_mask)
+    frame_indices = np.arange(people_keyps.shape[0])
+
+    # Frames up to the first one whose selected person has a centre have no previous centre (rightmost rule)
+    has_centre = people_mask.any(axis=1) & np.all(np.isfinite(centres[frame_indices, person_indices]), axis=1)
+    if not has_centre.any():
+        return person_indices
+    first_anchored = np.argmax(has_centre)
+
+    # Afterwards, a frame with people with a centre selects one of them, and its centre is the next previous centre
+    candidates = people_mask & np.all(np.isfinite(centres), axis=2)
+    num_candidates = np.sum(candidates, axis=1)
+    after_anchor = frame_indices > first_anchored
+    single = after_anchor & (num_candidates == 1)
+    person_indices[single] = np.argmax(candidates[single], axis=1)
+
+    previous_frames = np.maximum.accumulate(np.where(num_candidates > 0, frame_indices, -1))
+    for frame_idx in np.nonzero(after_anchor & (num_candidates > 1))[0]:
+        previous_frame = previous_frames[frame_idx - 1]
+        previous_centre = centres[previous_frame, person_indices[previous_frame]]
+        dists = np.linalg.norm(centres[frame_idx] - previous_centre, axis=1)
+        dists[~(people_mask[frame_idx] & np.isfinite(dists))] = np.inf
+        person_indices[frame_idx] = np.argmin(dists)
+    return person_indices
+
+
+def track_people(people_keyps, people_mask, max_gap=15, max_distance=100):
+    """
+    Link the detected people across frames into tracks by their centre distance.
+
+    In each frame, the detections are assigned to the tracks seen within the last max_gap frames (sliding window) by
+    Hungarian assignment on the distance between the detection's centre and the track's last centre. Detections
+    further than max_distance from every track, or left unassigned, start new tracks.
+
+    Args:
+        people_keyps: (ndarray) Shape (num_frames, max_people, 25, 3), see pad_people_keypoints()
+        people_mask: (ndarray) Shape (num_frames, max_people), True for the detected (non-padded) people.
+        max_gap: (int) Number of frames a track can be missing before it is terminated.
+        max_distance: (float) Maximum centre displacement in pixels for linking a detection to a track.
+    Returns:
+        track_ids: (ndarray) Shape (num_frames, max_people), int. Track index of each person. -1 for the padded
+                   people and the people without any confident keypoint.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    centres = _people_centres(people_keyps)  # (num_frames, max_people, 2)
+    valid = people_mask & np.all(np.isfinite(centres), axis=2)
+    track_ids = np.full(people_mask.shape, -1, dtype=int)
+    track_centres, track_last_frames = [], []
+    for frame_idx in range(people_keyps.shape[0]):
+        people_indices = np.where(valid[frame_idx])[0]
+        if people_indices.shape[0] == 0:
+            continue
+        active_tracks = [track_idx for track_idx, last_frame in enumerate(track_last_frames)
+                         if frame_idx - last_frame <= max_gap]
+        assigned = np.zeros(people_indices.shape[0], dtype=bool)
+        if len(active_tracks) > 0:
+            costs = np.linalg.norm(centres[frame_idx, people_indices][:, np.newaxis, :] -
+                                   np.asarray([track_centres[i] for i in active_tracks])[np.newaxis, :, :], axis=2)
+            rows, cols = linear_sum_assignment(costs)
+            for row, col in zip(rows, cols):
+                if costs[row, col] <= max_distance:
+                    track_ids[frame_idx, people_indices[row]] = active_tracks[col]
+                    assigned[row] = True
+        for row in np.where(~assigned)[0]:
+            track_ids[frame_idx, people_indices[row]] = len(track_centres)
+            track_centres.append(None)
+            track_last_frames.append(None)
+        for person_idx in people_indices:
+            track_centres[track_ids[frame_idx, person_idx]] = centres[frame_idx, person_idx]
+            track_last_frames[track_ids[frame_idx, person_idx]] = frame_idx
+    return track_ids
+
+
+def _select_longest_track(people_keyps, people_mask):
+    """
+    The person on the track detected in the most frames (see track_people()). Frames where that track is not
+    detected get no subject (-1), instead of a different person.
+    """
+    track_ids = track_people(people_keyps, people_mask)
+    if np.max(track_ids) < 0:
+        return np.full(people_mask.shape[0], -1, dtype=int)
+    longest_track = np.argmax(np.bincount(track_ids[track_ids >= 0]))
+    on_track = track_ids == longest_track
+    return np.where(on_track.any(axis=1), np.argmax(on_track, axis=1), -1)
+
+
+subject_selection_rules = {
+    "rightmost": _select_rightmost,
+    "largest": _select_largest,
+    "closest": _select_closest,
+    "track": _select_longest_track
+}
+
+
+def select_people_keypoints(people_keyps, people_mask, rule="rightmost"):
+    """
+    Select one subject in every frame from the padded keypoints of all detected people.
+
+    Args:
+        people_keyps: (ndarray) Shape (num_frames, max_people, 25, 3), see pad_people_keypoints()
+        people_mask: (ndarray) Shape (num_frames, max_people), True for the detected (non-padded) people.
+        rule: (str or callable) Key of subject_selection_rules ("rightmost", "largest", "closest", "track"), or a
+              function f(people_keyps, people_mask) that returns the selected person index (num_frames, ) of each
+              frame, or -1 for no subject.
+    Returns:
+        selected_keyps: (ndarray) Shape (num_frames, 25, 3). Zeros for the frames without a subject.
+        person_indices: (ndarray) Shape (num_frames, ). Index of the selected person. -1 for frames without a subject.
+    """
+    rule_func = subject_selection_rules[rule] if isinstance(rule, str) else rule
+    person_indices = np.asarray(rule_func(people_keyps, people_mask))
+    has_subject = people_mask.any(axis=1) & (person_indices >= 0)
+    person_indices = np.where(has_subject, person_indices, -1)
+    selected_keyps = people_keyps[np.arange(people_keyps.shape[0]), np.maximum(person_indices, 0)]
+    selected_keyps[~has_subject] = 0
+    return selected_keyps, person_indices
 
 
 def rename_files(folder, replace_arg):
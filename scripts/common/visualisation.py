@@ -1,4 +1,4 @@
-from .keypoints_format import excluded_points, draw_seq_col_indexes
+from .keypoints_format import excluded_points, draw_seq_col_indexes, openpose_L_indexes, openpose_R_indexes
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -53,6 +53,115 @@ def draw_skeleton_custom(ax, x, y, c, alpha, linewidth=1):
     return ax
 
 
+# 3x5 bitmap font of the characters needed by the captions of draw_keypoints_overlay(). Each row is 3 bits.
+_bitmap_font = {
+    "0": "111 101 101 101 111", "1": "010 110 010 010 111", "2": "111 001 111 100 111", "3": "111 001 111 001 111",
+    "4": "101 101 111 001 001", "5": "111 100 111 001 111", "6": "111 100 111 101 111", "7": "111 001 010 010 010",
+    "8": "111 101 111 101 111", "9": "111 101 111 001 111", ".": "000 000 000 000 010", ":": "000 010 000 010 000",
+    "-": "000 000 111 000 000", " ": "000 000 000 000 000", "A": "010 101 111 101 101", "E": "111 100 111 100 111",
+    "G": "111 100 101 101 111", "H": "101 101 111 101 101", "L": "100 100 100 100 111", "N": "101 111 111 111 101",
+    "O": "111 101 101 101 111", "R": "110 101 110 101 101", "S": "111 100 111 001 111", "T": "111 010 010 010 010"
+}
+
+
+def raster_markers(frame, points, color, size=3):
+    """
+    Draw "x" markers on the frame in place, without matplotlib.
+
+    Parameters
+    ----------
+    frame : numpy.darray
+        (h, w, 3) uint8
+    points : numpy.darray
+        (num_points, 2), (x, y) of the markers. Points with nan are skipped.
+    color : tuple
+        (r, g, b)
+    size : int
+        Half length of the marker's strokes in pixels.
+    """
+    points = points[np.all(np.isfinite(points), axis=1)]
+    centres = np.around(points).astype(int)  # (num_points, 2)
+    offsets = np.arange(-size, size + 1)
+    xs = (centres[:, 0:1] + offsets).ravel()
+    ys = np.concatenate([(centres[:, 1:2] + offsets).ravel(), (centres[:, 1:2] - offsets).ravel()])
+    xs = np.concatenate([xs, xs])
+    inside = (xs >= 0) & (xs < frame.shape[1]) & (ys >= 0) & (ys < frame.shape[0])
+    frame[ys[inside], xs[inside]] = color
+    return frame
+
+
+def raster_text(frame, text, origin=(2, 2), color=(255, 255, 255), background=(0, 0, 0), scale=2):
+    """
+    Draw text on the frame in place with a 3x5 bitmap font, without matplotlib. Letters are drawn in upper case.
+    Characters not in the font are drawn as spaces. "\\n" starts a new line.
+
+    Parameters
+    ----------
+    frame : numpy.darray
+        (h, w, 3) uint8
+    text : str
+    origin : tuple
+        (x, y) of the top-left corner of the text
+    color, background : tuple
+        (r, g, b) of the text and the box behind it. background=None leaves the frame visible behind the text.
+    scale : int
+        Size of each font pixel in frame pixels.
+    """
+    lines = text.upper().split("\n")
+    bitmap = np.zeros((6 * len(lines), 4 * max(len(line) for line in lines)), dtype=bool)
+    for line_idx, line in enumerate(lines):
+        for char_idx, char in enumerate(line):
+            rows = _bitmap_font.get(char, _bitmap_font[" "]).split(" ")
+            glyph = np.array([[bit == "1" for bit in row] for row in rows])
+            bitmap[line_idx * 6:line_idx * 6 + 5, char_idx * 4:char_idx * 4 + 3] = glyph
+    bitmap = np.kron(bitmap, np.ones((scale, scale), dtype=bool))
+
+    # Clip the text box to the frame
+    x, y = origin
+    h = min(bitmap.shape[0], frame.shape[0] - y)
+    w = min(bitmap.shape[1], frame.shape[1] - x)
+    if h <= 0 or w <= 0:
+        return frame
+    region = frame[y:y + h, x:x + w]
+    if background is not None:
+        region[:] = background
+    region[bitmap[0:h, 0:w]] = color
+    return frame
+
+
+def draw_keypoints_overlay(frame, keypoints_xy, caption="", L_indexes=None, R_indexes=None):
+    """
+    Draw the keypoints (left in red, right in blue) and a caption on a copy of the frame, directly on the uint8 raster.
+    It is the cheap replacement of plotting each frame with matplotlib.
+
+    Parameters
+    ----------
+    frame : numpy.darray
+        (h, w, 3) video frame with range [0, 255]
+    keypoints_xy : numpy.darray
+        (25, 2) keypoints in the frame's coordinate system. Keypoints with nan are not drawn.
+    caption : str
+        Drawn at the top-left corner. See raster_text() for the supported characters.
+    L_indexes, R_indexes : list
+        Indexes of the left/right keypoints. Default: openpose_L_indexes and openpose_R_indexes
+
+    Returns
+    -------
+    output_frame : numpy.darray
+        (h, w, 3) uint8
+    """
+    if L_indexes is None:
+        L_indexes = openpose_L_indexes
+    if R_indexes is None:
+        R_indexes = openpose_R_indexes
+    output_frame = np.clip(frame, 0, 255).astype(np.uint8)
+    raster_markers(output_frame, keypoints_xy[L_indexes], color=(255, 0, 0))
+    raster_markers(output_frame, keypoints_xy[R_indexes], color=(0, 0, 255))
+    if caption:
+        raster_text(output_frame, caption)
+    return output_frame
+
+
 class SkeletonPainter:
     def __init__(self, x, y, texts, sep_x=0.4, y_lim=[-0.6, 0.6]):
         """
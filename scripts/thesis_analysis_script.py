@@ -1,7 +1,7 @@
 # Environment $ nvidia-docker run --rm -it -e NVIDIA_VISIBLE_DEVICES=0 -v /data/hoi/gait_analysis:/mnt yyhhoi/neuro:1 bash
 
 from Spatiotemporal_VAE.Containers import BaseContainer, ConditionalContainer, PhenoCondContainer
-from common.generator import GaitGeneratorFromDFforTemporalVAE
+from common.generator import GaitGeneratorFromDFforTemporalVAE, PatientBatchSampler
 from common.utils import dict2json, json2dict
 import os
 import pprint
@@ -14,7 +14,7 @@ def print_model_info(model_identifier, hyper_params):
 
 
 def load_model_container(model_class, model_identifier, df_path, datagen_batch_size=512, gaitprint_completion=False,
-                         train_portion=0.99, seed=0):
+                         train_portion=0.99, seed=0, batch_sampler=None):
     # This function returns an object that wraps over the DL model
     # For each different model identifier, different set of hyperparameters is used
     # To look for the hyper-parameters I used, go to /data/hoi/gait_analysis/scripts/Spatiotemporal_VAE/model_chkpt/
@@ -65,7 +65,8 @@ def load_model_container(model_class, model_identifier, df_path, datagen_batch_s
     if df_path:
         data_gen = GaitGeneratorFromDFforTemporalVAE(df_path, m=datagen_batch_size, n=seq_dim,
                                                      train_portion=train_portion,
-                                                     gait_print=gaitprint_completion, seed=seed)
+                                                     gait_print=gaitprint_completion, seed=seed,
+                                                     batch_sampler=batch_sampler)
     else:
         data_gen = None
 
@@ -97,7 +98,7 @@ def load_model_container(model_class, model_identifier, df_path, datagen_batch_s
 
 
 def run_train_and_vis_on_stvae():
-    df_path = "/mnt/data/full_feas_tasks_phenos_nanMasks_idpatient_leg.pickle"
+    df_path = "/mnt/data/full_feas_tasks_phenos_nanMasks_idpatient_leg.npz"
     training_epoch = 1000
     # Choose the model identifier is one of the four: Thesis_B, Thesis_B+C, Thesis_B+C+T, Thesis_B+C+T+P
     # model_identifier = "Thesis_B"
@@ -109,6 +110,8 @@ def run_train_and_vis_on_stvae():
     # Based on the model identifier you choose, you will need to the variable identifiers below
     gaitprint_completion = True # True for Thesis B+T+C+P, False for Thesis_B, Thesis_B+C, Thesis_B+C+T
     batch_size = 64  # 64 for Thesis_B+C+T+P, 512 for Thesis_B, Thesis_B+C, Thesis_B+C+T
+    batch_sampler = None  # Or fixed-size batches of 8 patients x 8 tasks for Thesis_B+C+T+P, in place of the above:
+    # batch_sampler = PatientBatchSampler(num_patients=8, tasks_per_patient=8, strategy="pheno_stratified")
     # model_class = BaseContainer  # For Thesis_B
     # model_class = ConditionalContainer  # For Thesis_B+C or Thesis_B+C+T
     model_class = PhenoCondContainer  # For Thesis_B+C+T+P
@@ -120,7 +123,8 @@ def run_train_and_vis_on_stvae():
                                                             datagen_batch_size=batch_size,
                                                             gaitprint_completion=gaitprint_completion,
                                                             train_portion=0.80,
-                                                            seed=0)
+                                                            seed=0,
+                                                            batch_sampler=batch_sampler)
     # Model checkpoint is automatically saved in every epoch at Spatiotemporal_VAE/model_chkpt/
     model_container.train(training_epoch)
 
@@ -136,7 +140,7 @@ def run_save_model_outputs():
     """
     from Spatiotemporal_VAE.analysis_scripts.thesis_save_model_outputs import OutputSavers
     # Input dataframe
-    df_path = "/mnt/data/full_feas_tasks_phenos_nanMasks_idpatient_leg.pickle"
+    df_path = "/mnt/data/full_feas_tasks_phenos_nanMasks_idpatient_leg.npz"
 
     # Output dataframes. One for the general results. One for the PhenoNet identificaiton
     df_save_path = "/mnt/thesis_results/data/model_outputs_full_final.pickle"
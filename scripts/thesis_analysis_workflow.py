@@ -51,7 +51,7 @@ openpose_preprocess_wrapper(src_vid_dir, input_data_main_dir, output_vid_dir, ou
 from common.feature_extraction import FeatureExtractorForODE
 scr_keyps_dir = "/mnt/data/preprocessed_keypoints"
 labels_path = "/mnt/data/labels/fn_tasks_phenos_validated_rename.pkl"
-df_save_path = "/mnt/data/full_feas_tasks_phenos_nanMasks_idpatient_leg.pickle"
+df_save_path = "/mnt/data/full_feas_tasks_phenos_nanMasks_idpatient_leg.npz"
 minimum_sequence_window = 128  # Predefined fixed video segment length
 extractor = FeatureExtractorForODE(scr_keyps_dir=scr_keyps_dir,
                                    labels_path=labels_path,
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The packages (common, Spatiotemporal_VAE) are imported from the scripts directory, as in the scripts themselves
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
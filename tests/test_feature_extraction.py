@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")  # common.utils
+
+from common.feature_extraction import FeatureExtractorForODE
+from common.utils import read_oenpose_preprocessed_segments, load_df_pickle
+
+
+def write_keypoints_file(path, positions_2d, cut_duration, segments):
+    # Part-1 output, as written by common.preprocess.save_data_openpose()
+    np.savez(path, format_version=np.array(2), positions_2d=positions_2d.astype(np.float32),
+             video_shape=np.array([250, 250]), cut_duration=np.asarray(cut_duration),
+             segments=np.asarray(segments).reshape(-1, 2), layout_name=np.array("body_25"), num_joints=np.array(25),
+             keypoints_symmetry=np.array([[12, 13, 14, 5, 6, 7], [9, 10, 11, 2, 3, 4]]))
+
+
+def make_keypoints(num_frames, seed=0):
+    rng = np.random.RandomState(seed)
+    xy = rng.uniform(50, 200, size=(num_frames, 25, 2))
+    conf = rng.uniform(0.5, 1, size=(num_frames, 25, 1))
+    return np.concatenate([xy, conf], axis=2)
+
+
+def make_extractor(tmp_path):
+    empty_labels = {"all_filenames": set(), "vid2task": {}, "vid2pheno": {}, "vid2idpatients": {}, "vid2leg": {}}
+    return FeatureExtractorForODE(str(tmp_path), labels_path=None, df_save_path=str(tmp_path / "df.pickle"),
+                                  stats_cache_path=None, label_tables=empty_labels)
+
+
+def test_segments_drop_gap_frames(tmp_path):
+    # Frames 10-39 are kept by Part-1, with a low-confidence gap at frames 20-24 (marked by x = 1000)
+    keyps = make_keypoints(30)
+    keyps[10:15, :, 0] = 1000
+    write_keypoints_file(str(tmp_path / "vid.npz"), keyps, (10, 39), [[10, 19], [25, 39]])
+
+    keyps_segments = read_oenpose_preprocessed_segments(str(tmp_path / "vid.npz"))
+    assert [keyps_arr.shape[0] for keyps_arr in keyps_segments] == [10, 15]
+    np.testing.assert_array_equal(keyps_segments[0], keyps[0:10].astype(np.float32))
+    np.testing.assert_array_equal(keyps_segments[1], keyps[15:30].astype(np.float32))
+
+    extractor = make_extractor(tmp_path)
+    extractor.extract()
+    df = load_df_pickle(str(tmp_path / "df.pickle"))
+    assert list(df["vid_name_roots"]) == ["vid", "vid"]
+    assert [feature.shape[0] for feature in df["features"]] == [10, 15]
+    for feature, keyps_arr in zip(df["features"], keyps_segments):
+        expected, _ = extractor._transform_to_features(keyps_arr)
+        np.testing.assert_allclose(feature, expected)
+
+
+def test_single_segment_file_gives_single_row(tmp_path):
+    keyps = make_keypoints(20, seed=1)
+    write_keypoints_file(str(tmp_path / "vid.npz"), keyps, (5, 24), [[5, 24]])
+    extractor = make_extractor(tmp_path)
+    extractor.extract()
+    df = load_df_pickle(str(tmp_path / "df.pickle"))
+    assert [feature.shape[0] for feature in df["features"]] == [20]
+
+
+def test_parallel_extraction_splits_segments_as_serial(tmp_path):
+    for idx, segments in enumerate([[[0, 9], [15, 29]], [[3, 30]]]):
+        write_keypoints_file(str(tmp_path / "vid{}.npz".format(idx)), make_keypoints(31, seed=idx), (0, 30), segments)
+    extractor = make_extractor(tmp_path)
+    extractor.extract()
+    df_serial = load_df_pickle(str(tmp_path / "df.pickle"))
+    os.remove(str(tmp_path / "df.pickle"))
+
+    extractor = make_extractor(tmp_path)
+    extractor.extract_parallel(num_workers=2)
+    df_parallel = load_df_pickle(str(tmp_path / "df.pickle"))
+    assert list(df_parallel["vid_name_roots"]) == ["vid0", "vid0", "vid1"]
+    for feature_serial, feature_parallel in zip(df_serial["features"], df_parallel["features"]):
+        np.testing.assert_array_equal(feature_serial, feature_parallel)
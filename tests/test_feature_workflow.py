@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")  # common.utils
+pairwise = pytest.importorskip("sklearn.metrics.pairwise")
+
+from common.feature_extraction import FeatureExtractor
+from common.keypoints_format import openpose_L_indexes, openpose_R_indexes, openpose_central_indexes
+
+
+def asymmetry_measure_loop(data_each_frame):
+    # Reference: the per-anchor implementation that FeatureExtractor._asymmetry_measure() replaced
+    L_keyps = data_each_frame[openpose_L_indexes, :]
+    R_keyps = data_each_frame[openpose_R_indexes, :]
+    anchor_points = data_each_frame[openpose_central_indexes, :]
+    all_anchors_degree_list = []
+    for i in range(anchor_points.shape[0]):
+        each_anchor_point = anchor_points[[i], :]
+        L_eu_dist = np.linalg.norm(L_keyps - each_anchor_point, axis=1)
+        R_eu_dist = np.linalg.norm(R_keyps - each_anchor_point, axis=1)
+        all_anchors_degree_list.append(L_eu_dist / (R_eu_dist + 0.00001))
+    return np.array(all_anchors_degree_list).flatten()
+
+
+def iterative_workflow_loop(data):
+    # Reference: the per-frame implementation that FeatureExtractor._iterative_workflow() replaced
+    features_all_frames = []
+    upper_tri_indices = np.triu_indices(n=25, k=1)
+    for data_each_frame in data:
+        pair_dist = pairwise.pairwise_distances(data_each_frame, metric='euclidean')
+        only_relative_dist = pair_dist[upper_tri_indices[0], upper_tri_indices[1]]
+        features_all_frames.append(np.append(only_relative_dist, asymmetry_measure_loop(data_each_frame)))
+    features_all_frames_np = np.array(features_all_frames)
+    return np.append(np.mean(features_all_frames_np, axis=0), np.std(features_all_frames_np, axis=0))
+
+
+def random_sequences(num_cases, seed=0):
+    rng = np.random.RandomState(seed)
+    for case in range(num_cases):
+        num_frames = rng.randint(1, 400)
+        data = rng.uniform(0, 1, size=(num_frames, 25, 2)) * (250 if case % 2 else 1)
+        if case % 3 == 0:
+            # Coincident keypoints, as after the mean imputation of missing keypoints
+            data[:, rng.choice(25, size=5, replace=False), :] = data[:, [0], :]
+        yield data
+
+
+def test_asymmetry_measure_equals_loop():
+    extractor = FeatureExtractor(data_dir="", save_dir="")
+    for data in random_sequences(10):
+        asymmetry = extractor._asymmetry_measure(data)
+        assert asymmetry.shape == (data.shape[0], 33)
+        for frame_idx in range(data.shape[0]):
+            np.testing.assert_allclose(asymmetry[frame_idx], asymmetry_measure_loop(data[frame_idx]), rtol=1e-12)
+
+
+def test_iterative_workflow_equals_loop():
+    extractor = FeatureExtractor(data_dir="", save_dir="")
+    for data in random_sequences(30):
+        features = extractor._iterative_workflow(data)
+        features_ref = iterative_workflow_loop(data)
+        assert features.shape == (666,)
+        # The per-frame features are float32, and sklearn's dot-product expansion leaves ~1e-6 of noise on the
+        # distances between coincident keypoints
+        np.testing.assert_allclose(features, features_ref, rtol=1e-5, atol=1e-5 * np.max(np.abs(data)))
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("torch")  # common.utils
+
+from common.generator import GaitGeneratorFromDFforTemporalVAE
+
+
+def complete_gaitprint_loop(data_gen, df, rng):
+    # Reference: the per-patient loop that GaitGeneratorFromDFforTemporalVAE._complete_gaitprint() replaced
+    id_nan_mask = df["idpatients"].isnull() == False
+    current_uni_ids = np.unique(df[id_nan_mask]["idpatients"])
+    indexes_to_add = []
+    sum_uni_ids_with_pheno = 0
+    for uni_id in current_uni_ids:
+        df_patient_tasks = data_gen.df_nonan[data_gen.df_nonan["idpatients"] == uni_id]["tasks"]
+        grand_id_tasks = np.unique(df_patient_tasks)
+        uni_id_tasks = np.unique(df[(df["idpatients"] == uni_id)]["tasks"])
+        for grand_id_tasks_each in grand_id_tasks:
+            if grand_id_tasks_each not in uni_id_tasks:
+                add_indexes = df_patient_tasks[df_patient_tasks == grand_id_tasks_each].index
+                if add_indexes.shape[0] == 0:
+                    continue
+                indexes_to_add += list(rng.choice(add_indexes, size=1))
+        if list(df[(df["idpatients"] == uni_id)]["pheno_masks"])[0] == True:
+            sum_uni_ids_with_pheno += 1
+    df = pd.concat([df, data_gen.df_nonan.loc[indexes_to_add]], axis=0)
+    return df, sum_uni_ids_with_pheno
+
+
+def make_gaitprint_generator(num_rows, num_patients, seed):
+    # Only the state used by the gait print completion: the training rows, with patient indexes 0..num_patients-1
+    rng = np.random.RandomState(seed)
+    df_train = pd.DataFrame({
+        "idpatients": rng.randint(0, num_patients, size=num_rows).astype(float),
+        "tasks": rng.choice([0, 1, 2, 4, 7], size=num_rows),
+        "task_masks": rng.uniform(size=num_rows) > 0.2,
+        "pheno_masks": rng.uniform(size=num_rows) > 0.5,
+    }, index=rng.permutation(num_rows * 3)[0:num_rows])
+    df_train.loc[rng.uniform(size=num_rows) < 0.1, "idpatients"] = np.nan
+    # The last patient has only unlabelled tasks, hence no rows in df_nonan
+    df_train.loc[df_train["idpatients"] == num_patients - 1, "task_masks"] = False
+
+    data_gen = object.__new__(GaitGeneratorFromDFforTemporalVAE)
+    data_gen.df_train, data_gen.num_uni_patients = df_train, num_patients
+    data_gen.df_nonan = data_gen._construct_filtered_df()
+    data_gen.gaitprint_index = data_gen._construct_gaitprint_index()
+    return data_gen
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_complete_gaitprint_equals_loop(seed):
+    data_gen = make_gaitprint_generator(num_rows=400, num_patients=12, seed=seed)
+    batch_rng = np.random.RandomState(100 + seed)
+    num_complete, num_completed = 0, 0
+    for batch_size in [1, 5, 32, 128, 400]:
+        batch_df = data_gen.df_train.iloc[batch_rng.permutation(400)[0:batch_size]]
+        if batch_size == 400:
+            # Every patient already has all its tasks: nothing to append, no random draws
+            batch_df = pd.concat([batch_df, data_gen.df_nonan])
+
+        completed_df, num_pheno = data_gen._complete_gaitprint(batch_df.copy(), np.random.RandomState(seed))
+        rng_ref = np.random.RandomState(seed)
+        completed_df_ref, num_pheno_ref = complete_gaitprint_loop(data_gen, batch_df.copy(), rng_ref)
+        rng = np.random.RandomState(seed)
+        data_gen._complete_gaitprint(batch_df.copy(), rng)
+
+        pd.testing.assert_frame_equal(completed_df, completed_df_ref)
+        assert num_pheno == num_pheno_ref
+        assert rng.randint(1 << 30) == rng_ref.randint(1 << 30)  # The same random stream was consumed
+        num_complete += completed_df.shape[0] == batch_df.shape[0]
+        num_completed += completed_df.shape[0] > batch_df.shape[0]
+    assert num_complete >= 1 and num_completed >= 3
@@ -0,0 +1,184 @@
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")  # common.utils
+
+from common.generator import GaitGeneratorFromDF, GaitGeneratorFromDFforTemporalVAE, PrefetchIterator
+from common import utils
+from common.utils import write_df_pickle, write_feature_store, pin_numpy_arrays, pack_motion_masks, unpack_motion_masks
+
+
+def make_features_df(num_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    num_frames = rng.randint(130, 400, size=num_rows)
+    df = pd.DataFrame({"vid_name_roots": ["vid{}".format(i) for i in range(num_rows)]})
+    df["features"] = [rng.uniform(0, 1, size=(n, 25, 2)).astype(np.float32) for n in num_frames]
+    df["feature_masks"] = [np.repeat(rng.uniform(size=(n, 25, 1)) > 0.1, 2, axis=2) for n in num_frames]
+    df["tasks"], df["task_masks"] = rng.randint(0, 8, size=num_rows), np.arange(num_rows) % 2 == 0
+    df["phenos"], df["pheno_masks"] = rng.randint(0, 13, size=num_rows), rng.uniform(size=num_rows) > 0.5
+    df["idpatients"] = rng.randint(0, 10, size=num_rows).astype(float)
+    df["towards_camera"] = rng.randint(0, 3, size=num_rows)
+    df["leg"], df["leg_masks"] = rng.uniform(size=num_rows), rng.uniform(size=num_rows) > 0.2
+    df["num_frames"], df["fut_avail_mask"] = num_frames, num_frames > 128 + 32
+    return df
+
+
+def loop_for_array_construction(data_gen, df, num_samples):
+    # Reference: the per-sample loop that GaitGeneratorFromDFforTemporalVAE._loop_for_array_construction() replaced
+    fea_vec, fea_mask_vec = list(df["features"].iloc[0:num_samples]), list(df["feature_masks"].iloc[0:num_samples])
+    fut_avail_mask = np.asarray(df["fut_avail_mask"].iloc[0:num_samples], dtype=bool)
+    x_end_idx, y_end_idx = data_gen.keyps_x_dims, data_gen.keyps_x_dims + data_gen.keyps_y_dims
+    features_arr = np.zeros((num_samples, data_gen.total_fea_dims, data_gen.n))
+    fea_masks_arr = np.zeros(features_arr.shape, dtype=bool)
+    fut_features_arr = np.zeros((num_samples, data_gen.total_fea_dims, data_gen.fut_dim))
+    fut_fea_masks_arr = np.zeros(fut_features_arr.shape, dtype=bool)
+    for i in range(num_samples):
+        fut_dim = data_gen.fut_dim if fut_avail_mask[i] else 0
+        slice_start = np.random.choice(fea_vec[i].shape[0] - data_gen.n - fut_dim)
+        windows = [(slice(slice_start, slice_start + data_gen.n), features_arr, fea_masks_arr)]
+        if fut_avail_mask[i]:
+            windows.append((slice(slice_start + data_gen.n, slice_start + data_gen.n + data_gen.fut_dim),
+                            fut_features_arr, fut_fea_masks_arr))
+        for frames, out_features, out_masks in windows:
+            fea_vec_sliced, fea_mask_vec_sliced = fea_vec[i][frames, :, :], fea_mask_vec[i][frames, :, :]
+            out_features[i, 0:x_end_idx, :] = fea_vec_sliced[:, :, 0].T
+            out_features[i, x_end_idx:y_end_idx, :] = fea_vec_sliced[:, :, 1].T
+            out_masks[i, 0:x_end_idx, :] = fea_mask_vec_sliced[:, :, 0].T
+            out_masks[i, x_end_idx:y_end_idx, :] = fea_mask_vec_sliced[:, :, 1].T
+    return features_arr, fea_masks_arr, fut_features_arr, fut_fea_masks_arr
+
+
+@pytest.mark.parametrize("store_format", ["npz", "pickle"])
+def test_gathered_windows_equal_loop(tmp_path, store_format):
+    df = make_features_df(60)
+    store_path = str(tmp_path / "features.{}".format(store_format))
+    if store_format == "npz":
+        write_feature_store(df, store_path)
+    else:
+        write_df_pickle(df, store_path)
+    data_gen = GaitGeneratorFromDFforTemporalVAE(store_path, m=16, n=128, seed=3)
+
+    for seed, batch_df in enumerate([data_gen.df_train, data_gen.df_test]):
+        np.random.seed(seed)
+        x_info, fut_info, *_ = data_gen._loop_for_array_construction(batch_df, batch_df.shape[0])
+        next_draw = np.random.randint(1 << 30)
+        np.random.seed(seed)
+        features_ref, masks_ref, fut_features_ref, fut_masks_ref = loop_for_array_construction(
+            data_gen, batch_df, batch_df.shape[0])
+        next_draw_ref = np.random.randint(1 << 30)
+
+        assert x_info[0].dtype == np.float32
+        np.testing.assert_array_equal(x_info[0], features_ref)
+        np.testing.assert_array_equal(x_info[1], masks_ref)
+        np.testing.assert_array_equal(fut_info[0], fut_features_ref)
+        np.testing.assert_array_equal(fut_info[1], fut_masks_ref)
+        assert next_draw == next_draw_ref  # Both consumed the global random state alike
+
+
+@pytest.mark.parametrize("kwargs, eval_size", [({}, 4), ({"eval_size": 10}, 10)])
+def test_eval_batch_size(tmp_path, kwargs, eval_size):
+    store_path = str(tmp_path / "features.npz")
+    write_feature_store(make_features_df(60), store_path)
+    # 4 test samples by default, as before the evaluation batch was split out of the training batches
+    data_gen = GaitGeneratorFromDFforTemporalVAE(store_path, m=16, n=128, seed=3, **kwargs)
+    features_test, masks_test, *_ = data_gen.eval_data()
+    assert features_test.shape == masks_test.shape == (eval_size, 50, 128)
+    assert data_gen.eval_data()[0] is features_test  # Drawn once
+
+
+def flatten_batch(batch):
+    if isinstance(batch, (tuple, list)):
+        return [arr for item in batch for arr in flatten_batch(item)]
+    return [np.asarray(batch)]
+
+
+@pytest.mark.parametrize("num_workers", [1, 2, 3])
+def test_prefetched_batches_equal_serial(tmp_path, num_workers):
+    store_path = str(tmp_path / "features.npz")
+    write_feature_store(make_features_df(120), store_path)
+
+    def epochs(num_workers):
+        data_gen = GaitGeneratorFromDFforTemporalVAE(store_path, m=8, n=128, seed=3, gait_print=True)
+        prefetcher = PrefetchIterator(data_gen, num_workers=num_workers, seed=5, pin_memory=False)
+        return [[flatten_batch(batch) for batch in prefetcher.iterator()] for _ in range(2)]
+
+    serial_epochs, prefetched_epochs = epochs(0), epochs(num_workers)
+    assert len(serial_epochs[0]) > num_workers
+    for serial_batches, prefetched_batches in zip(serial_epochs, prefetched_epochs):
+        assert len(serial_batches) == len(prefetched_batches)
+        for serial_batch, prefetched_batch in zip(serial_batches, prefetched_batches):
+            for arr, arr_ref in zip(prefetched_batch, serial_batch):
+                np.testing.assert_array_equal(arr, arr_ref)
+    # Another epoch has other draws
+    assert not np.array_equal(serial_epochs[0][0][0], serial_epochs[1][0][0])
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="pinned memory needs CUDA")
+def test_pinned_arrays_are_float32():
+    features, masks = np.random.uniform(size=(64, 50, 128)), np.random.uniform(size=(64, 50, 128)) > 0.5
+    pinned_features, pinned_masks = pin_numpy_arrays((features, masks))
+    assert pinned_features.dtype == np.float32 and pinned_masks.dtype == bool
+    assert torch.from_numpy(pinned_features).is_pinned() and torch.from_numpy(pinned_masks).is_pinned()
+    np.testing.assert_array_equal(pinned_features, features.astype(np.float32))
+    np.testing.assert_array_equal(pinned_masks, masks)
+
+
+@pytest.mark.parametrize("seq_len", [128, 7])
+def test_motion_masks_roundtrip(seq_len):
+    keypoints_masks = np.random.RandomState(0).uniform(size=(16, 25, seq_len)) > 0.3
+    masks = np.concatenate([keypoints_masks, keypoints_masks], axis=1)  # x and y share the keypoint's mask
+    packed = pack_motion_masks(masks)
+    assert packed.dtype == np.uint8 and packed.shape == (16, 25, (seq_len + 7) // 8)
+    np.testing.assert_array_equal(unpack_motion_masks(packed, seq_len), masks)
+    # Dense 0/1 masks of the outputs saved before the packing
+    np.testing.assert_array_equal(unpack_motion_masks(masks.astype(np.float64), seq_len), masks)
+
+
+def test_base_iterator_yields_train_and_test_batches(tmp_path):
+    store_path = str(tmp_path / "features.npz")
+    write_feature_store(make_features_df(60), store_path)
+    data_gen = GaitGeneratorFromDF(store_path, m=8, n=128, train_portion=0.8, seed=3)
+    batches = list(data_gen.iterator())
+    assert len(batches) == 5
+    for (output_arr, output_arr_test), times in batches:
+        assert output_arr.shape == output_arr_test.shape == (8, 128, 75)
+        assert times.shape == (128,)
+    eval_arr, _ = data_gen.eval_data()
+    assert eval_arr.shape == (8, 128, 75) and data_gen.eval_data()[0] is eval_arr
+
+
+class FakeCompletedEvent:
+    def record(self):
+        pass
+
+    def query(self):
+        return True
+
+
+class FakePinnedTensor:
+    def __init__(self):
+        self.copies = []
+
+    def is_pinned(self):
+        return True
+
+    def to(self, device, non_blocking=False):
+        self.copies.append((device, non_blocking))
+        return "device tensor"
+
+
+def test_host_to_device_drains_completed_copies(monkeypatch):
+    # Copies that complete before query() (or earlier ones) must be released without emptying the queue past its end
+    fake_torch = SimpleNamespace(device=lambda device: SimpleNamespace(type="cuda"),
+                                 cuda=SimpleNamespace(Event=FakeCompletedEvent))
+    monkeypatch.setattr(utils, "torch", fake_torch)
+    monkeypatch.setattr(utils, "_pending_host_copies", deque())
+    host_tensors = [FakePinnedTensor() for _ in range(3)]
+    for host_tensor in host_tensors:
+        assert utils._host_to_device(host_tensor, "cuda:0") == "device tensor"
+        assert host_tensor.copies == [("cuda:0", True)]
+        assert len(utils._pending_host_copies) == 0
@@ -0,0 +1,87 @@
+import json
+import os
+from glob import glob
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")  # common.utils
+
+from common.utils import read_openpose_pose_keypoints, openpose_frame_index, pack_openpose_keypoints, \
+    read_openpose_keypoints_archive, read_and_select_openpose_keypoints
+
+
+def openpose_person(rng, person_id=-1):
+    # Keys and array lengths of OpenPose's BODY_25 output with face and hands
+    def keypoints(num):
+        arr = np.round(rng.uniform(0, 1000, size=(num, 3)), 3)
+        arr[:, 2] = np.round(rng.uniform(0, 1, size=num), 6)
+        arr[rng.uniform(size=num) < 0.2] = 0
+        return [float(x) if x != int(x) else int(x) for x in arr.reshape(-1)]
+
+    return {"person_id": [person_id], "pose_keypoints_2d": keypoints(25), "face_keypoints_2d": keypoints(70),
+            "hand_left_keypoints_2d": keypoints(21), "hand_right_keypoints_2d": keypoints(21),
+            "pose_keypoints_3d": [], "face_keypoints_3d": [], "hand_left_keypoints_3d": [],
+            "hand_right_keypoints_3d": []}
+
+
+def json_load_keypoints(json_path):
+    # The json module based reading, as the reference
+    with open(json_path, "r") as fh:
+        people = json.load(fh)["people"]
+    return np.asarray([person["pose_keypoints_2d"] for person in people], dtype=float).reshape(len(people), 25, 3)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_pose_keypoints_equal_json_load(tmp_path, seed):
+    rng = np.random.RandomState(seed)
+    num_people = seed % 5  # Including frames without anybody
+    data = {"version": 1.3, "people": [openpose_person(rng) for _ in range(num_people)]}
+    json_path = str(tmp_path / "vid_{:012d}_keypoints.json".format(seed * 7))
+    with open(json_path, "w") as fh:
+        json.dump(data, fh, indent=4 if seed % 2 else None)
+
+    people_keypoints, num_people_read, frame_idx = read_openpose_pose_keypoints(json_path)
+    expected = json_load_keypoints(json_path)
+    assert people_keypoints.shape == expected.shape == (num_people, 25, 3)
+    np.testing.assert_array_equal(people_keypoints, expected)
+    assert num_people_read == num_people
+    assert frame_idx == seed * 7
+
+
+def test_number_formats(tmp_path):
+    # Exponents, negative zero and integers, as written by various json encoders
+    tokens = ["1e-05", "2.5E+2", "-0.0", "0", "12"] + ["{:.3f}".format(x) for x in np.linspace(0, 999, 70)]
+    text = '{"version":1.3,"people":[{"person_id":[-1],"face_keypoints_2d":[1,2,3],"pose_keypoints_2d":[%s]}]}' % (
+        ",".join(tokens))
+    json_path = str(tmp_path / "vid_000000000000_keypoints.json")
+    with open(json_path, "w") as fh:
+        fh.write(text)
+    np.testing.assert_array_equal(read_openpose_pose_keypoints(json_path)[0], json_load_keypoints(json_path))
+
+
+def test_frame_index_from_file_name():
+    assert openpose_frame_index("/data/some_video_name_000000000042_keypoints.json") == 42
+
+
+def test_packed_archive_selects_as_json(tmp_path):
+    rng = np.random.RandomState(0)
+    json_dir, archive_dir = tmp_path / "vid", tmp_path / "archives"
+    json_dir.mkdir()
+    archive_dir.mkdir()
+    frame_indices = [0, 1, 2, 4, 5]
+    for frame_idx in frame_indices:
+        data = {"version": 1.3, "people": [openpose_person(rng) for _ in range(frame_idx % 3)]}
+        with open(str(json_dir / "vid_{:012d}_keypoints.json".format(frame_idx)), "w") as fh:
+            json.dump(data, fh)
+    archive_path = str(archive_dir / "vid.npz")
+    pack_openpose_keypoints(str(json_dir), archive_path)
+    # Only the archive is seen by the globs over the archive directory, without the temporary file
+    assert glob(str(archive_dir / "*")) == [archive_path] and os.listdir(str(archive_dir)) == ["vid.npz"]
+
+    archive = read_openpose_keypoints_archive(archive_path)
+    np.testing.assert_array_equal(archive[2], frame_indices)
+    for frame_idx in frame_indices:
+        json_path = str(json_dir / "vid_{:012d}_keypoints.json".format(frame_idx))
+        np.testing.assert_allclose(read_and_select_openpose_keypoints(None, frame_idx, archive=archive),
+                                   read_and_select_openpose_keypoints(json_path), rtol=1e-6)
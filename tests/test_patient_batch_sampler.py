@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("torch")  # common.utils
+
+from common.generator import GaitGeneratorFromDFforTemporalVAE, PatientBatchSampler
+
+
+def make_sampler(patient_labels, patient_num_tasks, **sampler_kwargs):
+    """
+    Sampler built on training rows of the given patients: patient p has the phenotype label patient_labels[p] (-1 for
+    no label) and the tasks 0..patient_num_tasks[p]-1, with one or two rows each.
+    """
+    rng = np.random.RandomState(0)
+    rows = []
+    for patient, (label, num_tasks) in enumerate(zip(patient_labels, patient_num_tasks)):
+        for task in range(num_tasks):
+            for _ in range(rng.randint(1, 3)):
+                rows.append({"idpatients": float(patient), "tasks": task, "task_masks": True,
+                             "phenos": max(label, 0), "pheno_masks": label >= 0})
+    df_train = pd.DataFrame(rows).sample(frac=1, random_state=0)
+    data_gen = object.__new__(GaitGeneratorFromDFforTemporalVAE)
+    data_gen.df_train, data_gen.num_uni_patients = df_train, len(patient_labels)
+    data_gen.df_nonan = data_gen._construct_filtered_df()
+    data_gen.gaitprint_index = data_gen._construct_gaitprint_index()
+    sampler = PatientBatchSampler(**sampler_kwargs)
+    sampler.build(data_gen.df_nonan, data_gen.gaitprint_index)
+    return sampler, data_gen.df_nonan
+
+
+def batches_of(sampler, df_nonan, num_batches, seed):
+    rows = sampler.sample(num_batches, np.random.RandomState(seed))
+    assert rows.shape == (num_batches * sampler.batch_size, )
+    return [df_nonan.iloc[batch_rows] for batch_rows in rows.reshape(num_batches, sampler.batch_size)]
+
+
+# 30 patients: labels 0 (12 patients), 1 (9), 2 (3) and unlabelled (6); some with fewer tasks than tasks_per_patient
+patient_labels = [0] * 12 + [1] * 9 + [2] * 3 + [-1] * 6
+patient_num_tasks = [8, 3, 1, 8, 5] * 6
+
+
+@pytest.mark.parametrize("strategy", PatientBatchSampler.strategies)
+def test_batches_have_fixed_size_and_tasks_per_patient(strategy):
+    sampler, df_nonan = make_sampler(patient_labels, patient_num_tasks, num_patients=6, tasks_per_patient=4,
+                                     strategy=strategy)
+    assert sampler.batch_size == 24
+    for batch in batches_of(sampler, df_nonan, num_batches=50, seed=0):
+        # Enough patients: each is drawn at most once per batch, with tasks_per_patient rows
+        rows_per_patient = batch["idpatients"].value_counts()
+        assert rows_per_patient.shape[0] == 6 and np.all(rows_per_patient == 4)
+        for patient, patient_rows in batch.groupby("idpatients"):
+            num_tasks = patient_num_tasks[int(patient)]
+            num_distinct_tasks = patient_rows["tasks"].nunique()
+            # Tasks without replacement first, then refilled with replacement from the patient's own tasks
+            assert num_distinct_tasks == min(num_tasks, 4)
+            assert patient_rows["tasks"].max() < num_tasks
+
+
+def test_pheno_stratified_quotas_use_largest_remainder():
+    # Labels with 6, 3 and 1 patients and 5 patients per batch: one per label, then the remaining 2 in proportion
+    # (1.2, 0.6, 0.2), i.e. 1 for the largest label by the integer part and 1 for the second by the largest remainder
+    sampler, df_nonan = make_sampler([0] * 6 + [1] * 3 + [2], [8] * 10, num_patients=5, tasks_per_patient=2,
+                                     strategy="pheno_stratified")
+    np.testing.assert_array_equal(sampler.label_values, [0, 1, 2])
+    np.testing.assert_array_equal(sampler.label_quotas, [2, 2, 1])
+    for batch in batches_of(sampler, df_nonan, num_batches=20, seed=1):
+        patients = batch.drop_duplicates("idpatients")
+        np.testing.assert_array_equal(patients["phenos"].value_counts().sort_index(), [2, 2, 1])
+
+
+@pytest.mark.parametrize("num_patients", [1, 3, 4, 7, 30, 45])
+def test_pheno_stratified_quotas_sum_to_num_patients(num_patients):
+    sampler, df_nonan = make_sampler(patient_labels, patient_num_tasks, num_patients=num_patients,
+                                     tasks_per_patient=3, strategy="pheno_stratified")
+    assert sampler.label_quotas.sum() == num_patients
+    if num_patients >= sampler.label_values.shape[0]:
+        assert np.all(sampler.label_quotas >= 1)
+    label_of_patient = dict(zip(range(len(patient_labels)), patient_labels))
+    for batch in batches_of(sampler, df_nonan, num_batches=10, seed=2):
+        # Patients may repeat within a label whose quota exceeds its number of patients
+        slot_labels = [label_of_patient[int(patient)] for patient in batch["idpatients"].to_numpy()[::3]]
+        label_counts = [slot_labels.count(label) for label in sampler.label_values]
+        np.testing.assert_array_equal(label_counts, sampler.label_quotas)
+
+
+def test_label_balanced_replacement():
+    # Without replacement if there are enough patients, with replacement otherwise
+    sampler, df_nonan = make_sampler(patient_labels, patient_num_tasks, num_patients=30, tasks_per_patient=1,
+                                     strategy="label_balanced")
+    for batch in batches_of(sampler, df_nonan, num_batches=10, seed=3):
+        assert batch["idpatients"].nunique() == 30
+    sampler, df_nonan = make_sampler(patient_labels, patient_num_tasks, num_patients=40, tasks_per_patient=1,
+                                     strategy="label_balanced")
+    for batch in batches_of(sampler, df_nonan, num_batches=10, seed=3):
+        assert batch.shape[0] == 40 and batch["idpatients"].nunique() <= 30
+
+    # Each label (the unlabelled patients as one more) is about equally likely
+    sampler, df_nonan = make_sampler(patient_labels, patient_num_tasks, num_patients=2, tasks_per_patient=1,
+                                     strategy="label_balanced")
+    rows = sampler.sample(2000, np.random.RandomState(4))
+    labels = np.where(df_nonan["pheno_masks"].to_numpy()[rows], df_nonan["phenos"].to_numpy()[rows], -1)
+    np.testing.assert_allclose(np.unique(labels, return_counts=True)[1] / rows.shape[0], 0.25, atol=0.03)
+
+
+@pytest.mark.parametrize("strategy", PatientBatchSampler.strategies)
+def test_sampling_is_reproducible(strategy):
+    sampler, _ = make_sampler(patient_labels, patient_num_tasks, num_patients=6, tasks_per_patient=4,
+                              strategy=strategy)
+    rows = sampler.sample(5, np.random.RandomState(7))
+    np.testing.assert_array_equal(sampler.sample(5, np.random.RandomState(7)), rows)
+    assert not np.array_equal(sampler.sample(5, np.random.RandomState(8)), rows)
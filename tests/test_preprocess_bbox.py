@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pytest
+
+for module_name in ("torch", "skvideo.io", "skimage.transform", "matplotlib.pyplot"):
+    pytest.importorskip(module_name)
+
+from common import preprocess
+from common.preprocess import OpenposePreprocessor, find_torso_length_from_keyps, find_torso_lengths_from_keyps, \
+    fill_missing_centres, ffmpeg_crop_commands, render_cropped_video_ffmpeg
+from common.utils import OnlineFilter_scalar, OnlineFilter_np
+
+
+def make_keypoints(num_frames, seed):
+    rng = np.random.RandomState(seed)
+    base = rng.uniform([150, 100], [450, 300], size=(1, 25, 2))
+    drift = np.cumsum(rng.normal(0, 3, size=(num_frames, 1, 2)), axis=0)
+    xy = base + drift + rng.normal(0, 2, size=(num_frames, 25, 2))
+    conf = rng.uniform(0, 1, size=(num_frames, 25, 1))
+    conf[rng.uniform(size=conf.shape) < 0.1] = 0
+    # Ears missing in some frames, one or both
+    conf[rng.uniform(size=num_frames) < 0.3, 17, 0] = 0
+    conf[rng.uniform(size=num_frames) < 0.3, 18, 0] = 0
+    return np.concatenate([xy, conf], axis=2)
+
+
+def make_preprocessor(keyps, vid_w, vid_h=480):
+    # Only the state used by the bounding box computation, without a video or OpenPose files
+    preprocessor = object.__new__(OpenposePreprocessor)
+    preprocessor.selected_keyps = keyps.copy()
+    preprocessor.num_frames, preprocessor.vid_h, preprocessor.vid_w = keyps.shape[0], vid_h, vid_w
+    preprocessor.cut_padding, preprocessor.cut_video_size = 0, (250, 250)
+    preprocessor.keyps_confidence_threshold = -0.2
+    preprocessor.box_length_filter = OnlineFilter_scalar(kernel_size=15)
+    preprocessor.keypoints_filter = OnlineFilter_np(input_size=(25, 2), kernel_size=3)
+    preprocessor.vreader = preprocessor.vwriter = None
+    preprocessor.selected_centres_smooth = keyps[:, :, 0:2].mean(axis=1)
+    preprocessor.start_idx, preprocessor.end_idx = 3, keyps.shape[0] - 5
+    return preprocessor
+
+
+def per_frame_keypoints_and_records(preprocessor):
+    # The frame-by-frame path of OpenposePreprocessor.preprocess(render_mode="serial")
+    all_keypoints, all_records = [], []
+    for frame_idx in range(preprocessor.start_idx, preprocessor.end_idx + 1):
+        vid_frame = np.zeros((preprocessor.vid_h, preprocessor.vid_w, 3))
+        _, keypoints, records, _, _ = preprocessor._find_video_clipping_area(vid_frame, frame_idx)
+        keypoints[:, [0, 1]] = preprocessor.keypoints_filter.add(keypoints[:, [0, 1]])
+        all_keypoints.append(keypoints)
+        all_records.append(records)
+    return np.asarray(all_keypoints), all_records
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_torso_lengths_equal_per_frame(seed):
+    keyps = make_keypoints(300, seed)
+    per_frame = np.array([find_torso_length_from_keyps(frame_keyps, 3)[0] for frame_keyps in keyps])
+    np.testing.assert_array_equal(find_torso_lengths_from_keyps(keyps, 3)[0], per_frame)
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_batched_boxes_equal_per_frame(seed):
+    # Narrow videos make the boxes cross the frame boundary and be clamped
+    vid_w = 300 if seed % 2 == 0 else 640
+    keyps = make_keypoints(300, seed)
+    expected_keypoints, expected_records = per_frame_keypoints_and_records(make_preprocessor(keyps, vid_w))
+    all_keypoints, all_records = make_preprocessor(keyps, vid_w)._transform_all_keypoints()
+
+    np.testing.assert_allclose(all_keypoints, expected_keypoints, rtol=0, atol=1e-9)
+    assert len(all_records) == len(expected_records)
+    for records, expected in zip(all_records, expected_records):
+        np.testing.assert_array_equal(records["translation"], expected["translation"])
+        assert records["translation"].shape == expected["translation"].shape
+        np.testing.assert_array_equal(records["bbox"], expected["bbox"])
+        assert records["resizing"] == expected["resizing"]
+
+
+@pytest.mark.parametrize("num_empty", [1, 20])
+def test_leading_frames_without_torso_take_full_frame(num_empty):
+    # No keypoints (hence no torso length) in the first frames of the extracted duration
+    vid_w, vid_h = 640, 480
+    keyps = make_keypoints(100, seed=num_empty)
+    keyps[3:3 + num_empty] = 0
+    expected_keypoints, expected_records = per_frame_keypoints_and_records(make_preprocessor(keyps, vid_w, vid_h))
+    all_keypoints, all_records = make_preprocessor(keyps, vid_w, vid_h)._transform_all_keypoints()
+
+    np.testing.assert_allclose(all_keypoints, expected_keypoints, rtol=0, atol=1e-9)
+    for frame_idx, (records, expected) in enumerate(zip(all_records, expected_records)):
+        np.testing.assert_array_equal(records["bbox"], expected["bbox"])
+        assert records["resizing"] == expected["resizing"]
+        if frame_idx < num_empty:
+            # Square box of the frame height, inside the frame
+            assert np.all(records["bbox"][0:2] >= 0) and np.all(records["bbox"][2:4] <= [vid_w, vid_h])
+            assert records["bbox"][3] - records["bbox"][1] == vid_h and records["bbox"][2] - records["bbox"][0] == vid_h
+            assert records["resizing"] == 250 / vid_h
+    assert np.all(np.isnan(all_keypoints[0:num_empty]))
+
+
+def test_fill_missing_centres():
+    centres = np.array([[np.nan, np.nan], [np.nan, 5.0], [10.0, 20.0], [np.nan, np.nan], [30.0, 40.0], [np.inf, 1.0]])
+    np.testing.assert_array_equal(fill_missing_centres(centres, 640, 480),
+                                  [[320, 240], [320, 240], [10, 20], [10, 20], [30, 40], [30, 40]])
+
+
+def test_ffmpeg_crop_commands():
+    # Inside the frame, clipped at the top-left corner, and clipped at the bottom-right corner
+    bboxes = np.array([[10, 20, 110, 220], [-5, 0, 50, 300], [600, 470, 700, 500]])
+    crop_areas, commands = ffmpeg_crop_commands(bboxes, 640, 480)
+    np.testing.assert_array_equal(crop_areas, [[100, 200, 10, 20], [50, 300, 0, 0], [40, 10, 600, 470]])
+    assert commands == ("0.0 crop@box w 100, crop@box h 200, crop@box x 10, crop@box y 20;\n"
+                        "0.5 crop@box w 50, crop@box h 300, crop@box x 0, crop@box y 0;\n"
+                        "1.5 crop@box w 40, crop@box h 10, crop@box x 600, crop@box y 470;\n")
+
+
+def test_render_cropped_video_ffmpeg_filters(monkeypatch):
+    calls = []
+
+    def fake_run(args, **kwargs):
+        commands_path = args[args.index("-vf") + 1].split("sendcmd=f=")[1].split(",")[0]
+        with open(commands_path, "r") as fh:
+            calls.append((args, commands_path, fh.read()))
+
+    monkeypatch.setattr(preprocess.subprocess, "run", fake_run)
+    bboxes = np.array([[10, 20, 110, 220], [12, 22, 112, 222], [14, 24, 114, 224]])
+    render_cropped_video_ffmpeg("in.mp4", "out.mp4", 7, bboxes, 640, 480, (250, 200), ffmpeg_path="ffmpeg")
+
+    (args, commands_path, commands), = calls
+    assert args[:6] == ["ffmpeg", "-y", "-loglevel", "error", "-i", "in.mp4"] and args[-1] == "out.mp4"
+    # The frames 7 to 9, with the frame index from the start frame as timestamp in seconds for the sendcmd script
+    assert args[args.index("-vf") + 1].split(",") == [
+        "trim=start_frame=7:end_frame=10", "setpts=N/TB", "format=rgb24", "sendcmd=f={}".format(commands_path),
+        "crop@box=w=100:h=200:x=10:y=20", "scale=200:250:flags=area", "setpts=N/FRAME_RATE/TB", "format=yuv420p"]
+    assert commands == ffmpeg_crop_commands(bboxes, 640, 480)[1]
+    assert commands.splitlines()[2].startswith("1.5 ")
+    assert not os.path.exists(commands_path)  # The script is removed afterwards
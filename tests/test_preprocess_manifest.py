@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import pytest
+
+for module_name in ("torch", "skvideo.io", "skimage.transform", "matplotlib.pyplot"):
+    pytest.importorskip(module_name)
+
+from common import preprocess
+from common.preprocess import (save_data_openpose, is_manifest_entry_up_to_date, is_adoptable_keypoints_output,
+                               read_preprocess_manifest, output_file_stat, file_sha1, _preprocess_single_video,
+                               default_manifest_path, OpenposePreprocessor)
+
+
+def write_output(path, num_frames=10, video_size=(250, 250)):
+    keypoints = np.random.RandomState(0).uniform(0, 250, size=(num_frames, 25, 3))
+    save_data_openpose(path, video_size, (0, num_frames - 1), list(keypoints))
+
+
+def done_entry(path):
+    entry = {"video": "vid", "status": "done", "input_fingerprint": "in", "params_hash": "params",
+             "output_sha1": file_sha1(path)}
+    entry.update(output_file_stat(path))
+    return entry
+
+
+def test_up_to_date_output_is_not_hashed(tmp_path, monkeypatch):
+    path = str(tmp_path / "vid.npz")
+    write_output(path)
+    entry = done_entry(path)
+
+    def fail_hash(file_path):
+        raise AssertionError("hashed")
+
+    monkeypatch.setattr(preprocess, "file_sha1", fail_hash)
+    assert is_manifest_entry_up_to_date(entry, "in", "params", path)
+    assert not is_manifest_entry_up_to_date(entry, "in", "other params", path)
+
+    # A different size is stale without hashing
+    write_output(path, num_frames=11)
+    assert not is_manifest_entry_up_to_date(entry, "in", "params", path)
+
+
+def test_touched_output_is_checked_by_hash(tmp_path):
+    path = str(tmp_path / "vid.npz")
+    write_output(path)
+    entry = done_entry(path)
+    os.utime(path, ns=(entry["output_mtime_ns"] + 10 ** 9, entry["output_mtime_ns"] + 10 ** 9))
+    assert is_manifest_entry_up_to_date(entry, "in", "params", path)
+
+    # Same size, different content
+    with open(path, "r+b") as fh:
+        fh.seek(200)
+        byte = fh.read(1)
+        fh.seek(200)
+        fh.write(bytes([byte[0] ^ 0xFF]))
+    assert not is_manifest_entry_up_to_date(entry, "in", "params", path)
+
+
+def test_adoptable_output(tmp_path):
+    params = OpenposePreprocessor.preprocess_params()
+    path = str(tmp_path / "vid.npz")
+    write_output(path)
+    assert is_adoptable_keypoints_output(path, params)
+
+    # Other output size
+    write_output(path, video_size=(128, 128))
+    assert not is_adoptable_keypoints_output(path, params)
+
+    # Older format, without the format version
+    np.savez(path, positions_2d=np.zeros((10, 25, 3)))
+    assert not is_adoptable_keypoints_output(path, params)
+
+    # Truncated
+    write_output(path)
+    with open(path, "r+b") as fh:
+        fh.truncate(os.path.getsize(path) // 2)
+    assert not is_adoptable_keypoints_output(path, params)
+
+
+def test_default_manifest_is_outside_output_dir(tmp_path):
+    output_data_dir = str(tmp_path / "output")
+    manifest_path = default_manifest_path(output_data_dir + os.sep)
+    assert os.path.dirname(manifest_path) == str(tmp_path)
+    assert manifest_path == default_manifest_path(output_data_dir)
+
+
+@pytest.fixture
+def video_dirs(tmp_path):
+    keyps_dir = tmp_path / "keypoints" / "vid"
+    keyps_dir.mkdir(parents=True)
+    (keyps_dir / "vid_000000000000_keypoints.json").write_text('{"people": []}')
+    output_data_dir = tmp_path / "output"
+    output_data_dir.mkdir()
+    return str(keyps_dir), str(tmp_path), str(output_data_dir), str(tmp_path / "manifest.jsonl")
+
+
+def test_existing_output_is_adopted_without_manifest_entry(video_dirs):
+    keyps_dir, vid_dir, output_data_dir, manifest_path = video_dirs
+    write_output(os.path.join(output_data_dir, "vid.npz"))
+
+    processed = _preprocess_single_video(keyps_dir, vid_dir, vid_dir, output_data_dir, plot_keypoints=False,
+                                         write_video=False, manifest_path=manifest_path, manifest_entry=None,
+                                         adopt_existing_outputs=True)
+    assert not processed
+    entry = read_preprocess_manifest(manifest_path)["vid"]
+    assert entry["status"] == "done" and entry["adopted"]
+
+    # The adopted entry makes the next run skip the video by its size and modification time
+    processed = _preprocess_single_video(keyps_dir, vid_dir, vid_dir, output_data_dir, plot_keypoints=False,
+                                         write_video=False, manifest_path=manifest_path, manifest_entry=entry)
+    assert not processed
+
+
+@pytest.mark.parametrize("adopt_existing_outputs, truncated", [(False, False), (True, True)])
+def test_output_is_reprocessed_unless_adopted(video_dirs, adopt_existing_outputs, truncated):
+    keyps_dir, vid_dir, output_data_dir, manifest_path = video_dirs
+    output_path = os.path.join(output_data_dir, "vid.npz")
+    write_output(output_path)
+    if truncated:
+        with open(output_path, "r+b") as fh:
+            fh.truncate(os.path.getsize(output_path) // 2)
+
+    # Reprocessed, which fails here since there is no video
+    with pytest.raises(Exception):
+        _preprocess_single_video(keyps_dir, vid_dir, vid_dir, output_data_dir, plot_keypoints=False,
+                                 write_video=False, manifest_path=manifest_path, manifest_entry=None,
+                                 adopt_existing_outputs=adopt_existing_outputs)
+    assert read_preprocess_manifest(manifest_path)["vid"]["status"] == "failed"
+
+
+def test_video_is_moved_to_output_path_when_finalized(tmp_path):
+    class Writer:
+        def __init__(self, path):
+            self.path = path
+
+        def writeFrame(self, frame):
+            with open(self.path, "ab") as fh:
+                fh.write(b"frame")
+
+        def close(self):
+            pass
+
+    manager = object.__new__(preprocess.VideoManager)
+    manager.output_video_path = str(tmp_path / "vid.mp4")
+    manager.output_video_tmp_path = str(tmp_path / "vid.tmp.mp4")
+    manager.vreader, manager.vwriter = None, Writer(manager.output_video_tmp_path)
+    manager.vwriter.writeFrame(None)
+    assert not os.path.isfile(manager.output_video_path)
+    manager.finalize_output_video()
+    assert os.listdir(str(tmp_path)) == ["vid.mp4"]
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")  # common.utils
+
+from common.utils import extract_contagious, run_length_encoding, moving_average
+
+
+def extract_contagious_loop(binary_train, max_neigh):
+    # Reference: the frame-by-frame implementation that extract_contagious() replaced
+    contagious_arr = np.zeros(binary_train.shape)
+    group_arr = np.zeros(binary_train.shape)
+    filtered_binary_arr = np.zeros(binary_train.shape)
+    for i in range(binary_train.shape[0]):
+        if binary_train[i] == 1:
+            if i == 0:
+                contagious_arr[i] = 1
+            else:
+                contagious_arr[i] = contagious_arr[i - 1] + 1
+        else:
+            contagious_arr[i] = 0
+    focus = contagious_arr[-1]
+    for i in reversed(range(binary_train.shape[0])):
+        if contagious_arr[i] == 0:
+            if i != 0:
+                focus = contagious_arr[i - 1]
+            else:
+                focus = contagious_arr[i]
+        else:
+            group_arr[i] = focus
+    filtered_binary_arr[(group_arr <= max_neigh) & (group_arr > 0)] = 1
+    return filtered_binary_arr, (contagious_arr, group_arr)
+
+
+def random_binary_trains(num_cases, seed=0):
+    rng = np.random.RandomState(seed)
+    yield np.ones(1)
+    yield np.zeros(1)
+    yield np.ones(17)
+    yield np.zeros(17)
+    for _ in range(num_cases):
+        # Runs of random lengths, including values other than 0 and 1, which count as 0
+        num_frames = rng.randint(1, 300)
+        p_one = rng.uniform(0.05, 0.95)
+        run_lengths = rng.geometric(rng.uniform(0.05, 0.9), size=num_frames)
+        run_values = np.where(rng.uniform(size=num_frames) < p_one, 1, rng.choice([0, 2], size=num_frames))
+        yield np.repeat(run_values, run_lengths)[:num_frames].astype(float)
+
+
+@pytest.mark.parametrize("max_neigh", [0, 1, 3, 10, 1000])
+def test_extract_contagious_equals_loop(max_neigh):
+    for binary_train in random_binary_trains(200, seed=max_neigh):
+        filtered, (contagious, group) = extract_contagious(binary_train, max_neigh)
+        filtered_ref, (contagious_ref, group_ref) = extract_contagious_loop(binary_train, max_neigh)
+        np.testing.assert_array_equal(filtered, filtered_ref)
+        np.testing.assert_array_equal(contagious, contagious_ref)
+        np.testing.assert_array_equal(group, group_ref)
+
+
+def test_run_length_encoding_properties():
+    assert all(arr.shape[0] == 0 for arr in run_length_encoding(np.zeros(0)))
+    for arr in random_binary_trains(200):
+        starts, lengths, values = run_length_encoding(arr)
+        # Runs reconstruct the array, cover it contiguously, and neighbouring runs differ
+        np.testing.assert_array_equal(np.repeat(values, lengths), arr)
+        assert starts[0] == 0 and np.all(lengths > 0)
+        np.testing.assert_array_equal(starts[1:], np.cumsum(lengths)[:-1])
+        assert np.all(values[1:] != values[:-1])
+
+
+def find_extracted_duration_loop(confidences_filtered, threshold):
+    # Reference: the forward/backward loop that OpenposePreprocessor._find_extracted_duration() replaced
+    num_frames = confidences_filtered.shape[0]
+    start_idx, end_idx = None, None
+    for i in range(num_frames - 1):
+        reverse_i = num_frames - 1 - i
+        if (confidences_filtered[i] > threshold) and (start_idx is None):
+            start_idx = i
+        if (confidences_filtered[reverse_i] > threshold) and (end_idx is None):
+            end_idx = reverse_i
+    return start_idx, end_idx
+
+
+def test_extracted_duration_bounds_equal_loop():
+    for module_name in ("skvideo.io", "skimage.transform", "matplotlib.pyplot"):
+        pytest.importorskip(module_name)
+    from common.preprocess import OpenposePreprocessor
+
+    rng = np.random.RandomState(0)
+    num_compared = 0
+    for case in range(200):
+        num_frames = rng.randint(2, 400)
+        confidences = np.repeat(rng.uniform(-25, 0, size=num_frames), rng.randint(1, 30, size=num_frames))[:num_frames]
+        preprocessor = object.__new__(OpenposePreprocessor)
+        preprocessor.keyps_confidences, preprocessor.num_frames = confidences, num_frames
+        preprocessor.keyps_confidence_threshold, preprocessor.min_segment_length = -10, 1
+        preprocessor.op_data_each_video_dir = "case{}".format(case)
+
+        start_ref, end_ref = find_extracted_duration_loop(moving_average(confidences, 5), -10)
+        if start_ref is None or end_ref is None:
+            # The loop leaves the bounds unset (and skips the last/first frame), the vectorised version raises only
+            # if no frame at all passes
+            continue
+        preprocessor._find_extracted_duration()
+        assert (preprocessor.start_idx, preprocessor.end_idx) == (start_ref, end_ref)
+        # The segments are the runs of frames above the threshold
+        above = moving_average(confidences, 5) > -10
+        in_segments = np.zeros(num_frames, dtype=bool)
+        for start, end in preprocessor.segments:
+            in_segments[start:end + 1] = True
+        np.testing.assert_array_equal(in_segments, above)
+        num_compared += 1
+    assert num_compared > 50
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")  # common.utils
+
+from common.utils import select_people_keypoints, pad_people_keypoints, _people_centres, _select_rightmost
+
+
+def select_closest_loop(people_keyps, people_mask):
+    # Reference: the frame-by-frame recurrence of the "closest" rule, before the frames with a single candidate were
+    # selected at once
+    centres = _people_centres(people_keyps)
+    person_indices = _select_rightmost(people_keyps, people_mask)
+    previous_centre = None
+    for frame_idx in range(people_keyps.shape[0]):
+        if previous_centre is not None:
+            dists = np.linalg.norm(centres[frame_idx] - previous_centre, axis=1)
+            dists[~(people_mask[frame_idx] & np.isfinite(dists))] = np.inf
+            if np.isfinite(dists).any():
+                person_indices[frame_idx] = np.argmin(dists)
+        if np.isfinite(centres[frame_idx, person_indices[frame_idx]]).all() and people_mask[frame_idx].any():
+            previous_centre = centres[frame_idx, person_indices[frame_idx]]
+    return person_indices
+
+
+def random_people_keypoints(num_frames, max_people, rng):
+    people_keypoints_list = []
+    for _ in range(num_frames):
+        num_people = rng.randint(0, max_people + 1)
+        keyps = np.concatenate([rng.uniform(0, 640, size=(num_people, 25, 2)),
+                                rng.uniform(0, 1, size=(num_people, 25, 1))], axis=2)
+        # People without any confident keypoint have no centre
+        keyps[rng.uniform(size=num_people) < 0.2, :, 2] = 0
+        people_keypoints_list.append(keyps)
+    return pad_people_keypoints(people_keypoints_list)
+
+
+@pytest.mark.parametrize("max_people", [1, 2, 4])
+def test_closest_rule_equals_loop(max_people):
+    rng = np.random.RandomState(max_people)
+    for num_frames in [1, 2, 5, 50, 300]:
+        for _ in range(5):
+            people_keyps, people_mask = random_people_keypoints(num_frames, max_people, rng)
+            selected_keyps, person_indices = select_people_keypoints(people_keyps, people_mask, rule="closest")
+            expected_keyps, expected_indices = select_people_keypoints(people_keyps, people_mask,
+                                                                       rule=select_closest_loop)
+            np.testing.assert_array_equal(person_indices, expected_indices)
+            np.testing.assert_array_equal(selected_keyps, expected_keyps)